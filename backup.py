@@ -0,0 +1,278 @@
+"""
+Online backups of the school databases.
+
+:func:`backup` copies a live database with SQLite's backup API. The copy is
+made in batches of ``pages`` pages with a pause between batches; the source
+is only locked while a batch is copied, so the apps keep reading and writing
+during a backup. If the source is written to by another connection, SQLite
+restarts the copy so the result is always a consistent snapshot; under
+steady writes it might never finish. After ``MAX_RESTARTS`` restarts or
+``MAX_SECONDS`` of copying, the backup falls back to copying everything in a
+single step: that holds a read lock for the whole copy, which blocks writers
+only in rollback-journal mode (in WAL mode they carry on), but it is
+guaranteed to finish.
+
+Each copy is written to a ``.partial`` file, checked with
+``PRAGMA integrity_check`` and only then renamed into place. The newest
+``keep`` generations are kept. A :class:`BackupScheduler` repeats this on a
+background thread.
+
+Scheduled backups are enabled by ``SCHOOL_BACKUP_DIR`` (see
+:func:`start_from_env`); one-off backups can be made with::
+
+    python backup.py school_management.db backups --keep 5
+"""
+import argparse
+import glob
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger("backup")
+
+# Pages copied per step and pause between steps.
+PAGES = 256
+PAUSE = 0.005
+KEEP = 5
+# Limits of the throttled copy before falling back to a single step.
+MAX_RESTARTS = 10
+MAX_SECONDS = 60.0
+
+
+class BackupError(Exception):
+    """Raised when a copy fails its integrity check."""
+
+
+class _Throttled(Exception):
+    """Aborts a throttled copy that keeps restarting."""
+
+
+def _read_only(path):
+    # Path.as_uri() percent-encodes '#', '?' and '%' and handles drive letters.
+    return sqlite3.connect(pathlib.Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+
+
+class BackupResult:
+    """
+    Outcome of one backup.
+
+    :param path: Path of the verified copy.
+    :param pages: Number of pages copied.
+    :param page_size: Page size of the database in bytes.
+    :param seconds: Wall-clock time of the copy and the check.
+    :param steps: Number of backup steps, i.e. times the source was locked.
+    """
+
+    def __init__(self, path, pages, page_size, seconds, steps):
+        self.path = path
+        self.pages = pages
+        self.page_size = page_size
+        self.seconds = seconds
+        self.steps = steps
+
+    @property
+    def bytes(self):
+        return self.pages * self.page_size
+
+    @property
+    def throughput(self):
+        """Copied bytes per second."""
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.path}: {self.bytes / 1e6:.1f} MB in {self.seconds:.2f} s "
+                f"({self.throughput / 1e6:.1f} MB/s, {self.steps} steps)")
+
+
+def _generation_name(source, dest_dir):
+    base = os.path.splitext(os.path.basename(source))[0]
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+    return os.path.join(dest_dir, f"{base}-{stamp}.db")
+
+
+def generations(source, dest_dir):
+    """
+    Lists the backups of ``source`` in ``dest_dir``, oldest first.
+
+    :param source: Path of the backed-up database.
+    :param dest_dir: Directory holding the backups.
+    :return: A list of paths.
+    """
+    base = os.path.splitext(os.path.basename(source))[0]
+    return sorted(glob.glob(os.path.join(glob.escape(dest_dir), f"{base}-*.db")))
+
+
+def rotate(source, dest_dir, keep=KEEP):
+    """
+    Deletes all but the newest ``keep`` backups of ``source``.
+
+    :return: The deleted paths.
+    """
+    old = generations(source, dest_dir)[:-keep] if keep > 0 else []
+    for path in old:
+        os.remove(path)
+    return old
+
+
+def verify(path):
+    """
+    Runs ``PRAGMA integrity_check`` on a database file.
+
+    :param path: Path of the file to check.
+    :raises BackupError: If the check reports any problem.
+    """
+    conn = _read_only(path)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+    if problems != ["ok"]:
+        raise BackupError(f"{path} failed the integrity check: {'; '.join(problems[:5])}")
+
+
+def backup(source, dest_dir, keep=KEEP, pages=PAGES, pause=PAUSE):
+    """
+    Copies a live database into a new, verified generation in ``dest_dir``.
+
+    :param source: Path of the database to back up.
+    :param dest_dir: Directory for the backups; created if missing.
+    :param keep: Number of generations to keep.
+    :param pages: Pages copied per step.
+    :param pause: Seconds to sleep between steps so writers can get in.
+    :return: A :class:`BackupResult`.
+    :raises FileNotFoundError: If ``source`` does not exist.
+    :raises BackupError: If the copy fails its integrity check.
+    """
+    if not os.path.isfile(source):
+        raise FileNotFoundError(f"no database at {source}")
+    database = os.path.basename(source)
+    os.makedirs(dest_dir, exist_ok=True)
+    dest = _generation_name(source, dest_dir)
+    partial = dest + ".partial"
+    steps = 0
+    restarts = 0
+    previous = None
+
+    def progress(status, remaining, total):
+        nonlocal steps, restarts, previous
+        steps += 1
+        # The remaining page count only goes up when a write restarted the copy.
+        if previous is not None and remaining > previous:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _Throttled
+        previous = remaining
+        if time.perf_counter() - start > MAX_SECONDS:
+            raise _Throttled
+        if remaining:
+            time.sleep(pause)
+
+    start = time.perf_counter()
+    try:
+        src = _read_only(source)
+        try:
+            dst = sqlite3.connect(partial)
+            try:
+                try:
+                    src.backup(dst, pages=pages, progress=progress)
+                except _Throttled:
+                    logger.warning("backup of %s restarted %d times in %.1f s, copying in one step",
+                                   source, restarts, time.perf_counter() - start)
+                    src.backup(dst)
+                    steps += 1
+                page_count = dst.execute("PRAGMA page_count").fetchone()[0]
+                page_size = dst.execute("PRAGMA page_size").fetchone()[0]
+            finally:
+                dst.close()
+        finally:
+            src.close()
+        verify(partial)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        metrics.inc("school_backups_total", database=database, result="failed")
+        raise
+    os.replace(partial, dest)
+    result = BackupResult(dest, page_count, page_size, time.perf_counter() - start, steps)
+
+    for path in rotate(source, dest_dir, keep):
+        logger.info("removed old backup %s", path)
+    logger.info("backup %s", result)
+    metrics.inc("school_backups_total", database=database, result="ok")
+    metrics.observe("school_backup_seconds", result.seconds, database=database)
+    metrics.set_gauge("school_backup_bytes_per_second", result.throughput, database=database)
+    return result
+
+
+class BackupScheduler:
+    """
+    Backs up a database every ``interval`` seconds on a daemon thread.
+
+    :param source: Path of the database to back up.
+    :param dest_dir: Directory for the backups.
+    :param interval: Seconds between backups; the first one runs immediately.
+    :param keep: Number of generations to keep.
+    """
+
+    def __init__(self, source, dest_dir, interval=3600.0, keep=KEEP):
+        self.source = source
+        self.dest_dir = dest_dir
+        self.interval = interval
+        self.keep = keep
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="backup-scheduler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.last_result = backup(self.source, self.dest_dir, self.keep)
+            except (sqlite3.Error, OSError, BackupError):
+                logger.exception("backup of %s failed", self.source)
+            self._stop.wait(self.interval)
+
+
+def start_from_env(source):
+    """
+    Starts scheduled backups of ``source`` if ``SCHOOL_BACKUP_DIR`` is set.
+
+    ``SCHOOL_BACKUP_INTERVAL`` (seconds, default 3600) and ``SCHOOL_BACKUP_KEEP``
+    (default 5) tune the schedule.
+
+    :param source: Path of the database to back up.
+    :return: The running :class:`BackupScheduler`, or None.
+    """
+    dest_dir = os.environ.get("SCHOOL_BACKUP_DIR")
+    if not dest_dir:
+        return None
+    return BackupScheduler(source, dest_dir,
+                           interval=float(os.environ.get("SCHOOL_BACKUP_INTERVAL", "3600")),
+                           keep=int(os.environ.get("SCHOOL_BACKUP_KEEP", str(KEEP)))).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up a school database while it is in use.")
+    parser.add_argument("database")
+    parser.add_argument("dest_dir", nargs="?", default="backups")
+    parser.add_argument("--keep", type=int, default=KEEP)
+    parser.add_argument("--pages", type=int, default=PAGES, help="pages copied per step")
+    parser.add_argument("--pause", type=float, default=PAUSE, help="seconds between steps")
+    args = parser.parse_args()
+    print(backup(args.database, args.dest_dir, args.keep, args.pages, args.pause))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Counts lost updates of concurrent editors, without and with version checks.
+
+``--editors`` threads each repeatedly open a random one of ``--records``
+students, think for ``--think-ms`` and save the student with its age raised
+by one, through their own :class:`repository.SqliteRepository`. Without
+version checks a save can overwrite one made while the editor was thinking,
+and the ages add up to fewer than the saves. With them such a save is
+refused with :class:`repository.StaleRecordError` and the editor starts over
+from the current record, as after "Load theirs" in the edit dialogs::
+
+    python bench_edits.py --editors 8 --records 20
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import db_mmb78
+import repository
+
+
+def setup(path, records):
+    db_mmb78.configure(path)
+    db_mmb78.create_tables()
+    repo = repository.SqliteRepository(path, "enrollments")
+    repo.add_many("students", [(f"S{i}", f"Student {i}", 0, f"s{i}@school.edu") for i in range(records)])
+    repo.close()
+
+
+def editor(path, records, edits, think, checked, results, seed):
+    rng = random.Random(seed)
+    repo = repository.SqliteRepository(path, "enrollments")
+    saved = conflicts = 0
+    for _ in range(edits):
+        student_id = f"S{rng.randrange(records)}"
+        while True:
+            version = repo.version("students", student_id) if checked else None
+            row = repo.get("students", student_id)
+            time.sleep(think)
+            try:
+                repo.update("students", row[:2] + (row[2] + 1,) + row[3:], version)
+            except repository.StaleRecordError:
+                conflicts += 1
+                continue
+            saved += 1
+            break
+    repo.close()
+    results.append((saved, conflicts))
+
+
+def run(path, args, checked):
+    results = []
+    threads = [threading.Thread(target=editor, args=(path, args.records, args.edits, args.think_ms / 1000,
+                                                     checked, results, seed))
+               for seed in range(args.editors)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    repo = repository.SqliteRepository(path, "enrollments")
+    total = sum(row[2] for row in repo.list("students"))
+    repo.close()
+    saved = sum(result[0] for result in results)
+    conflicts = sum(result[1] for result in results)
+    name = "version-checked" if checked else "unchecked"
+    print(f"{name:16s} {saved} saves, {saved - total} lost, {conflicts} conflicts, {seconds:.2f} s")
+    return saved - total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--editors", type=int, default=8)
+    parser.add_argument("--records", type=int, default=20)
+    parser.add_argument("--edits", type=int, default=50, help="saves per editor")
+    parser.add_argument("--think-ms", type=float, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for checked in (False, True):
+            path = os.path.join(tmp, f"edits-{checked}.db")
+            setup(path, args.records)
+            lost = run(path, args, checked)
+        assert lost == 0, "version-checked saves lost updates"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Times exam scheduling on a large generated enrollment.
+
+Creates a database in a temporary directory with ``--courses`` courses of
+skewed popularity and ``--enrollments`` enrollments of ``--per-student``
+courses each, builds the co-enrollment graph, colors it and checks that no
+two courses sharing a student got the same slot. With ``--slots`` the number
+of slots is limited and the clashes it causes are counted::
+
+    python bench_exams.py --courses 10000 --enrollments 1000000
+"""
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+
+import db
+import exams
+
+
+def setup(path, courses, students, per_student, seed=1):
+    """Creates the database with the courses and enrollments of the test."""
+    rng = random.Random(seed)
+    popularity = list(itertools.accumulate(1 / (i + 1) ** 0.7 for i in range(courses)))
+    db.configure(path)
+    db.create_tables()
+    conn = db.get_connection()
+    conn.execute("INSERT INTO instructors VALUES ('I0', 'Instructor', 40, 'i@school.edu')")
+    conn.executemany("INSERT INTO courses VALUES (?, ?, 'I0')", [(f"C{i}", f"Course {i}") for i in range(courses)])
+    conn.executemany("INSERT INTO students VALUES (?, ?, 20, ?)",
+                     [(f"S{i}", f"Student {i}", f"s{i}@school.edu") for i in range(students)])
+
+    def enrollments():
+        for i in range(students):
+            taken = set()
+            while len(taken) < per_student:
+                taken.add(rng.choices(range(courses), cum_weights=popularity)[0])
+            for course in taken:
+                yield f"S{i}", f"C{course}"
+
+    conn.executemany("INSERT INTO student_courses (student_id, course_id) VALUES (?, ?)", enrollments())
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--courses", type=int, default=10000)
+    parser.add_argument("--enrollments", type=int, default=1000000)
+    parser.add_argument("--per-student", type=int, default=5)
+    parser.add_argument("--slots", type=int, default=None)
+    args = parser.parse_args()
+    students = args.enrollments // args.per_student
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        setup(os.path.join(tmp, "exams.db"), args.courses, students, args.per_student)
+        print(f"{students * args.per_student} enrollments in {args.courses} courses "
+              f"created in {time.perf_counter() - start:.1f} s")
+
+        start = time.perf_counter()
+        graph = exams.CoEnrollmentGraph.from_db(db.get_connection(), "student_courses")
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        schedule = exams.assign_slots(graph, args.slots)
+        colored = time.perf_counter() - start
+        print(f"graph  {built:6.2f} s, {len(graph.neighbors) // 2} edges")
+        print(f"slots  {colored:6.2f} s, {schedule.slot_count} slots, {schedule.clashes} clashes")
+        print(f"total  {built + colored:6.2f} s")
+
+        clashes = 0
+        for course in range(len(graph)):
+            slot = schedule.slots[graph.courses[course]]
+            clashes += sum(weight for neighbor, weight in graph.edges(course)
+                           if schedule.slots[graph.courses[neighbor]] == slot)
+        assert clashes // 2 == schedule.clashes, (clashes // 2, schedule.clashes)
+        print("slots checked against every edge")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Times typo-tolerant name search on generated names.
+
+Builds a pool of first names and surnames, draws full names from it with a
+skewed distribution like real rosters, indexes them and searches for
+misspelled versions of random names, reporting how often the intended name
+is ranked first and in the top ten::
+
+    python bench_fuzzy.py --records 500000
+"""
+import argparse
+import random
+import time
+
+from fuzzy_index import FuzzyIndex
+
+CONSONANTS = "bcdfghjklmnprstvwyz"
+VOWELS = "aeiou"
+
+
+def make_pool(count, rng):
+    """Returns ``count`` distinct pronounceable words of two to four syllables."""
+    syllables = [rng.choice(CONSONANTS) + rng.choice(VOWELS) + rng.choice(["", "", rng.choice(CONSONANTS)])
+                 for _ in range(300)]
+    pool = set()
+    while len(pool) < count:
+        pool.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).title())
+    return sorted(pool)
+
+
+def make_names(count, seed=1):
+    """Returns ``count`` full names, some with a middle name."""
+    rng = random.Random(seed)
+    first = make_pool(5000, rng)
+    last = make_pool(60000, rng)
+    # Zipf-like weights: a few very common names and a long tail.
+    first_weights = [1 / (i + 1) for i in range(len(first))]
+    last_weights = [1 / (i + 1) ** 0.8 for i in range(len(last))]
+    firsts = rng.choices(first, first_weights, k=count)
+    lasts = rng.choices(last, last_weights, k=count)
+    middles = rng.choices(first, first_weights, k=count)
+    return [f"{f} {m} {l}" if rng.random() < 0.2 else f"{f} {l}"
+            for f, m, l in zip(firsts, middles, lasts)]
+
+
+def misspell(word, rng):
+    """Applies one random insertion, deletion, substitution or swap to ``word``."""
+    i = rng.randrange(1, len(word))
+    edit = rng.choice("idst")
+    letter = rng.choice(VOWELS + CONSONANTS)
+    if edit == "i":
+        return word[:i] + letter + word[i:]
+    if edit == "d":
+        return word[:i] + word[i + 1:]
+    if edit == "s":
+        return word[:i] + letter + word[i + 1:]
+    return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=500000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    names = make_names(args.records)
+    start = time.perf_counter()
+    index = FuzzyIndex()
+    for i, name in enumerate(names):
+        index.add(i, name)
+    print(f"indexed {len(names)} names in {time.perf_counter() - start:.1f} s")
+
+    rng = random.Random(2)
+    elapsed = 0.0
+    first = top_ten = 0
+    for _ in range(args.queries):
+        target = rng.randrange(len(names))
+        first_name, *_, last_name = names[target].split()
+        query = f"{misspell(first_name, rng)} {misspell(last_name, rng)}"
+        start = time.perf_counter()
+        found = index.search(query, limit=10)
+        elapsed += time.perf_counter() - start
+        # Another record with the same name is as good a hit.
+        hits = [names[key] for key in found]
+        first += bool(hits) and hits[0].split()[::len(hits[0].split()) - 1] == [first_name, last_name]
+        top_ten += any(hit.split()[::len(hit.split()) - 1] == [first_name, last_name] for hit in hits)
+
+    print(f"fuzzy search {elapsed / args.queries * 1000:8.2f} ms/query")
+    print(f"intended name first in {first / args.queries:.0%}, in the top ten in {top_ten / args.queries:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compares rewriting the JSON data file on every save with journaled saves.
+
+Fills ``school_data`` with ``--students`` students, ``--courses`` courses and
+their enrollments, then saves ``--saves`` times with one student edited in
+between: once writing the whole file each time, as ``save_data`` did, and
+once appending to the journal. Then times loading the snapshot with the
+journal replayed, and :func:`school_data.compact`::
+
+    python bench_journal.py --students 100000 --saves 50
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+import school_data
+from school_data import Student, Instructor, Course
+
+
+def build(students, courses):
+    rng = random.Random(1)
+    school_data.students[:] = [Student(f"Student {i}", 20, f"s{i}@school.edu", f"S{i}") for i in range(students)]
+    school_data.instructors[:] = [Instructor(f"Instructor {i}", 40, f"i{i}@school.edu", f"I{i}") for i in range(100)]
+    school_data.courses[:] = [Course(f"C{i}", f"Course {i}") for i in range(courses)]
+    for i, course in enumerate(school_data.courses):
+        course.instructor = school_data.instructors[i % 100]
+        course.enrolled_students = rng.sample(school_data.students, min(50, students))
+
+
+def full_save(path):
+    data = {kind: [school_data._entry(kind, record) for record in records]
+            for kind, records in school_data._records().items()}
+    with open(path, "w") as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def timed(name, saves, save):
+    rng = random.Random(2)
+    start = time.perf_counter()
+    for k in range(saves):
+        rng.choice(school_data.students).age = 20 + k % 10
+        save()
+    per_save = (time.perf_counter() - start) / saves
+    print(f"  {name:12s} {per_save * 1000:8.2f} ms per save")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--students", type=int, default=100000)
+    parser.add_argument("--courses", type=int, default=1000)
+    parser.add_argument("--saves", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data.json")
+        build(args.students, args.courses)
+        school_data.save_data(path)
+        print(f"{args.students} students, {os.path.getsize(path) / 1e6:.1f} MB")
+        timed("full file", args.saves, lambda: full_save(os.path.join(tmp, "full.json")))
+        timed("journal", args.saves, lambda: school_data.save_data(path))
+        print(f"  journal {os.path.getsize(path + '.log')} bytes")
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            school_data.load_data(path)
+            replayed = time.perf_counter() - start
+            start = time.perf_counter()
+            school_data.compact(path)
+            compacted = time.perf_counter() - start
+            start = time.perf_counter()
+            school_data.load_data(path)
+            loaded = time.perf_counter() - start
+        print(f"  load with journal {replayed:.2f} s, compact {compacted:.2f} s, load after {loaded:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Load test of course registration under contention.
+
+Creates a database in a temporary directory with a few popular courses of
+limited capacity, then lets ``--registrants`` students register at once from
+``--threads`` threads through ``db_mmb78.enroll_student``, each for several
+courses, most of them popular. Prints throughput and latency percentiles,
+then checks that no course went over capacity, that every attempt ended up
+enrolled or waitlisted exactly once and that drops promote the waitlist in
+arrival order::
+
+    python bench_registration.py --registrants 5000 --threads 32
+"""
+import argparse
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import db_mmb78
+import registration
+
+
+def setup(path, registrants, courses, capacity, wal):
+    """Creates the database with the students and courses of the test."""
+    db_mmb78.configure(path)
+    db_mmb78.create_tables()
+    conn = db_mmb78.connect()
+    if wal:
+        conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("INSERT INTO instructors VALUES ('I0', 'Instructor', 40, 'i@school.edu')")
+    conn.executemany("INSERT INTO students VALUES (?, ?, 20, ?)",
+                     [(f"S{i}", f"Student {i}", f"s{i}@school.edu") for i in range(registrants)])
+    conn.executemany("INSERT INTO courses VALUES (?, ?, 'I0')",
+                     [(f"C{i}", f"Course {i}") for i in range(courses)])
+    for i in range(courses):
+        registration.set_capacity(conn, f"C{i}", capacity)
+    conn.commit()
+    conn.close()
+
+
+def run(registrants, courses, per_student, threads, seed=1):
+    """
+    Registers every student for ``per_student`` courses from ``threads`` threads.
+
+    :return: ``(latencies, outcomes, errors, seconds)``.
+    """
+    rng = random.Random(seed)
+    # A few courses get most of the demand, like the ones everyone needs.
+    weights = [1 / (i + 1) for i in range(courses)]
+    attempts = queue.Queue()
+    for i in range(registrants):
+        picked = set()
+        while len(picked) < per_student:
+            picked.add(rng.choices(range(courses), weights)[0])
+        for course in picked:
+            attempts.put((f"S{i}", f"C{course}"))
+
+    latencies = []
+    outcomes = {}
+    errors = []
+    lock = threading.Lock()
+    start_gate = threading.Event()
+
+    def worker():
+        start_gate.wait()
+        while True:
+            try:
+                student_id, course_id = attempts.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            try:
+                result = db_mmb78.enroll_student(student_id, course_id)
+            except sqlite3.Error as e:
+                with lock:
+                    errors.append(repr(e))
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                outcomes[result.status] = outcomes.get(result.status, 0) + 1
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    started = time.perf_counter()
+    start_gate.set()
+    for thread in pool:
+        thread.join()
+    return latencies, outcomes, errors, time.perf_counter() - started
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def check(capacity, attempts):
+    """Asserts the capacity, exactly-once and promotion-order invariants."""
+    conn = db_mmb78.connect()
+    over = conn.execute("""
+        SELECT course_id, COUNT(*) FROM enrollments GROUP BY course_id HAVING COUNT(*) > ?
+    """, (capacity,)).fetchall()
+    assert not over, f"courses over capacity: {over}"
+    enrolled = conn.execute("SELECT COUNT(*), COUNT(DISTINCT student_id || '/' || course_id) FROM enrollments").fetchone()
+    assert enrolled[0] == enrolled[1], "duplicate enrollments"
+    waiting = conn.execute("SELECT COUNT(*) FROM waitlist").fetchone()[0]
+    assert enrolled[0] + waiting == attempts, f"{enrolled[0]} enrolled + {waiting} waiting != {attempts} attempts"
+    both = conn.execute("""
+        SELECT COUNT(*) FROM waitlist JOIN enrollments USING (student_id, course_id)
+    """).fetchone()[0]
+    assert not both, "students both enrolled and waitlisted"
+
+    course_id = conn.execute("SELECT course_id FROM waitlist GROUP BY course_id ORDER BY COUNT(*) DESC").fetchone()
+    conn.close()
+    if course_id is None:
+        return
+    course_id = course_id[0]
+    line = db_mmb78.get_waitlist(course_id)
+    seated = [student.student_id for student in db_mmb78.get_enrollments_for_course(course_id)]
+    dropped = min(3, len(line))
+    for student_id in seated[:dropped]:
+        db_mmb78.drop_student(student_id, course_id)
+    now_seated = {student.student_id for student in db_mmb78.get_enrollments_for_course(course_id)}
+    assert set(line[:dropped]) <= now_seated, "waitlist not promoted in order"
+    assert db_mmb78.get_waitlist(course_id) == line[dropped:], "waitlist order changed"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--registrants", type=int, default=5000)
+    parser.add_argument("--courses", type=int, default=40)
+    parser.add_argument("--per-student", type=int, default=4)
+    parser.add_argument("--capacity", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--wal", action="store_true", help="use write-ahead logging")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup(os.path.join(tmp, "registration.db"), args.registrants, args.courses, args.capacity, args.wal)
+        latencies, outcomes, errors, seconds = run(args.registrants, args.courses, args.per_student, args.threads)
+        print(f"{len(latencies)} registrations from {args.threads} threads in {seconds:.2f} s "
+              f"({len(latencies) / seconds:.0f}/s)")
+        print("latency  p50 {:.1f} ms  p99 {:.1f} ms  max {:.1f} ms".format(
+            *(1000 * value for value in (percentile(latencies, 0.5), percentile(latencies, 0.99), max(latencies)))))
+        print("outcomes", ", ".join(f"{status} {count}" for status, count in sorted(outcomes.items())))
+        if errors:
+            print(f"{len(errors)} errors, e.g. {errors[0]}")
+        check(args.capacity, len(latencies))
+        print("invariants ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Times reading courses with and without their relationships.
+
+Creates a ``db_mmb78`` database in a temporary directory and reads every
+course in three ways: names only, as the dropdowns do; with the enrolled
+students of each course read by ``get_enrollments_for_course`` (one query
+per course); and with ``course.enrolled_students`` loaded lazily, a batch of
+courses per query. Then times ``get_course_by_id`` with and without reading
+its instructor and students::
+
+    python bench_relations.py --courses 2000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import db_mmb78
+
+
+def setup(path, courses, students, per_student):
+    db_mmb78.configure(path)
+    db_mmb78.create_tables()
+    conn = db_mmb78.connect()
+    conn.executemany("INSERT INTO instructors VALUES (?, ?, 40, ?)",
+                     [(f"I{i}", f"Instructor {i}", f"i{i}@school.edu") for i in range(100)])
+    conn.executemany("INSERT INTO courses VALUES (?, ?, ?)",
+                     [(f"C{i}", f"Course {i}", f"I{i % 100}") for i in range(courses)])
+    conn.executemany("INSERT INTO students VALUES (?, ?, 20, ?)",
+                     [(f"S{i}", f"Student {i}", f"s{i}@school.edu") for i in range(students)])
+    rng = random.Random(1)
+    conn.executemany("INSERT OR IGNORE INTO enrollments (student_id, course_id) VALUES (?, ?)",
+                     [(f"S{i}", f"C{rng.randrange(courses)}") for i in range(students) for _ in range(per_student)])
+    conn.commit()
+    conn.close()
+
+
+def timed(name, call, repeat):
+    best = min(_once(call) for _ in range(repeat))
+    print(f"  {name:34s} {best * 1000:9.1f} ms")
+
+
+def _once(call):
+    start = time.perf_counter()
+    call()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--courses", type=int, default=2000)
+    parser.add_argument("--students", type=int, default=20000)
+    parser.add_argument("--per-student", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup(os.path.join(tmp, "school.db"), args.courses, args.students, args.per_student)
+        ids = [f"C{i}" for i in random.Random(2).sample(range(args.courses), min(200, args.courses))]
+        print(f"all {args.courses} courses")
+        timed("names", lambda: [course.course_name for course in db_mmb78.iter_courses()], args.repeat)
+        timed("students, query per course",
+              lambda: [db_mmb78.get_enrollments_for_course(course.course_id) for course in db_mmb78.iter_courses()],
+              args.repeat)
+        timed("students, lazy batches",
+              lambda: [course.enrolled_students for course in db_mmb78.iter_courses()], args.repeat)
+        print(f"get_course_by_id x {len(ids)}")
+        timed("name", lambda: [db_mmb78.get_course_by_id(i).course_name for i in ids], args.repeat)
+        timed("instructor and students",
+              lambda: [(course.instructor, course.enrolled_students)
+                       for course in map(db_mmb78.get_course_by_id, ids)], args.repeat)
+
+
+if __name__ == "__main__":
+    main()
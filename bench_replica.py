@@ -0,0 +1,112 @@
+"""
+Compares reads from the database file with reads from an in-memory replica.
+
+Creates a ``db``-schema database (``student_courses``) in a temporary
+directory and runs the reads of the PyQt app against a
+:class:`repository.SqliteRepository` and a
+:class:`repository.ReplicaRepository`: loading every tab as
+``display_records`` does, name searches, and record lookups. With
+``--writer``, another process commits an edit every few milliseconds
+meanwhile, as other apps do, and the replica syncs on every
+``REPLICA_SYNC_MS`` like the app's timer. Then times the replica's extra
+work: mirrored updates and a full sync::
+
+    python bench_replica.py --students 100000 --writer
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import db
+import repository
+
+
+def setup(path, students, courses):
+    db.configure(path)
+    db.create_tables()
+    db.close()
+    repo = repository.SqliteRepository(path, "student_courses")
+    with repo.transaction():
+        repo.add_many("instructors", [(f"I{i}", f"Instructor {i}", 40, f"i{i}@school.edu") for i in range(100)])
+        repo.add_many("courses", [(f"C{i}", f"Course {i}", f"I{i % 100}") for i in range(courses)])
+        repo.add_many("students", [(f"S{i}", f"Student {i}", 20, f"s{i}@school.edu") for i in range(students)])
+        rng = random.Random(1)
+        repo.enroll_many((f"S{i}", f"C{rng.randrange(courses)}") for i in range(students) for _ in range(3))
+    repo.close()
+
+
+def timed(name, calls, repo, sync):
+    """Runs the calls, syncing the replica on the app's interval; prints p50 and p99."""
+    latencies = []
+    last_sync = time.perf_counter()
+    for call in calls:
+        if sync and time.perf_counter() - last_sync > repository.REPLICA_SYNC_MS / 1000:
+            repo.sync()
+            last_sync = time.perf_counter()
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"  {name:18s} p50 {p50:8.3f} ms  p99 {p99:8.3f} ms")
+
+
+def writer(path, students, stop):
+    """Commits a student edit every 5 ms until ``stop`` is set."""
+    repo = repository.SqliteRepository(path, "student_courses")
+    rng = random.Random(3)
+    while not stop.is_set():
+        i = rng.randrange(students)
+        repo.update("students", (f"S{i}", f"Student {i}", rng.randrange(18, 30), f"s{i}@school.edu"))
+        time.sleep(0.005)
+    repo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--students", type=int, default=100000)
+    parser.add_argument("--courses", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=20, help="loads of every tab")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--writer", action="store_true", help="commit edits from another process meanwhile")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lab.db")
+        setup(path, args.students, args.courses)
+        rng = random.Random(2)
+        names = [f"Student {rng.randrange(args.students)}" for _ in range(args.lookups)]
+        ids = [f"S{rng.randrange(args.students)}" for _ in range(args.lookups)]
+
+        for cls in (repository.SqliteRepository, repository.ReplicaRepository):
+            start = time.perf_counter()
+            repo = cls(path, "student_courses")
+            print(f"{cls.__name__} (opened in {(time.perf_counter() - start) * 1000:.0f} ms)")
+            stop = multiprocessing.Event()
+            process = multiprocessing.Process(target=writer, args=(path, args.students, stop))
+            if args.writer:
+                process.start()
+            sync = cls is repository.ReplicaRepository
+            try:
+                timed("display_records", [lambda: [repo.list(kind) for kind in repository.KINDS]] * args.rounds,
+                      repo, sync)
+                timed("search", [lambda name=name: repo.search("students", name) for name in names[:200]],
+                      repo, sync)
+                timed("get", [lambda i=i: (repo.get("students", i), repo.courses_of(i)) for i in ids], repo, sync)
+                timed("update", [lambda i=i: repo.update("students", (i, "Renamed", 21, "r@school.edu"))
+                                 for i in ids[:200]], repo, False)
+                if sync:
+                    timed("sync (full copy)", [repo.reload] * 10, repo, False)
+            finally:
+                stop.set()
+                if args.writer:
+                    process.join()
+            repo.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Runs the same workload against every repository backend.
+
+Each backend starts empty in a temporary directory and goes through bulk
+loads, point reads, searches, single-record updates and a bulk delete. The
+time of each phase is printed per backend::
+
+    python bench_repository.py --students 20000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import repository
+
+
+def workload(repo, students, instructors, courses, enrollments, point_ops, seed=1):
+    """
+    Runs the benchmark workload on an empty repository.
+
+    :return: A list of ``(phase, seconds)``.
+    """
+    rng = random.Random(seed)
+    timings = []
+
+    def phase(name, func):
+        start = time.perf_counter()
+        func()
+        timings.append((name, time.perf_counter() - start))
+
+    student_ids = [f"S{i}" for i in range(students)]
+    course_ids = [f"C{i}" for i in range(courses)]
+
+    def bulk_load():
+        with repo.transaction():
+            repo.add_many("instructors", [(f"I{i}", f"Instructor {i}", 30 + i % 30, f"i{i}@school.edu")
+                                          for i in range(instructors)])
+            repo.add_many("courses", [(course_id, f"Course {course_id}", f"I{i % instructors}")
+                                      for i, course_id in enumerate(course_ids)])
+            repo.add_many("students", [(student_id, f"Student {student_id}", 18 + i % 10, f"{student_id}@school.edu")
+                                       for i, student_id in enumerate(student_ids)])
+            pairs = {(rng.choice(student_ids), rng.choice(course_ids)) for _ in range(enrollments)}
+            repo.enroll_many(sorted(pairs))
+
+    def point_reads():
+        for _ in range(point_ops):
+            repo.get("students", rng.choice(student_ids))
+            repo.enrolled_students(rng.choice(course_ids))
+
+    def searches():
+        for _ in range(max(point_ops // 20, 1)):
+            repo.search("students", str(rng.randrange(1000)))
+
+    def updates():
+        for _ in range(point_ops):
+            student_id = rng.choice(student_ids)
+            repo.update("students", (student_id, f"Renamed {student_id}", 20, f"{student_id}@school.edu"))
+
+    def bulk_delete():
+        repo.delete_many("students", student_ids[: students // 4])
+
+    phase("bulk load", bulk_load)
+    phase(f"{point_ops} point reads", point_reads)
+    phase("searches", searches)
+    phase(f"{point_ops} updates", updates)
+    phase("bulk delete 25%", bulk_delete)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--students", type=int, default=20000)
+    parser.add_argument("--instructors", type=int, default=200)
+    parser.add_argument("--courses", type=int, default=1000)
+    parser.add_argument("--enrollments", type=int, default=60000)
+    parser.add_argument("--point-ops", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            "memory": lambda: repository.MemoryRepository(),
+            "json": lambda: repository.JsonRepository(os.path.join(tmp, "bench.json")),
+            "sqlite": lambda: repository.SqliteRepository(os.path.join(tmp, "bench.db"), create=True),
+        }
+        results = {}
+        for name, factory in backends.items():
+            repo = factory()
+            try:
+                results[name] = workload(repo, args.students, args.instructors, args.courses,
+                                         args.enrollments, args.point_ops)
+            finally:
+                repo.close()
+
+    phases = [phase for phase, _ in next(iter(results.values()))]
+    print(f"{'phase':<22}" + "".join(f"{name:>12}" for name in results))
+    for i, phase in enumerate(phases):
+        print(f"{phase:<22}" + "".join(f"{results[name][i][1] * 1000:10.1f}ms" for name in results))
+
+
+if __name__ == "__main__":
+    main()
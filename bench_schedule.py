@@ -0,0 +1,100 @@
+"""
+Times schedule conflict checks on a large generated enrollment.
+
+Creates a database in a temporary directory whose courses meet twice a week
+in common time slots, enrolls every student in ``--per-student`` random
+courses without checking their schedules, then times single registration
+checks and the full conflict report, and compares a sample of the report with
+a brute-force check::
+
+    python bench_schedule.py --enrollments 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import db_mmb78
+import schedule
+from schedule import Meeting
+
+# Start times of the blocks of a teaching day, in minutes; some blocks are
+# longer and overlap the next one.
+STARTS = [8 * 60 + 90 * i for i in range(7)]
+
+
+def setup(path, courses, students, per_student, seed=1):
+    """Creates the database; returns the meetings of every course."""
+    rng = random.Random(seed)
+    db_mmb78.configure(path)
+    db_mmb78.create_tables()
+    conn = db_mmb78.connect()
+    conn.execute("INSERT INTO instructors VALUES ('I0', 'Instructor', 40, 'i@school.edu')")
+    conn.executemany("INSERT INTO courses VALUES (?, ?, 'I0')", [(f"C{i}", f"Course {i}") for i in range(courses)])
+    meetings = {}
+    for i in range(courses):
+        day = rng.randrange(3)
+        start = rng.choice(STARTS)
+        length = rng.choice([75, 75, 75, 110])
+        meetings[f"C{i}"] = [Meeting(day, start, start + length), Meeting(day + 2, start, start + length)]
+        schedule.set_meetings(conn, f"C{i}", meetings[f"C{i}"])
+    conn.executemany("INSERT INTO students VALUES (?, ?, 20, ?)",
+                     [(f"S{i}", f"Student {i}", f"s{i}@school.edu") for i in range(students)])
+    conn.executemany("INSERT INTO enrollments (student_id, course_id) VALUES (?, ?)",
+                     ((f"S{i}", f"C{course}") for i in range(students)
+                      for course in rng.sample(range(courses), per_student)))
+    conn.commit()
+    conn.close()
+    return meetings
+
+
+def brute_force(meetings, courses):
+    """Returns the overlapping pairs among ``courses`` by comparing every meeting."""
+    courses = sorted(courses)
+    return {(a, b) for i, a in enumerate(courses) for b in courses[i + 1:]
+            if any(x.day == y.day and x.start < y.end and y.start < x.end
+                   for x in meetings[a] for y in meetings[b])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--enrollments", type=int, default=1000000)
+    parser.add_argument("--courses", type=int, default=2000)
+    parser.add_argument("--per-student", type=int, default=5)
+    parser.add_argument("--checks", type=int, default=2000)
+    args = parser.parse_args()
+    students = args.enrollments // args.per_student
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        meetings = setup(os.path.join(tmp, "schedule.db"), args.courses, students, args.per_student)
+        print(f"{students * args.per_student} enrollments of {students} students in {args.courses} courses "
+              f"created in {time.perf_counter() - start:.1f} s")
+
+        rng = random.Random(2)
+        conn = db_mmb78.connect()
+        start = time.perf_counter()
+        for _ in range(args.checks):
+            schedule.conflicts(conn, f"S{rng.randrange(students)}", f"C{rng.randrange(args.courses)}")
+        elapsed = time.perf_counter() - start
+        print(f"single check   {elapsed / args.checks * 1000:8.3f} ms")
+
+        start = time.perf_counter()
+        found = {}
+        for conflict in schedule.conflict_report(conn):
+            found.setdefault(conflict.student_id, set()).add((conflict.course_id, conflict.other_course_id))
+        print(f"full report    {time.perf_counter() - start:8.2f} s, "
+              f"{sum(map(len, found.values()))} conflicts for {len(found)} students")
+
+        sampled = min(2000, students)
+        for student_id in rng.sample([f"S{i}" for i in range(students)], sampled):
+            enrolled = [row[0] for row in conn.execute("SELECT course_id FROM enrollments WHERE student_id = ?",
+                                                      (student_id,))]
+            assert found.get(student_id, set()) == brute_force(meetings, enrolled), student_id
+        conn.close()
+        print(f"report matches brute force on {sampled} students")
+
+
+if __name__ == "__main__":
+    main()
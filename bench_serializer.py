@@ -0,0 +1,80 @@
+"""
+Compares serializing a course catalog with to_dict/from_dict and with serializer.py.
+
+Builds an in-memory graph of ``--students`` students, each registered in
+``--per-student`` of ``--courses`` courses taught by ``--instructors``
+instructors, with both sides of every relationship set, and round-trips the
+catalog (every course) through JSON: as ``[course.to_dict() ...]`` read back
+with ``Course.from_dict``, and as one :func:`serializer.to_document` read back
+with :func:`serializer.from_document`. Prints the time of each direction, the
+size of the JSON and the number of student objects read back::
+
+    python bench_serializer.py --students 20000 --per-student 5
+"""
+import argparse
+import json
+import random
+import time
+
+import schedule
+import serializer
+from lab2_mmb78 import Student, Instructor, Course
+
+
+def build(students, courses, instructors, per_student):
+    rng = random.Random(1)
+    teachers = [Instructor(f"Instructor {i}", 40, f"i{i}@school.edu", f"I{i}") for i in range(instructors)]
+    catalog = []
+    for i in range(courses):
+        course = Course(f"C{i}", f"Course {i}", capacity=200,
+                        meetings=schedule.parse_meetings(f"Mon {8 + i % 10:02d}:00-{9 + i % 10:02d}:00"))
+        teachers[i % instructors].assign_course(course)
+        catalog.append(course)
+    for i in range(students):
+        student = Student(f"Student {i}", 20, f"s{i}@school.edu", f"S{i}")
+        for course in rng.sample(catalog, per_student):
+            student.register_course(course)
+            course.add_student(student)
+    return catalog
+
+
+def enrollments(courses):
+    return sorted((student.student_id, course.course_id) for course in courses for student in course.enrolled_students)
+
+
+def timed(call):
+    start = time.perf_counter()
+    result = call()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--students", type=int, default=20000)
+    parser.add_argument("--courses", type=int, default=1000)
+    parser.add_argument("--instructors", type=int, default=100)
+    parser.add_argument("--per-student", type=int, default=5)
+    args = parser.parse_args()
+
+    catalog = build(args.students, args.courses, args.instructors, args.per_student)
+    expected = enrollments(catalog)
+    print(f"{len(expected)} enrollments")
+
+    text, dump = timed(lambda: json.dumps([course.to_dict() for course in catalog]))
+    courses, read = timed(lambda: [Course.from_dict(data) for data in json.loads(text)])
+    copies = sum(len(course.enrolled_students) for course in courses)
+    print(f"  to_dict/from_dict  dump {dump:6.2f} s  load {read:6.2f} s  "
+          f"{len(text) / 1e6:6.1f} MB  {copies} student objects")
+    assert enrollments(courses) == expected
+
+    text, dump = timed(lambda: json.dumps(serializer.to_document(catalog), separators=(",", ":")))
+    graph, read = timed(lambda: serializer.from_document(json.loads(text)))
+    print(f"  serializer         dump {dump:6.2f} s  load {read:6.2f} s  "
+          f"{len(text) / 1e6:6.1f} MB  {len(graph.students)} student objects")
+    assert enrollments(graph.courses.values()) == expected
+    student = next(iter(graph.students.values()))
+    assert all(student in course.enrolled_students for course in student.registered_courses)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Compares saving course edits call by call with one unit-of-work commit.
+
+Each of ``--courses`` courses is renamed, and gets ``--add`` students
+enrolled and ``--drop`` dropped, once with ``update_course``,
+``enroll_student`` and ``drop_student`` (a connection and a transaction
+each) and once through a ``db_mmb78.session()`` committed at the end, and
+prints the time and the transactions of each::
+
+    python bench_session.py --courses 200
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import db_mmb78
+
+
+def setup(path, courses, students, per_course):
+    db_mmb78.configure(path)
+    db_mmb78.create_tables()
+    conn = db_mmb78.connect()
+    conn.execute("INSERT INTO instructors VALUES ('I0', 'Instructor', 40, 'i@school.edu')")
+    conn.executemany("INSERT INTO courses VALUES (?, ?, 'I0')", [(f"C{i}", f"Course {i}") for i in range(courses)])
+    conn.executemany("INSERT INTO students VALUES (?, ?, 20, ?)",
+                     [(f"S{i}", f"Student {i}", f"s{i}@school.edu") for i in range(students)])
+    rng = random.Random(1)
+    conn.executemany("INSERT INTO enrollments (student_id, course_id) VALUES (?, ?)",
+                     [(f"S{student}", f"C{i}") for i in range(courses)
+                      for student in rng.sample(range(students), per_course)])
+    conn.commit()
+    conn.close()
+
+
+def plan(courses, students, add, drop):
+    """Returns (course_id, new name, student IDs to add, student IDs to drop) per course."""
+    rng = random.Random(2)
+    edits = []
+    for i in range(courses):
+        enrolled = [row.student_id for row in db_mmb78.get_enrollments_for_course(f"C{i}")]
+        others = [f"S{s}" for s in rng.sample(range(students), add + len(enrolled)) if f"S{s}" not in enrolled]
+        edits.append((f"C{i}", f"Course {i} (renamed)", others[:add], rng.sample(enrolled, drop)))
+    return edits
+
+
+def call_by_call(edits):
+    transactions = 0
+    for course_id, name, added, dropped in edits:
+        course = db_mmb78.get_course_by_id(course_id)
+        course.course_name = name
+        db_mmb78.update_course(course)
+        for student_id in added:
+            db_mmb78.enroll_student(student_id, course_id, allow_conflicts=True)
+        for student_id in dropped:
+            db_mmb78.drop_student(student_id, course_id)
+        transactions += 1 + len(added) + len(dropped)
+    return transactions
+
+
+def unit_of_work(edits):
+    session = db_mmb78.session(allow_conflicts=True)
+    for course_id, name, added, dropped in edits:
+        course = session.get_course(course_id)
+        course.course_name = name
+        for student_id in added:
+            course.add_student(session.get_student(student_id))
+        course.enrolled_students = [s for s in course.enrolled_students if s.student_id not in dropped]
+    session.commit()
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--courses", type=int, default=200)
+    parser.add_argument("--students", type=int, default=5000)
+    parser.add_argument("--per-course", type=int, default=30)
+    parser.add_argument("--add", type=int, default=5)
+    parser.add_argument("--drop", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = []
+        for name, save in (("call by call", call_by_call), ("unit of work", unit_of_work)):
+            setup(os.path.join(tmp, f"{save.__name__}.db"), args.courses, args.students, args.per_course)
+            edits = plan(args.courses, args.students, args.add, args.drop)
+            start = time.perf_counter()
+            transactions = save(edits)
+            seconds = time.perf_counter() - start
+            print(f"{name:14s} {seconds:6.2f} s  {transactions} transactions")
+            conn = db_mmb78.connect()
+            results.append((conn.execute("SELECT course_id, course_name FROM courses ORDER BY 1").fetchall(),
+                            conn.execute("SELECT * FROM enrollments ORDER BY 1, 2").fetchall()))
+            conn.close()
+        assert results[0] == results[1], "the two ways left different data"
+        print("same data either way")
+
+
+if __name__ == "__main__":
+    main()
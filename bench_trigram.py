@@ -0,0 +1,87 @@
+"""
+Compares substring search through a trigram index with a linear scan.
+
+Generates names, emails and course names, indexes them and times random
+queries of several lengths both ways, checking that both return the same
+records::
+
+    python bench_trigram.py --records 1000000
+"""
+import argparse
+import random
+import string
+import time
+
+from trigram_index import TrigramIndex
+
+CONSONANTS = "bcdfghjklmnprstvwyz"
+VOWELS = "aeiou"
+
+
+def make_texts(count, seed=1):
+    """
+    Returns ``count`` texts shaped like the search keys of the JSON app.
+
+    :return: A list of ``"name\\nemail"`` strings.
+    """
+    rng = random.Random(seed)
+    syllables = [rng.choice(CONSONANTS) + rng.choice(VOWELS) + rng.choice(["", "", rng.choice(CONSONANTS)])
+                 for _ in range(400)]
+    texts = []
+    for i in range(count):
+        first = "".join(rng.choice(syllables) for _ in range(rng.randint(2, 3))).title()
+        last = "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).title()
+        texts.append(f"{first} {last}\n{first.lower()}.{last.lower()}{i % 100}@school.edu")
+    return texts
+
+
+def queries(texts, count, seed=2):
+    """Returns substrings of random names, from 3 to 8 characters long, plus a few misses."""
+    rng = random.Random(seed)
+    picked = []
+    for _ in range(count):
+        text = rng.choice(texts).lower().split("\n")[0]
+        length = rng.randint(3, 8)
+        start = rng.randrange(max(len(text) - length, 1))
+        picked.append(text[start:start + length])
+    picked += ["".join(rng.choice(string.ascii_lowercase) for _ in range(5)) for _ in range(count // 10)]
+    return picked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    texts = make_texts(args.records)
+    lowered = [text.lower() for text in texts]
+
+    start = time.perf_counter()
+    index = TrigramIndex()
+    for i, text in enumerate(texts):
+        index.add(i, text)
+    print(f"indexed {len(texts)} records in {time.perf_counter() - start:.1f} s")
+
+    scan_time = index_time = 0.0
+    for query in queries(texts, args.queries):
+        start = time.perf_counter()
+        expected = [i for i, text in enumerate(lowered) if query in text]
+        scan_time += time.perf_counter() - start
+        start = time.perf_counter()
+        found = index.search(query)
+        index_time += time.perf_counter() - start
+        assert found == expected, query
+
+    count = args.queries + args.queries // 10
+    print(f"linear scan  {scan_time / count * 1000:8.2f} ms/query")
+    print(f"trigram      {index_time / count * 1000:8.2f} ms/query")
+
+    start = time.perf_counter()
+    for i in range(0, len(texts), 10):
+        index.add(i, texts[i].upper() + " edited")
+    print(f"re-indexed {len(texts) // 10} edited records in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
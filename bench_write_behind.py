@@ -0,0 +1,111 @@
+"""
+Compares committing each form submission with write-behind group commits.
+
+Adds ``--records`` students to a database in a temporary directory, once with
+one ``Repository.add`` (and commit) per record and once through a
+:class:`write_behind.WriteBehind` buffer, and prints the latency of each
+submission and the total time. Then checks crash recovery: edits journaled
+but never flushed, and edits flushed but still in the journal, are all in the
+database exactly once after reopening::
+
+    python bench_write_behind.py --records 2000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import db_mmb78
+import repository
+import write_behind
+
+
+def open_repo(path):
+    db_mmb78.configure(path)
+    db_mmb78.create_tables()
+    return repository.SqliteRepository(path, "enrollments")
+
+
+def students(prefix, count):
+    return [(f"{prefix}{i}", f"Student {i}", 20, f"s{i}@school.edu") for i in range(count)]
+
+
+def timed(submit, rows):
+    """Returns the latency of each call of ``submit`` and the total seconds."""
+    latencies = []
+    start = time.perf_counter()
+    for row in rows:
+        begin = time.perf_counter()
+        submit(row)
+        latencies.append(time.perf_counter() - begin)
+    return latencies, time.perf_counter() - start
+
+
+def summary(name, latencies, seconds):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{name:14s} p50 {p50:7.3f} ms  p99 {p99:7.3f} ms  total {seconds:6.2f} s")
+
+
+def check_recovery(tmp):
+    """Asserts that reopening a journal applies every acknowledged edit once."""
+    path = os.path.join(tmp, "recovery.db")
+    journal = path + ".edits"
+    repo = open_repo(path)
+
+    # Acknowledged but never flushed: the app died before the timer fired.
+    writes = write_behind.WriteBehind(repo, journal)
+    for row in students("R", 10):
+        writes.submit("add", "students", row)
+    writes.submit("update", "students", ("R0", "Renamed", 21, "r@school.edu"))
+    del writes
+
+    # Flushed, but the app died before the journal was cleared.
+    saved = journal + ".saved"
+    writes = write_behind.WriteBehind(repo, journal)
+    assert len(repo.list("students")) == 10, "unflushed edits lost"
+    assert repo.get("students", "R0")[1] == "Renamed", "update lost"
+    for row in students("T", 5):
+        writes.submit("add", "students", row)
+    shutil.copyfile(journal, saved)
+    writes.flush()
+    shutil.copyfile(saved, journal)
+    del writes
+
+    write_behind.WriteBehind(repo, journal).close()
+    assert len(repo.list("students")) == 15, "flushed edits applied twice or lost"
+    assert os.path.getsize(journal) == 0
+    repo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--flush-size", type=int, default=write_behind.FLUSH_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = open_repo(os.path.join(tmp, "direct.db"))
+        latencies, seconds = timed(lambda row: repo.add("students", row), students("S", args.records))
+        summary("commit each", latencies, seconds)
+        repo.close()
+
+        path = os.path.join(tmp, "buffered.db")
+        repo = open_repo(path)
+        writes = write_behind.WriteBehind(repo, path + ".edits", flush_size=args.flush_size)
+        latencies, seconds = timed(lambda row: writes.submit("add", "students", row), students("S", args.records))
+        start = time.perf_counter()
+        writes.close()
+        seconds += time.perf_counter() - start
+        summary("write-behind", latencies, seconds)
+        assert len(repo.list("students")) == args.records
+        repo.close()
+
+        check_recovery(tmp)
+        print("recovery ok")
+
+
+if __name__ == "__main__":
+    main()
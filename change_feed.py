@@ -0,0 +1,198 @@
+"""
+Change-data-capture for the school databases.
+
+:func:`install` adds a ``change_log`` table and triggers that append one
+entry per inserted, updated or deleted row of the watched tables. Each entry
+holds the table name, the operation and the row's key as a JSON array.
+
+A :class:`ChangeFeed` follows the log of one database file. Its
+:meth:`~ChangeFeed.poll` first compares ``PRAGMA data_version``, which only
+changes when another connection committed, so an idle poll is a single
+pragma. When something was committed it reads the log entries past its
+cursor, collapses repeated changes of the same row, fetches the current
+version of each changed row and hands the resulting :class:`Change` list to
+its subscribers. GUIs call :meth:`~ChangeFeed.poll` from a Tk ``after()``
+callback or a ``QTimer`` and patch their views with the changed rows instead
+of re-reading every table.
+"""
+import json
+import os
+from collections import namedtuple
+
+import metrics
+import sql_trace
+
+# Key columns of the tables watched by db_mmb78. db.py passes its own mapping
+# because it keeps enrollments in ``student_courses``.
+TABLES = {
+    "students": ("student_id",),
+    "instructors": ("instructor_id",),
+    "courses": ("course_id",),
+    "enrollments": ("student_id", "course_id"),
+}
+
+# Entries kept by :func:`trim`; feeds that fall further behind get a reset.
+LOG_KEEP = 10000
+
+POLL_MS = int(os.environ.get("SCHOOL_CHANGE_POLL_MS", "500"))
+
+Change = namedtuple("Change", "seq table op key row")
+Change.__doc__ = """
+One changed row.
+
+``op`` is ``"insert"``, ``"update"`` or ``"delete"`` (the last operation
+seen for the row), ``key`` the tuple of key column values and ``row`` the
+current row as returned by ``SELECT *``, or None for deletes. A change with
+``op == "reset"`` and no table means entries were missed and the subscriber
+should reload everything.
+"""
+
+
+def _key_expr(prefix, columns):
+    return "json_array(" + ", ".join(f"{prefix}.{column}" for column in columns) + ")"
+
+
+def install(conn, tables=TABLES):
+    """
+    Creates the change log and its triggers if they do not exist yet.
+
+    :param conn: An open connection; the caller commits.
+    :param tables: Mapping of table name to its key columns.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            op TEXT NOT NULL,
+            row_key TEXT NOT NULL,
+            changed_at REAL NOT NULL DEFAULT (julianday('now'))
+        )
+    """)
+    for table, columns in tables.items():
+        new_key = _key_expr("NEW", columns)
+        old_key = _key_expr("OLD", columns)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_cdc_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO change_log (table_name, op, row_key) VALUES ('{table}', 'insert', {new_key});
+            END
+        """)
+        # A changed key is logged as a delete of the old key and an update of the new one.
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_cdc_update AFTER UPDATE ON {table}
+            BEGIN
+                INSERT INTO change_log (table_name, op, row_key)
+                    SELECT '{table}', 'delete', {old_key} WHERE {old_key} IS NOT {new_key};
+                INSERT INTO change_log (table_name, op, row_key) VALUES ('{table}', 'update', {new_key});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_cdc_delete AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO change_log (table_name, op, row_key) VALUES ('{table}', 'delete', {old_key});
+            END
+        """)
+
+
+def trim(conn, keep=LOG_KEEP):
+    """
+    Deletes all but the newest ``keep`` log entries.
+
+    :param conn: An open connection; the caller commits.
+    :param keep: Number of entries to keep.
+    """
+    conn.execute("DELETE FROM change_log WHERE seq <= (SELECT MAX(seq) FROM change_log) - ?", (keep,))
+
+
+class ChangeFeed:
+    """
+    Follows the change log of a database and delivers changed rows.
+
+    The feed starts at the current end of the log, so only changes committed
+    after it was created are delivered. It owns one connection and must be
+    polled from a single thread.
+
+    :param database: Path of the database file.
+    :param tables: Mapping of table name to key columns; entries for other
+                   tables are skipped.
+    """
+
+    def __init__(self, database, tables=TABLES):
+        self.database = database
+        self.tables = tables
+        self._conn = sql_trace.connect(database)
+        self._data_version = None
+        self._subscribers = []
+        self.last_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+    def subscribe(self, callback):
+        """
+        Registers a callable that receives the list of changes of each poll.
+
+        :param callback: Called with a non-empty list of :class:`Change`.
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def poll(self):
+        """
+        Reads the changes committed since the last poll and delivers them.
+
+        If a subscriber raises, the exception propagates and the feed's cursor
+        stays put, so the next poll delivers the changes again to every
+        subscriber; subscribers should apply changes idempotently.
+
+        :return: The delivered changes, in log order.
+        """
+        conn = self._conn
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return []
+
+        entries = conn.execute(
+            "SELECT seq, table_name, op, row_key FROM change_log WHERE seq > ? ORDER BY seq",
+            (self.last_seq,),
+        ).fetchall()
+        # Entries are only removed by trim(), so a gap means this feed fell behind it.
+        if entries and entries[0][0] > self.last_seq + 1:
+            changes = [Change(entries[-1][0], None, "reset", None, None)]
+        else:
+            changes = self._collapse(entries)
+
+        if changes:
+            metrics.inc("school_change_feed_changes_total", len(changes), database=os.path.basename(self.database))
+            for callback in list(self._subscribers):
+                callback(changes)
+        # Only advanced once every subscriber succeeded, so a failing subscriber
+        # gets the same changes again on the next poll.
+        if entries:
+            self.last_seq = entries[-1][0]
+        self._data_version = version
+        return changes
+
+    def _collapse(self, entries):
+        latest = {}
+        for seq, table, op, row_key in entries:
+            if table not in self.tables:
+                continue
+            # Re-inserting moves the row to the end, keeping the log order of the last change.
+            latest.pop((table, row_key), None)
+            latest[(table, row_key)] = (seq, op)
+
+        changes = []
+        for (table, row_key), (seq, op) in latest.items():
+            key = tuple(json.loads(row_key))
+            row = None
+            if op != "delete":
+                where = " AND ".join(f"{column} = ?" for column in self.tables[table])
+                row = self._conn.execute(f"SELECT * FROM {table} WHERE {where}", key).fetchone()
+                if row is None:
+                    # Deleted by a commit after the log was read; that entry comes next poll.
+                    op = "delete"
+            changes.append(Change(seq, table, op, key, row))
+        return changes
+
+    def close(self):
+        self._conn.close()
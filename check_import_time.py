@@ -0,0 +1,70 @@
+"""
+Import-time budget check for the data layer.
+
+Each module is imported in a fresh interpreter under ``python -X importtime``.
+The check fails if a module pulls in tkinter or PyQt5, or if its cumulative
+import time (best of several runs) exceeds its budget. Run it with::
+
+    python check_import_time.py
+"""
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Cumulative import budget per module, in milliseconds.
+BUDGETS_MS = {
+    "lab2_mmb78": 20,
+    "db_mmb78": 60,
+    "db": 60,
+    "school_data": 40,
+}
+GUI_PACKAGES = ("tkinter", "_tkinter", "PyQt5")
+RUNS = 5
+
+
+def measure(module):
+    """
+    Imports ``module`` once in a new interpreter.
+
+    :param module: Name of the module to import.
+    :return: A tuple ``(cumulative_ms, imported)`` where ``imported`` is the set
+             of top-level package names that were imported along the way.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=HERE, capture_output=True, text=True, check=True)
+    cumulative_ms = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        name = name.strip()
+        imported.add(name.split(".")[0])
+        if name == module:
+            cumulative_ms = int(cumulative) / 1000
+    return cumulative_ms, imported
+
+
+def main():
+    failures = []
+    for module, budget in BUDGETS_MS.items():
+        runs = [measure(module) for _ in range(RUNS)]
+        best = min(ms for ms, _ in runs)
+        gui = sorted(set(GUI_PACKAGES) & runs[0][1])
+        status = "ok"
+        if gui:
+            status = "imports " + ", ".join(gui)
+        elif best > budget:
+            status = f"over budget ({budget} ms)"
+        if status != "ok":
+            failures.append(module)
+        print(f"{module:15s} {best:8.2f} ms  {status}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
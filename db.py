@@ -1,14 +1,117 @@
-import sqlite3
+import os
+import change_feed
+import exams
+import metrics
+import schema
+import sql_trace
+import versions
 
-conn = sqlite3.connect("lab4\\EECE435L-lab4-awh15-mmb78\\lab_db.db")
-conn.execute("PRAGMA foreign_keys = 1")
-cursor = conn.cursor()
+DB_PATH = os.environ.get("LAB_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "lab_db.db"))
 
-cursor.execute("CREATE TABLE if not exists students (student_id TEXT PRIMARY KEY, name TEXT, age INTEGER, email TEXT)")
-cursor.execute("CREATE TABLE if not exists instructors (instructor_id TEXT PRIMARY KEY, name TEXT, age INTEGER, email TEXT)")
-cursor.execute("CREATE TABLE if not exists courses (course_id TEXT PRIMARY KEY, course_name TEXT, instructor_id TEXT, FOREIGN KEY(instructor_id) REFERENCES instructors(instructor_id))")
+_conn = None
 
-cursor.execute("CREATE TABLE if not exists student_courses (student_id TEXT, course_id TEXT, FOREIGN KEY(student_id) REFERENCES students(student_id), FOREIGN KEY(course_id) REFERENCES courses(course_id))")
+# Tables watched by the change feed, with their key columns.
+CHANGE_TABLES = {
+    "students": ("student_id",),
+    "instructors": ("instructor_id",),
+    "courses": ("course_id",),
+    "student_courses": ("student_id", "course_id"),
+}
 
-conn.commit()
-conn.close()
\ No newline at end of file
+metrics.register_collector(metrics.sqlite_collector(lambda: DB_PATH, ("students", "instructors", "courses", "student_courses")))
+
+
+def configure(path):
+    """
+    Points the data layer at another database file.
+
+    An already open connection is closed; the next call to
+    :func:`get_connection` opens ``path``.
+
+    :param path: Path of the SQLite database file.
+    """
+    global DB_PATH
+    close()
+    DB_PATH = path
+
+
+def get_connection():
+    """
+    Returns the shared connection, opening it on first use.
+
+    :return: An open sqlite3 connection with foreign keys enabled.
+    """
+    global _conn
+    if _conn is None:
+        _conn = sql_trace.connect(DB_PATH)
+        _conn.execute("PRAGMA foreign_keys = 1")
+    return _conn
+
+
+def iter_rows(query, params=(), arraysize=500):
+    """
+    Yields the rows of a query read through a private connection.
+
+    Background threads cannot use the shared connection, so this opens its own
+    and closes it when the generator is exhausted or closed.
+
+    :param query: The SELECT statement.
+    :param params: Parameters for the statement.
+    :param arraysize: Rows fetched from SQLite per batch.
+    """
+    conn = sql_trace.connect(DB_PATH)
+    try:
+        cursor = conn.cursor()
+        cursor.arraysize = arraysize
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def close():
+    """
+    Closes the shared connection if it is open.
+    """
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+
+def create_tables():
+    """
+    Creates the students, instructors, courses and student_courses tables if missing,
+    together with the change log that keeps other windows up to date and the
+    row versions that catch conflicting edits (see :mod:`versions`).
+
+    Tables from before cascading deletes are upgraded, see :func:`schema.create`.
+    """
+    conn = get_connection()
+    schema.create(conn, "student_courses")
+    versions.create(conn)
+    change_feed.install(conn, CHANGE_TABLES)
+    change_feed.trim(conn)
+
+    conn.commit()
+
+
+def schedule_exams(slots=None):
+    """
+    Assigns final exam slots so that no student has two exams at once.
+
+    :param slots: Maximum number of slots, or None for as many as needed; with
+                  too few, the slots costing the fewest clashes are chosen.
+    :return: An :class:`exams.ExamSchedule`.
+    """
+    graph = exams.CoEnrollmentGraph.from_db(get_connection(), "student_courses")
+    return exams.assign_slots(graph, slots)
+
+
+if __name__ == "__main__":
+    create_tables()
+    close()
@@ -1,58 +1,80 @@
-import sqlite3
-from lab2_mmb78 import Student, Instructor, Course
+import os
+import change_feed
+import exams
+import fuzzy_index
+import metrics
+import query
+import registration
+import relations
+import schedule
+import schema
+import sql_trace
+import unit_of_work
+import versions
+
+DB_PATH = os.environ.get('SCHOOL_DB_PATH', 'school_management.db')
+
+metrics.register_collector(metrics.sqlite_collector(lambda: DB_PATH, ('students', 'instructors', 'courses', 'enrollments')))
+
+# Typo-tolerant name index over students, instructors and courses, built on
+# the first fuzzy_search() and kept current from the change log
+NAME_COLUMNS = {'students': ('student_id', 'name'), 'instructors': ('instructor_id', 'name'),
+                'courses': ('course_id', 'course_name')}
+_name_index = None
+_name_feed = None
+
+# Point the module at another database file
+def configure(path):
+    global DB_PATH, _name_index, _name_feed
+    DB_PATH = path
+    if _name_feed is not None:
+        _name_feed.close()
+    _name_index = _name_feed = None
 
 # Function to connect to the SQLite database
 def connect():
-    return sqlite3.connect('school_management.db')
+    conn = sql_trace.connect(DB_PATH)
+    # Needed on every connection for the cascading deletes
+    conn.execute('PRAGMA foreign_keys = 1')
+    return conn
 
 # Function to create the required tables
 def create_tables():
     conn = connect()
-    c = conn.cursor()
 
-    # Create Students table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS students (
-            student_id TEXT PRIMARY KEY,
-            name TEXT,
-            age INTEGER,
-            email TEXT
-        )
-    ''')
-
-    # Create Instructors table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS instructors (
-            instructor_id TEXT PRIMARY KEY,
-            name TEXT,
-            age INTEGER,
-            email TEXT
-        )
-    ''')
-
-    # Create Courses table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS courses (
-            course_id TEXT PRIMARY KEY,
-            course_name TEXT,
-            instructor_id TEXT,
-            FOREIGN KEY(instructor_id) REFERENCES instructors(instructor_id)
-        )
-    ''')
-
-    # Create Enrollments table to track students enrolled in courses
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS enrollments (
-            student_id TEXT,
-            course_id TEXT,
-            FOREIGN KEY(student_id) REFERENCES students(student_id),
-            FOREIGN KEY(course_id) REFERENCES courses(course_id)
-        )
-    ''')
+    # Students, instructors, courses and enrollments; deleting a student or
+    # course removes its enrollments, deleting an instructor unassigns courses
+    schema.create(conn, 'enrollments')
+
+    # Course capacities and waitlists, promoted by triggers when seats free up
+    registration.create(conn)
+
+    # Weekly meeting times, checked for conflicts at registration
+    schedule.create(conn)
+
+    # Row versions checked by the edit forms' updates
+    versions.create(conn)
+
+    # Change log read by other instances to refresh their views
+    change_feed.install(conn)
+    change_feed.trim(conn)
 
     conn.commit()
     conn.close()
 
+# Composable query on one table, compiled to a single SQL statement; see query.py.
+# select('students').where(age__gt=20, courses__course_id='C1').order_by('name').objects()
+def select(table):
+    return query.Query(table, connect)
+
+# Unit of work over Student, Instructor and Course objects: changes made to
+# the objects it loads, and objects added or deleted through it, are written
+# in one transaction by commit(), only the changed columns and enrollments;
+# see unit_of_work.py.
+# s = session(); course = s.get_course('C1'); course.add_student(s.get_student('S1')); s.commit()
+def session(allow_conflicts=False):
+    return unit_of_work.Session(connect, allow_conflicts)
+
 # CRUD Functions for Students
 def add_student(student):
     conn = connect()
@@ -61,28 +83,41 @@ def add_student(student):
         INSERT INTO students (student_id, name, age, email) VALUES (?, ?, ?, ?)
     ''', (student.student_id, student.name, student.age, student.get_email()))
     conn.commit()
+    metrics.inc('school_crud_operations_total', entity='student', op='create')
     conn.close()
 
 def get_all_students():
+    return list(iter_students())
+
+# Streams the students from the cursor, arraysize rows at a time, so memory
+# stays flat however many there are. Exports and reports should use the
+# iter_* functions; the connection closes when the generator is exhausted or closed.
+# Relationships of the records read by any function here, like
+# student.registered_courses, load on first access, for arraysize records at
+# once; see relations.py.
+def iter_students(arraysize=query.ARRAYSIZE):
+    metrics.inc('school_crud_operations_total', entity='student', op='read')
+    loader = relations.Loader(connect, arraysize)
+    rows = query.iter_rows(connect, 'SELECT * FROM students', arraysize=arraysize)
+    yield from relations.iter_batched(rows, loader.student, arraysize)
+
+# With a version from get_version(), raises versions.StaleRecordError instead
+# of overwriting a student someone else changed or deleted since
+def update_student(student, version=None):
     conn = connect()
     c = conn.cursor()
-    c.execute('SELECT * FROM students')
-    rows = c.fetchall()
-    conn.close()
-
-    students = []
-    for row in rows:
-        student = Student(name=row[1], age=row[2], email=row[3], student_id=row[0])
-        students.append(student)
-    return students
-
-def update_student(student):
-    conn = connect()
-    c = conn.cursor()
-    c.execute('''
-        UPDATE students SET name = ?, age = ?, email = ? WHERE student_id = ?
-    ''', (student.name, student.age, student.get_email(), student.student_id))
+    params = (student.name, student.age, student.get_email(), student.student_id)
+    if version is None:
+        c.execute('UPDATE students SET name = ?, age = ?, email = ? WHERE student_id = ?', params)
+    else:
+        c.execute('UPDATE students SET name = ?, age = ?, email = ? WHERE student_id = ? AND '
+                  + versions.matches('students'), params + (version,))
+        if c.rowcount == 0:
+            error = versions.stale(conn, 'students', student.student_id)
+            conn.close()
+            raise error
     conn.commit()
+    metrics.inc('school_crud_operations_total', entity='student', op='update')
     conn.close()
 
 def delete_student(student_id):
@@ -90,8 +125,30 @@ def delete_student(student_id):
     c = conn.cursor()
     c.execute('DELETE FROM students WHERE student_id = ?', (student_id,))
     conn.commit()
+    metrics.inc('school_crud_operations_total', entity='student', op='delete')
     conn.close()
 
+# Bulk deletes, committed in chunks so other writers get in between
+def delete_students(student_ids, chunk_size=schema.CHUNK_SIZE):
+    conn = connect()
+    try:
+        deleted = schema.delete_ids(conn, 'students', 'student_id', student_ids, chunk_size)
+    finally:
+        conn.close()
+    metrics.inc('school_crud_operations_total', deleted, entity='student', op='delete')
+    return deleted
+
+# Deletes the students matching a SQL condition, e.g. a graduating class:
+# delete_students_where('age > ?', (25,)). The condition must not come from user input.
+def delete_students_where(where, params=(), chunk_size=schema.CHUNK_SIZE):
+    conn = connect()
+    try:
+        deleted = schema.delete_where(conn, 'students', where, params, chunk_size)
+    finally:
+        conn.close()
+    metrics.inc('school_crud_operations_total', deleted, entity='student', op='delete')
+    return deleted
+
 # CRUD Functions for Instructors
 def add_instructor(instructor):
     conn = connect()
@@ -100,28 +157,34 @@ def add_instructor(instructor):
         INSERT INTO instructors (instructor_id, name, age, email) VALUES (?, ?, ?, ?)
     ''', (instructor.instructor_id, instructor.name, instructor.age, instructor.get_email()))
     conn.commit()
+    metrics.inc('school_crud_operations_total', entity='instructor', op='create')
     conn.close()
 
 def get_all_instructors():
-    conn = connect()
-    c = conn.cursor()
-    c.execute('SELECT * FROM instructors')
-    rows = c.fetchall()
-    conn.close()
+    return list(iter_instructors())
 
-    instructors = []
-    for row in rows:
-        instructor = Instructor(name=row[1], age=row[2], email=row[3], instructor_id=row[0])
-        instructors.append(instructor)
-    return instructors
+def iter_instructors(arraysize=query.ARRAYSIZE):
+    metrics.inc('school_crud_operations_total', entity='instructor', op='read')
+    loader = relations.Loader(connect, arraysize)
+    rows = query.iter_rows(connect, 'SELECT * FROM instructors', arraysize=arraysize)
+    yield from relations.iter_batched(rows, loader.instructor, arraysize)
 
-def update_instructor(instructor):
+# See update_student() for the version
+def update_instructor(instructor, version=None):
     conn = connect()
     c = conn.cursor()
-    c.execute('''
-        UPDATE instructors SET name = ?, age = ?, email = ? WHERE instructor_id = ?
-    ''', (instructor.name, instructor.age, instructor.get_email(), instructor.instructor_id))
+    params = (instructor.name, instructor.age, instructor.get_email(), instructor.instructor_id)
+    if version is None:
+        c.execute('UPDATE instructors SET name = ?, age = ?, email = ? WHERE instructor_id = ?', params)
+    else:
+        c.execute('UPDATE instructors SET name = ?, age = ?, email = ? WHERE instructor_id = ? AND '
+                  + versions.matches('instructors'), params + (version,))
+        if c.rowcount == 0:
+            error = versions.stale(conn, 'instructors', instructor.instructor_id)
+            conn.close()
+            raise error
     conn.commit()
+    metrics.inc('school_crud_operations_total', entity='instructor', op='update')
     conn.close()
 
 def delete_instructor(instructor_id):
@@ -129,6 +192,7 @@ def delete_instructor(instructor_id):
     c = conn.cursor()
     c.execute('DELETE FROM instructors WHERE instructor_id = ?', (instructor_id,))
     conn.commit()
+    metrics.inc('school_crud_operations_total', entity='instructor', op='delete')
     conn.close()
 
 # CRUD Functions for Courses
@@ -138,30 +202,40 @@ def add_course(course):
     c.execute('''
         INSERT INTO courses (course_id, course_name, instructor_id) VALUES (?, ?, ?)
     ''', (course.course_id, course.course_name, course.instructor.instructor_id))
+    if course.capacity is not None:
+        registration.set_capacity(conn, course.course_id, course.capacity)
+    if course.meetings:
+        schedule.set_meetings(conn, course.course_id, course.meetings)
     conn.commit()
+    metrics.inc('school_crud_operations_total', entity='course', op='create')
     conn.close()
 
 def get_all_courses():
-    conn = connect()
-    c = conn.cursor()
-    c.execute('SELECT * FROM courses')
-    rows = c.fetchall()
-    conn.close()
+    return list(iter_courses())
 
-    courses = []
-    for row in rows:
-        instructor = get_instructor_by_id(row[2])  # Assuming instructor retrieval by ID
-        course = Course(course_id=row[0], course_name=row[1], instructor=instructor)
-        courses.append(course)
-    return courses
+# The instructor of each course is read in the same statement
+def iter_courses(arraysize=query.ARRAYSIZE):
+    return select('courses').iter_objects(arraysize)
 
-def update_course(course):
+# See update_student() for the version; meetings are not versioned
+def update_course(course, version=None):
     conn = connect()
     c = conn.cursor()
-    c.execute('''
-        UPDATE courses SET course_name = ?, instructor_id = ? WHERE course_id = ?
-    ''', (course.course_name, course.instructor.instructor_id, course.course_id))
+    params = (course.course_name, course.instructor.instructor_id, course.course_id)
+    if version is None:
+        c.execute('UPDATE courses SET course_name = ?, instructor_id = ? WHERE course_id = ?', params)
+    else:
+        c.execute('UPDATE courses SET course_name = ?, instructor_id = ? WHERE course_id = ? AND '
+                  + versions.matches('courses'), params + (version,))
+        if c.rowcount == 0:
+            error = versions.stale(conn, 'courses', course.course_id)
+            conn.close()
+            raise error
+    # Meetings not loaded (None) are left as they are
+    if course.meetings is not None:
+        schedule.set_meetings(conn, course.course_id, course.meetings)
     conn.commit()
+    metrics.inc('school_crud_operations_total', entity='course', op='update')
     conn.close()
 
 def delete_course(course_id):
@@ -169,20 +243,32 @@ def delete_course(course_id):
     c = conn.cursor()
     c.execute('DELETE FROM courses WHERE course_id = ?', (course_id,))
     conn.commit()
+    metrics.inc('school_crud_operations_total', entity='course', op='delete')
     conn.close()
 
+def delete_courses(course_ids, chunk_size=schema.CHUNK_SIZE):
+    conn = connect()
+    try:
+        deleted = schema.delete_ids(conn, 'courses', 'course_id', course_ids, chunk_size)
+    finally:
+        conn.close()
+    metrics.inc('school_crud_operations_total', deleted, entity='course', op='delete')
+    return deleted
+
 # Helper function to get an instructor by ID
 def get_instructor_by_id(instructor_id):
+    metrics.inc('school_crud_operations_total', entity='instructor', op='read')
     conn = connect()
     c = conn.cursor()
     c.execute('SELECT * FROM instructors WHERE instructor_id = ?', (instructor_id,))
     row = c.fetchone()
     conn.close()
     if row:
-        return Instructor(name=row[1], age=row[2], email=row[3], instructor_id=row[0])
+        return relations.Loader(connect).instructor(row)
     return None
 
 def get_instructor_by_name(name):
+    metrics.inc('school_crud_operations_total', entity='instructor', op='read')
     conn = connect()
     c = conn.cursor()
     c.execute('SELECT * FROM instructors WHERE name = ?', (name,))
@@ -190,73 +276,224 @@ def get_instructor_by_name(name):
     conn.close()
 
     if row:
-        return Instructor(instructor_id=row[0], name=row[1], age=row[2], email=row[3])
+        return relations.Loader(connect).instructor(row)
     else:
         return None
 
 # Enrollment Functions
-def enroll_student(student_id, course_id):
+# Takes a seat if the course has one free, or joins its waitlist (unless
+# waitlist is False). Atomic under concurrent registrants; returns a
+# registration.Registration with the status and waitlist position. Raises
+# schedule.ScheduleConflict if the course overlaps the student's other
+# courses, unless allow_conflicts is True.
+def enroll_student(student_id, course_id, waitlist=True, allow_conflicts=False):
     conn = connect()
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO enrollments (student_id, course_id) VALUES (?, ?)
-    ''', (student_id, course_id))
+    try:
+        result = registration.enroll(conn, student_id, course_id, waitlist, allow_conflicts)
+    finally:
+        conn.close()
+    if result.status == registration.ENROLLED:
+        metrics.inc('school_crud_operations_total', entity='enrollment', op='create')
+        metrics.inc('school_enrollments_total')
+    return result
+
+# Drops a student from a course or its waitlist; the first waitlisted student
+# takes the freed seat in the same transaction
+def drop_student(student_id, course_id):
+    conn = connect()
+    try:
+        dropped = registration.drop(conn, student_id, course_id)
+    finally:
+        conn.close()
+    if dropped:
+        metrics.inc('school_crud_operations_total', entity='enrollment', op='delete')
+    return dropped
+
+# Limits a course to capacity students (None for unlimited); raising the
+# limit promotes waitlisted students right away
+def set_course_capacity(course_id, capacity):
+    conn = connect()
+    registration.set_capacity(conn, course_id, capacity)
     conn.commit()
+    metrics.inc('school_crud_operations_total', entity='course', op='update')
     conn.close()
 
-def get_enrollments_for_course(course_id):
+# Replaces the weekly meetings of a course (schedule.Meeting list)
+def set_course_meetings(course_id, meetings):
     conn = connect()
-    c = conn.cursor()
-    c.execute('SELECT student_id FROM enrollments WHERE course_id = ?', (course_id,))
-    rows = c.fetchall()
+    schedule.set_meetings(conn, course_id, meetings)
+    conn.commit()
+    metrics.inc('school_crud_operations_total', entity='course', op='update')
+    conn.close()
+
+# Every student enrolled in two overlapping courses, as schedule.Conflict
+# tuples (student_id, course_id, other_course_id), streamed by student
+def iter_schedule_conflicts():
+    metrics.inc('school_crud_operations_total', entity='enrollment', op='read')
+    conn = connect()
+    try:
+        yield from schedule.conflict_report(conn)
+    finally:
+        conn.close()
+
+# Final exam slots from the course co-enrollment graph: courses sharing a
+# student never share a slot, unless slots limits the number of slots.
+# Returns an exams.ExamSchedule.
+def schedule_exams(slots=None):
+    conn = connect()
+    try:
+        graph = exams.CoEnrollmentGraph.from_db(conn, 'enrollments')
+    finally:
+        conn.close()
+    return exams.assign_slots(graph, slots)
+
+def get_waitlist(course_id):
+    metrics.inc('school_crud_operations_total', entity='enrollment', op='read')
+    conn = connect()
+    waiting = registration.get_waitlist(conn, course_id)
     conn.close()
+    return waiting
 
-    students = []
-    for row in rows:
-        student = get_student_by_id(row[0])  # Assuming student retrieval by ID
-        students.append(student)
-    return students
+def get_enrollments_for_course(course_id):
+    return list(iter_enrollments_for_course(course_id))
+
+# The enrolled students are read in the same statement as the enrollments
+def iter_enrollments_for_course(course_id, arraysize=query.ARRAYSIZE):
+    metrics.inc('school_crud_operations_total', entity='enrollment', op='read')
+    rows = query.iter_rows(connect, '''
+        SELECT students.* FROM enrollments JOIN students ON students.student_id = enrollments.student_id
+        WHERE enrollments.course_id = ?
+    ''', (course_id,), arraysize)
+    loader = relations.Loader(connect, arraysize)
+    yield from relations.iter_batched(rows, loader.student, arraysize)
+
+# (student_id, course_id) pairs of all enrollments
+def iter_enrollments(arraysize=query.ARRAYSIZE):
+    metrics.inc('school_crud_operations_total', entity='enrollment', op='read')
+    yield from query.iter_rows(connect, 'SELECT student_id, course_id FROM enrollments', arraysize=arraysize)
+
+# Version of a student, instructor or course for the update functions. Read it
+# before the record itself: a change in between then fails the update rather
+# than being overwritten.
+def get_version(table, record_id):
+    conn = connect()
+    version = versions.get(conn, table, record_id)
+    conn.close()
+    return version
 
 def get_student_by_id(student_id):
+    metrics.inc('school_crud_operations_total', entity='student', op='read')
     conn = connect()
     c = conn.cursor()
     c.execute('SELECT * FROM students WHERE student_id = ?', (student_id,))
     row = c.fetchone()
     conn.close()
     if row:
-        return Student(name=row[1], age=row[2], email=row[3], student_id=row[0])
+        return relations.Loader(connect).student(row)
     return None
 
     
 def get_course_by_id(course_id):
+    metrics.inc('school_crud_operations_total', entity='course', op='read')
     conn = connect()
     c = conn.cursor()
     c.execute('SELECT * FROM courses WHERE course_id = ?', (course_id,))
     row = c.fetchone()
+    capacity = registration.get_capacity(conn, course_id)
+    meetings = schedule.get_meetings(conn, course_id)
     conn.close()
 
     if row:
-        # Fetch instructor information for the course
-        instructor = get_instructor_by_id(row[2])  # Assuming row[2] contains instructor_id
-        # Fetch enrolled students for the course
-        enrolled_students = get_enrollments_for_course(course_id)
-        return Course(course_id=row[0], course_name=row[1], instructor=instructor, enrolled_students=enrolled_students)
+        # The instructor and enrolled students load when first used
+        return relations.Loader(connect).course(row, capacity=capacity, meetings=meetings)
     return None
 
 def get_course_by_name(course_name):
     """Fetches a course by its name from the database."""
+    metrics.inc('school_crud_operations_total', entity='course', op='read')
     conn = connect()
     c = conn.cursor()
 
     # Query the database for the course with the given course_name
     c.execute('SELECT * FROM courses WHERE course_name = ?', (course_name,))
     row = c.fetchone()
+    capacity = registration.get_capacity(conn, row[0]) if row else None
+    meetings = schedule.get_meetings(conn, row[0]) if row else None
     conn.close()
 
     if row:
         # Assuming row[0] is course_id, row[1] is course_name, and row[2] is instructor_id
-        instructor = get_instructor_by_id(row[2])  # Fetch the instructor by ID
-        return Course(course_id=row[0], course_name=row[1], instructor=instructor)
+        return relations.Loader(connect).course(row, capacity=capacity, meetings=meetings)
     
     return None  # Return None if the course is not found
 
+# Fuzzy search over student, instructor and course names. Tolerates typos and
+# spellings that sound alike ("jhon smth", "Kathryn" for "Catherine") and
+# returns Student, Instructor and Course objects, best match first.
+def fuzzy_search(text, limit=fuzzy_index.LIMIT):
+    if _name_index is None:
+        metrics.cache_miss('name_index')
+        _build_name_index()
+    else:
+        metrics.cache_hit('name_index')
+    _name_feed.poll()
+    if _name_index is None:
+        # The feed fell behind the log and asked for a reset
+        metrics.cache_miss('name_index')
+        _build_name_index()
+    keys = _name_index.search(text, limit)
+    metrics.inc('school_crud_operations_total', entity='name', op='search')
+
+    found = {}
+    for table in NAME_COLUMNS:
+        ids = [record_id for kind, record_id in keys if kind == table]
+        if ids:
+            found.update(((table, record_id), record) for record_id, record in _get_by_ids(table, ids).items())
+    # Records deleted since the last poll are skipped
+    return [found[key] for key in keys if key in found]
+
+def _build_name_index():
+    global _name_index, _name_feed
+    if _name_feed is None:
+        # Opened before reading the names so changes committed meanwhile are not missed
+        _name_feed = change_feed.ChangeFeed(DB_PATH)
+        _name_feed.subscribe(_apply_name_changes)
+    index = fuzzy_index.FuzzyIndex()
+    conn = connect()
+    for table, (key, name) in NAME_COLUMNS.items():
+        for record_id, text in conn.execute(f'SELECT {key}, {name} FROM {table}'):
+            index.add((table, record_id), text)
+    conn.close()
+    _name_index = index
+
+def _apply_name_changes(changes):
+    global _name_index
+    if _name_index is None:
+        return
+    for change in changes:
+        if change.op == 'reset':
+            _name_index = None
+            return
+        if change.table not in NAME_COLUMNS:
+            continue
+        key = (change.table, change.key[0])
+        if change.op != 'delete':
+            _name_index.add(key, change.row[1])
+        elif key in _name_index:
+            _name_index.remove(key)
+
+# Fetches the records of one table with the given IDs in one query, by ID
+def _get_by_ids(table, ids):
+    conn = connect()
+    c = conn.cursor()
+    placeholders = ', '.join('?' * len(ids))
+    c.execute(f'SELECT * FROM {table} WHERE {NAME_COLUMNS[table][0]} IN ({placeholders})', ids)
+    rows = c.fetchall()
+    conn.close()
+
+    loader = relations.Loader(connect)
+    if table == 'students':
+        return {row[0]: loader.student(row) for row in rows}
+    if table == 'instructors':
+        return {row[0]: loader.instructor(row) for row in rows}
+    return {row[0]: loader.course(row) for row in rows}
@@ -0,0 +1,148 @@
+"""
+Final exam scheduling by coloring the course co-enrollment graph.
+
+Two courses sharing students cannot hold their exams in the same slot. The
+:class:`CoEnrollmentGraph` has an edge between such courses, weighted by the
+number of students they share, stored as compressed sparse rows: the
+neighbours of course ``i`` are ``neighbors[offsets[i]:offsets[i + 1]]``, with
+their weights at the same positions in ``weights``. The edges are counted
+from each student's courses with :class:`collections.Counter`, which counts
+a whole iterator of course pairs in C.
+
+:func:`assign_slots` colors the graph with the DSatur heuristic: it always
+places next the course whose neighbours already use the most distinct slots,
+the most constrained one, breaking ties by the students it shares, and gives
+it the first free slot. With a fixed number of slots a course may find none
+free; it then goes to the slot costing the fewest students two exams at once.
+
+``bench_exams.py`` times it on 10k courses and 1M enrollments.
+"""
+import heapq
+import itertools
+from array import array
+from collections import Counter, namedtuple
+
+ExamSchedule = namedtuple("ExamSchedule", "slots slot_count clashes")
+ExamSchedule.__doc__ = """
+Result of :func:`assign_slots`.
+
+``slots`` maps each course ID to its 0-based slot, ``slot_count`` is the
+number of slots used and ``clashes`` the number of times a student has two
+exams in the same slot, 0 unless the number of slots was limited.
+"""
+
+
+class CoEnrollmentGraph:
+    """
+    Courses and the number of students each pair of them shares.
+
+    :param courses: Course IDs; course ``i`` is ``courses[i]``.
+    :param offsets: ``array`` of ``len(courses) + 1`` offsets into ``neighbors``.
+    :param neighbors: ``array`` of course indexes.
+    :param weights: ``array`` of shared student counts, parallel to ``neighbors``.
+    """
+
+    def __init__(self, courses, offsets, neighbors, weights):
+        self.courses = courses
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.courses)
+
+    @classmethod
+    def from_enrollments(cls, enrollments, courses=()):
+        """
+        Builds the graph from ``(student_id, course_id)`` pairs.
+
+        :param enrollments: Pairs grouped by student, e.g. ordered by student ID.
+        :param courses: Course IDs to include even without enrollments.
+        """
+        index = {}
+        for course_id in courses:
+            index.setdefault(course_id, len(index))
+        pairs = Counter()
+        for _, rows in itertools.groupby(enrollments, key=lambda row: row[0]):
+            taken = sorted({index.setdefault(course_id, len(index)) for _, course_id in rows})
+            if len(taken) > 1:
+                pairs.update(itertools.combinations(taken, 2))
+
+        size = len(index)
+        degree = [0] * (size + 1)
+        for a, b in pairs:
+            degree[a + 1] += 1
+            degree[b + 1] += 1
+        offsets = array("l", itertools.accumulate(degree))
+        neighbors = array("l", bytes(offsets[-1] * array("l").itemsize))
+        weights = array("l", neighbors)
+        fill = array("l", offsets[:-1])
+        for (a, b), weight in pairs.items():
+            neighbors[fill[a]], weights[fill[a]] = b, weight
+            fill[a] += 1
+            neighbors[fill[b]], weights[fill[b]] = a, weight
+            fill[b] += 1
+        return cls(list(index), offsets, neighbors, weights)
+
+    @classmethod
+    def from_db(cls, conn, enrollment_table="enrollments"):
+        """
+        Builds the graph of all courses from an enrollment table.
+
+        :param conn: An open connection.
+        :param enrollment_table: ``"enrollments"`` (db_mmb78) or ``"student_courses"`` (db).
+        """
+        courses = [row[0] for row in conn.execute("SELECT course_id FROM courses")]
+        cursor = conn.cursor()
+        cursor.arraysize = 2000
+        cursor.execute(f"SELECT student_id, course_id FROM {enrollment_table} ORDER BY student_id")
+        rows = itertools.chain.from_iterable(iter(cursor.fetchmany, []))
+        return cls.from_enrollments(rows, courses)
+
+    def edges(self, course):
+        """Returns ``(neighbour, weight)`` pairs of the course with index ``course``."""
+        start, end = self.offsets[course], self.offsets[course + 1]
+        return zip(self.neighbors[start:end], self.weights[start:end])
+
+
+def assign_slots(graph, slots=None):
+    """
+    Assigns an exam slot to every course, see the module docstring.
+
+    :param graph: A :class:`CoEnrollmentGraph`.
+    :param slots: Maximum number of slots, or None to use as many as needed
+                  for no student to have two exams at once.
+    :return: An :class:`ExamSchedule`.
+    """
+    size = len(graph)
+    slot_of = [-1] * size
+    # Slots used by the neighbours of each course placed so far.
+    used = [set() for _ in range(size)]
+    load = [sum(graph.weights[graph.offsets[i]:graph.offsets[i + 1]]) for i in range(size)]
+    queue = [(0, -load[i], i) for i in range(size)]
+    heapq.heapify(queue)
+    slot_count = 0
+    clashes = 0
+
+    while queue:
+        saturation, _, course = heapq.heappop(queue)
+        # Courses are pushed again when their saturation grows; skip the old entries.
+        if slot_of[course] >= 0 or -saturation != len(used[course]):
+            continue
+        taken = used[course]
+        slot = next(s for s in itertools.count() if s not in taken)
+        if slots is not None and slot >= slots:
+            cost = [0] * slots
+            for neighbor, weight in graph.edges(course):
+                if slot_of[neighbor] >= 0:
+                    cost[slot_of[neighbor]] += weight
+            slot = min(range(slots), key=cost.__getitem__)
+            clashes += cost[slot]
+        slot_of[course] = slot
+        slot_count = max(slot_count, slot + 1)
+        for neighbor, _ in graph.edges(course):
+            if slot_of[neighbor] < 0 and slot not in used[neighbor]:
+                used[neighbor].add(slot)
+                heapq.heappush(queue, (-len(used[neighbor]), -load[neighbor], neighbor))
+
+    return ExamSchedule(dict(zip(graph.courses, slot_of)), slot_count, clashes)
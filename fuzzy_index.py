@@ -0,0 +1,270 @@
+"""
+Typo-tolerant name search.
+
+A :class:`FuzzyIndex` splits every indexed name into words and finds the
+words of a query even when they are misspelled. Candidate words come from two
+indexes over the distinct words of the names, which are far fewer than the
+names themselves:
+
+- A SymSpell-style deletion index maps every string obtained by deleting up
+  to :data:`MAX_DISTANCE` characters from the first :data:`PREFIX_LENGTH`
+  characters of a word to that word. Deleting characters from the query
+  word and looking the results up finds every word within that many edits
+  of it without comparing the query to each word; the candidates are then
+  checked with :func:`edit_distance`.
+- A phonetic index maps the :func:`phonetic_key` of each word to the words
+  sounding like it, so "Kathryn" finds "Catherine" although they are four
+  edits apart.
+
+Names must contain a match for every query word. They are ranked by the sum
+of the costs of those matches, then by how many words they have beyond the
+query's, then by indexing order. A word found by spelling costs its edit
+distance, plus half an edit unless it also sounds like the query word; a word
+found only by sound costs one edit more than the query word allows.
+
+``bench_fuzzy.py`` times it on generated names.
+"""
+import heapq
+import re
+import unicodedata
+
+# Edits allowed in a query word of at least 6 characters; shorter words
+# allow fewer, see :func:`allowed_edits`.
+MAX_DISTANCE = 2
+
+# Only this many leading characters of a word are put in the deletion index.
+PREFIX_LENGTH = 7
+
+# Phonetic buckets larger than this are ignored; short keys match too much to rank.
+PHONETIC_MAX = 200
+
+# Number of names returned by default.
+LIMIT = 20
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+# Soundex consonant classes; vowels, h, w and y have none.
+_CODES = {letter: str(code)
+          for code, letters in enumerate(["bfpv", "cgjkqsxz", "dt", "l", "mn", "r"], 1)
+          for letter in letters}
+
+# Spellings of the same sound, rewritten before coding.
+_REWRITES = [(re.compile(pattern), repl) for pattern, repl in [
+    (r"^(?:kn|gn|pn)", "n"), (r"^wr", "r"), (r"^ps", "s"),
+    (r"ph", "f"), (r"gh(?![aeiou])", ""), (r"dg", "j"),
+]]
+
+
+def words(text):
+    """
+    Returns the lowercase words of ``text``, with accents removed.
+
+    :param text: A name.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return _WORD.findall(text.encode("ascii", "ignore").decode())
+
+
+def phonetic_key(word):
+    """
+    Returns a key shared by words that sound alike.
+
+    This is Soundex without its four-character limit and with the first
+    letter coded like the others, so "Catherine" and "Kathryn" both give
+    ``"2365"``. A few silent or alternative spellings are rewritten first.
+
+    :param word: A lowercase word.
+    """
+    for pattern, repl in _REWRITES:
+        word = pattern.sub(repl, word)
+    key = []
+    previous = None
+    for letter in word:
+        code = _CODES.get(letter)
+        # h and w do not separate equal codes, vowels do.
+        if letter in "hw":
+            continue
+        if code is not None and code != previous:
+            key.append(code)
+        previous = code
+    return "".join(key)
+
+
+def edit_distance(a, b, limit):
+    """
+    Returns the edit distance of two strings, or ``limit + 1`` if it is larger.
+
+    Insertions, deletions, substitutions and swaps of adjacent characters
+    count as one edit (optimal string alignment distance).
+
+    :param a: A string.
+    :param b: Another string.
+    :param limit: Largest distance of interest.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cost = ca != cb
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if cost and i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                value = min(value, before[j - 2] + 1)
+            current[j] = value
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+def allowed_edits(word):
+    """Returns the number of edits tolerated in a query word: 0, 1 or :data:`MAX_DISTANCE`."""
+    if len(word) < 3:
+        return 0
+    return 1 if len(word) < 6 else MAX_DISTANCE
+
+
+def deletes(word, distance):
+    """
+    Returns the strings obtained by deleting up to ``distance`` characters of ``word``.
+
+    :return: A set that includes ``word`` itself.
+    """
+    found = {word}
+    edge = {word}
+    for _ in range(distance):
+        edge = {w[:i] + w[i + 1:] for w in edge if len(w) > 1 for i in range(len(w))} - found
+        found |= edge
+    return found
+
+
+class FuzzyIndex:
+    """
+    Typo-tolerant index over the names of keyed documents.
+
+    Keys can be any hashable value, e.g. record IDs or ``(table, id)`` pairs.
+    """
+
+    def __init__(self):
+        self._words_of = {}
+        self._order = {}
+        self._next = 0
+        self._postings = {}
+        self._deletes = {}
+        self._sounds = {}
+
+    def __len__(self):
+        return len(self._words_of)
+
+    def __contains__(self, key):
+        return key in self._words_of
+
+    def add(self, key, name):
+        """
+        Indexes ``name`` under ``key``, replacing the name indexed before.
+
+        :param key: The document key.
+        :param name: The name to index.
+        """
+        if key in self._words_of:
+            self.remove(key)
+        name_words = tuple(words(name))
+        self._words_of[key] = name_words
+        self._order[key] = self._next
+        self._next += 1
+        for word in set(name_words):
+            posting = self._postings.get(word)
+            if posting is None:
+                posting = self._postings[word] = set()
+                self._add_word(word)
+            posting.add(key)
+
+    def _add_word(self, word):
+        for deleted in deletes(word[:PREFIX_LENGTH], MAX_DISTANCE):
+            self._deletes.setdefault(deleted, []).append(word)
+        self._sounds.setdefault(phonetic_key(word), []).append(word)
+
+    def remove(self, key):
+        """
+        Removes the document indexed under ``key``.
+
+        Words stay in the deletion and phonetic indexes with an empty posting,
+        so indexing them again costs nothing.
+
+        :param key: The document key.
+        :raises KeyError: If ``key`` is not indexed.
+        """
+        name_words = self._words_of.pop(key)
+        del self._order[key]
+        for word in set(name_words):
+            self._postings[word].discard(key)
+
+    def candidates(self, word):
+        """
+        Returns the indexed words matching a query word, with their costs.
+
+        :param word: A lowercase query word.
+        :return: A dict of word to cost, see the module docstring.
+        """
+        allowed = allowed_edits(word)
+        sound = phonetic_key(word)
+        postings = self._postings
+        found = {}
+        checked = set()
+        for deleted in deletes(word[:PREFIX_LENGTH], allowed):
+            for candidate in self._deletes.get(deleted, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if not postings[candidate]:
+                    continue
+                distance = edit_distance(word, candidate, allowed)
+                if distance <= allowed:
+                    found[candidate] = distance + (0 if phonetic_key(candidate) == sound else 0.5)
+        # Words that only sound alike rank after all spelling matches; their
+        # distance does not matter, so it is not computed.
+        alike = self._sounds.get(sound, ()) if len(sound) > 1 else ()
+        if len(alike) <= PHONETIC_MAX:
+            for candidate in alike:
+                if candidate not in found and postings[candidate]:
+                    found[candidate] = allowed + 1
+        return found
+
+    def search(self, query, limit=LIMIT):
+        """
+        Returns the keys of the names best matching ``query``, best first.
+
+        :param query: One or more words, possibly misspelled; case and accents are ignored.
+        :param limit: Maximum number of keys returned.
+        :return: A list of at most ``limit`` keys.
+        """
+        query_words = words(query)
+        if not query_words:
+            return []
+        matches = [self.candidates(word) for word in query_words]
+        if not all(matches):
+            return []
+
+        # Only names holding a match for every query word are ranked.
+        postings = self._postings
+        keys = None
+        for found in sorted(matches, key=len):
+            matched = set().union(*(postings[word] for word in found))
+            keys = matched if keys is None else keys & matched
+            if not keys:
+                return []
+
+        words_of = self._words_of
+        costs = {}
+        for key in keys:
+            name_words = words_of[key]
+            costs[key] = sum(min(found[w] for w in name_words if w in found) for found in matches)
+
+        extra = len(query_words)
+        order = self._order
+        return heapq.nsmallest(limit, costs,
+                               key=lambda key: (costs[key], len(words_of[key]) - extra, order[key]))
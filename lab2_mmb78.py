@@ -1,3 +1,5 @@
+import schedule
+
 def is_valid_email(email):
     if "@" in email and "." in email.split("@")[1]:
         return True
@@ -6,6 +8,33 @@ def is_valid_email(email):
 def is_non_negative_age(age):
     return isinstance(age, int) and age >= 0
 
+class relationship:
+    # Attribute holding related objects. Objects read from the database carry
+    # the batch they were read in (see relations.py), which loads the attribute
+    # for the whole batch on first access; other objects get default().
+    def __init__(self, default):
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        if self.name not in obj.__dict__:
+            batch = obj.__dict__.get("_batch")
+            if batch is not None:
+                batch.load(self.name)
+            if self.name not in obj.__dict__:
+                obj.__dict__[self.name] = self.default()
+        return obj.__dict__[self.name]
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+
+def is_loaded(obj, name):
+    return name in obj.__dict__
+
 class Person:
     def __init__(self, name, age, email):
         if not is_valid_email(email):
@@ -40,10 +69,13 @@ class Person:
         return cls(data["name"], data["age"], data["email"])
 
 class Student(Person):
+    registered_courses = relationship(list)
+
     def __init__(self, name, age, email, student_id, registered_courses=None):
         super().__init__(name, age, email)
         self.student_id = student_id
-        self.registered_courses = registered_courses if registered_courses is not None else []
+        if registered_courses is not None:
+            self.registered_courses = registered_courses
 
     def register_course(self, course):
         if course not in self.registered_courses:
@@ -70,10 +102,13 @@ class Student(Person):
 
 
 class Instructor(Person):
+    assigned_courses = relationship(list)
+
     def __init__(self, name, age, email, instructor_id, assigned_courses=None):
         super().__init__(name, age, email)
         self.instructor_id = instructor_id
-        self.assigned_courses = assigned_courses if assigned_courses is not None else []
+        if assigned_courses is not None:
+            self.assigned_courses = assigned_courses
 
     def assign_course(self, course):
         if course not in self.assigned_courses:
@@ -95,17 +130,24 @@ class Instructor(Person):
             age=data["age"],
             email=data["email"],
             instructor_id=data["instructor_id"],
-            assigned_courses=[Course(course_id) for course_id in data["assigned_courses"]]
+            assigned_courses=[course_id for course_id in data["assigned_courses"]]
         )
         return instructor
 
 
 class Course:
-    def __init__(self, course_id, course_name, instructor, enrolled_students=None):
+    instructor = relationship(lambda: None)
+    enrolled_students = relationship(list)
+
+    def __init__(self, course_id, course_name, instructor=None, enrolled_students=None, capacity=None, meetings=None):
         self.course_id = course_id
         self.course_name = course_name
-        self.instructor = instructor
-        self.enrolled_students = enrolled_students if enrolled_students is not None else []  
+        if instructor is not None:
+            self.instructor = instructor
+        if enrolled_students is not None:
+            self.enrolled_students = enrolled_students
+        self.capacity = capacity  # None means no limit
+        self.meetings = meetings  # schedule.Meeting list, None if not loaded
 
     def add_student(self, student):
         if student not in self.enrolled_students:
@@ -116,7 +158,9 @@ class Course:
             "course_id": self.course_id,
             "course_name": self.course_name,
             "instructor": self.instructor.to_dict() if self.instructor else None,
-            "enrolled_students": [student.to_dict() for student in self.enrolled_students]  
+            "enrolled_students": [student.to_dict() for student in self.enrolled_students],
+            "capacity": self.capacity,
+            "meetings": schedule.format_meetings(self.meetings) if self.meetings is not None else None
         }
 
     @classmethod
@@ -124,10 +168,13 @@ class Course:
         instructor_data = data.get("instructor")
         instructor = Instructor.from_dict(instructor_data) if instructor_data else None
         enrolled_students = [Student.from_dict(student_data) for student_data in data.get("enrolled_students", [])]
+        meetings = data.get("meetings")
         return cls(
             course_id=data["course_id"],
             course_name=data["course_name"],
             instructor=instructor,
-            enrolled_students=enrolled_students  
+            enrolled_students=enrolled_students,
+            capacity=data.get("capacity"),
+            meetings=schedule.parse_meetings(meetings) if meetings is not None else None
         )
 
@@ -0,0 +1,357 @@
+"""
+In-process runtime metrics in the Prometheus text format.
+
+Metrics are disabled unless :func:`enable` is called or the environment sets
+``SCHOOL_METRICS_PORT`` (serve ``/metrics`` on that local port) or
+``SCHOOL_METRICS_FILE`` (rewrite that file every ``SCHOOL_METRICS_INTERVAL``
+seconds); see :func:`start_from_env`. While disabled, every recording call
+returns after a single flag check.
+
+Counters and histograms are recorded by the data layer and GUI handlers.
+Values that are cheaper to read on demand than to track, such as table row
+counts and database file sizes, come from collectors that only run when the
+metrics are rendered.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger("metrics")
+
+# Upper bounds (in seconds) of the duration histogram buckets.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_enabled = False
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_collectors = []
+_help = {
+    "school_crud_operations_total": "CRUD operations by entity and operation.",
+    "school_enrollments_total": "Students enrolled in courses.",
+    "school_registrations_total": "Registration attempts by result.",
+    "school_edit_conflicts_total": "Edits refused because the record changed since it was read.",
+    "school_write_behind_edits_total": "Edits acknowledged by write-behind buffers.",
+    "school_write_behind_flushes_total": "Group commits of write-behind buffers.",
+    "school_write_behind_flush_seconds": "Time to apply and commit a write-behind batch.",
+    "school_replica_syncs_total": "Copies of the database into the in-memory read replica.",
+    "school_replica_sync_seconds": "Time to copy the database into the read replica.",
+    "school_cache_requests_total": "Cache lookups by cache and result.",
+    "school_cache_hit_ratio": "Fraction of cache lookups that were hits.",
+    "school_table_rows": "Rows per table.",
+    "school_db_file_bytes": "Size of the database file.",
+    "school_db_wal_bytes": "Size of the write-ahead log.",
+    "school_ui_refresh_seconds": "Time spent refreshing a view.",
+    "school_event_loop_lag_seconds": "Delay of the GUI event loop heartbeat.",
+    "school_startup_seconds": "Time from startup to first paint and to interactive.",
+    "school_change_feed_changes_total": "Changed rows delivered by change feeds.",
+    "school_backups_total": "Online backups by result.",
+    "school_backup_seconds": "Time to copy and verify a backup.",
+    "school_backup_bytes_per_second": "Throughput of the last backup.",
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """
+    Increments a counter.
+
+    :param name: Metric name, ending in ``_total``.
+    :param amount: Amount to add.
+    :param labels: Label values identifying the series.
+    """
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    """
+    Sets a gauge to a value.
+
+    :param name: Metric name.
+    :param value: The current value.
+    :param labels: Label values identifying the series.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    """
+    Records a duration in a histogram.
+
+    :param name: Metric name, ending in ``_seconds``.
+    :param seconds: The observed duration.
+    :param labels: Label values identifying the series.
+    """
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * len(DURATION_BUCKETS) + [0, 0.0]
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += 1
+        hist[-1] += seconds
+
+
+def cache_hit(cache):
+    """
+    Counts a hit on the named cache: ``identity_map`` (relations.Loader),
+    ``name_index`` (db_mmb78.fuzzy_search) or ``pragma_profile`` (tuning).
+    """
+    inc("school_cache_requests_total", cache=cache, result="hit")
+
+
+def cache_miss(cache):
+    """Counts a miss on the named cache."""
+    inc("school_cache_requests_total", cache=cache, result="miss")
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Observes the duration of the ``with`` block.
+
+    :param name: Histogram name.
+    :param labels: Label values identifying the series.
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name, **labels):
+    """
+    Decorator that observes the duration of every call.
+
+    :param name: Histogram name.
+    :param labels: Label values identifying the series.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def register_collector(collector):
+    """
+    Registers a callable that yields ``(name, labels, value)`` gauge samples.
+
+    Collectors run only when the metrics are rendered.
+
+    :param collector: A callable taking no arguments.
+    """
+    _collectors.append(collector)
+
+
+def sqlite_collector(path, tables):
+    """
+    Builds a collector for row counts and file sizes of a SQLite database.
+
+    :param path: Path of the database file, or a callable returning it for
+                 databases whose location is configured after import.
+    :param tables: Names of the tables whose rows are counted.
+    :return: A collector suitable for :func:`register_collector`.
+    """
+    def collect():
+        path_now = path() if callable(path) else path
+        database = os.path.basename(path_now)
+        if not os.path.exists(path_now):
+            return
+        yield "school_db_file_bytes", {"database": database}, os.path.getsize(path_now)
+        try:
+            wal_bytes = os.path.getsize(path_now + "-wal")
+        except OSError:
+            # No WAL, or it was checkpointed away meanwhile.
+            wal_bytes = 0
+        yield "school_db_wal_bytes", {"database": database}, wal_bytes
+        conn = sqlite3.connect(path_now)
+        try:
+            for table in tables:
+                try:
+                    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                except sqlite3.OperationalError:
+                    continue
+                yield "school_table_rows", {"database": database, "table": table}, count
+        finally:
+            conn.close()
+    return collect
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def render():
+    """
+    Renders all metrics in the Prometheus text exposition format.
+
+    :return: The exposition text.
+    """
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+
+    for collector in list(_collectors):
+        try:
+            for name, labels, value in collector():
+                gauges[_key(name, labels)] = value
+        except (sqlite3.Error, OSError):
+            logger.exception("metrics collector %r failed", collector)
+            continue
+
+    hits = {}
+    for (name, labels), value in counters.items():
+        if name == "school_cache_requests_total":
+            label_map = dict(labels)
+            totals = hits.setdefault(label_map["cache"], [0, 0])
+            totals[0 if label_map["result"] == "hit" else 1] += value
+    for cache, (hit, miss) in hits.items():
+        gauges[_key("school_cache_hit_ratio", {"cache": cache})] = hit / (hit + miss)
+
+    lines = []
+    for kind, series in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({name for name, _ in series}):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (series_name, labels), value in sorted(series.items()):
+                if series_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for name in sorted({name for name, _ in histograms}):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        for (series_name, labels), hist in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            for bound, count in zip(DURATION_BUCKETS, hist):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {hist[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist[-2]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(port, host="127.0.0.1"):
+    """
+    Enables metrics and serves ``/metrics`` from a daemon thread.
+
+    :param port: Local port to listen on.
+    :param host: Interface to bind, loopback by default.
+    :return: The running HTTP server.
+    """
+    # Imported here so that importing this module stays cheap for the data layer.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    enable()
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def dump_periodically(path, interval=15.0):
+    """
+    Enables metrics and rewrites ``path`` every ``interval`` seconds.
+
+    The file is replaced atomically so scrapers never read a partial dump.
+
+    :param path: Destination file, e.g. for the node exporter textfile collector.
+    :param interval: Seconds between dumps.
+    :return: An event that stops the dumping thread when set.
+    """
+    enable()
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            tmp = path + ".tmp"
+            try:
+                with open(tmp, "w") as file:
+                    file.write(render())
+                os.replace(tmp, path)
+            except Exception:
+                # Keep dumping; the next interval may succeed.
+                logger.exception("writing metrics to %s failed", path)
+
+    threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+    return stop
+
+
+def start_from_env():
+    """
+    Starts the exporters configured in the environment, if any.
+    """
+    port = os.environ.get("SCHOOL_METRICS_PORT")
+    if port:
+        serve(int(port))
+    path = os.environ.get("SCHOOL_METRICS_FILE")
+    if path:
+        dump_periodically(path, float(os.environ.get("SCHOOL_METRICS_INTERVAL", "15")))
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
@@ -0,0 +1,123 @@
+"""
+Helpers for showing a window first and streaming its initial data in.
+
+A :class:`BackgroundLoader` reads rows on a worker thread and hands them over
+in chunks through a queue. The GUI thread calls :meth:`BackgroundLoader.drain`
+from a Tk ``after()`` callback or a ``QTimer``; each call applies chunks only
+until its time slice is used up, so the event loop keeps painting and
+handling input while a large table fills.
+
+:class:`StartupTimer` records time-to-first-paint and time-to-interactive.
+"""
+import logging
+import queue
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger("progressive")
+
+_DONE = object()
+
+
+class StartupTimer:
+    """
+    Measures startup phases relative to the moment it was created.
+
+    :param name: Name of the window being started, used in logs and metrics.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.phases = {}
+
+    def mark(self, phase):
+        """
+        Records the time elapsed until ``phase`` (e.g. ``"first_paint"``).
+
+        Only the first mark of a phase counts.
+
+        :param phase: Name of the phase reached.
+        :return: Seconds since the timer was created.
+        """
+        if phase in self.phases:
+            return self.phases[phase]
+        elapsed = self.phases[phase] = time.perf_counter() - self.start
+        logger.info("%s: %s after %.0f ms", self.name, phase, elapsed * 1000)
+        metrics.observe("school_startup_seconds", elapsed, window=self.name, phase=phase)
+        return elapsed
+
+
+class BackgroundLoader:
+    """
+    Reads rows on a worker thread and delivers them to the GUI thread in chunks.
+
+    :param source: Callable returning an iterable of rows; runs on the worker
+                   thread, so it must open its own database connection.
+    :param chunk_size: Number of rows per chunk.
+    """
+
+    def __init__(self, source, chunk_size=200):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.rows_loaded = 0
+        self.done = False
+        self._queue = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="background-loader", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stops reading; rows already queued are discarded."""
+        self._cancelled.set()
+
+    def _run(self):
+        chunk = []
+        try:
+            for row in self.source():
+                if self._cancelled.is_set():
+                    return
+                chunk.append(row)
+                if len(chunk) >= self.chunk_size:
+                    self._queue.put(chunk)
+                    chunk = []
+            if chunk:
+                self._queue.put(chunk)
+        except Exception as e:
+            self._queue.put(e)
+        finally:
+            self._queue.put(_DONE)
+
+    def drain(self, apply, budget=0.008):
+        """
+        Applies queued chunks on the calling (GUI) thread for up to ``budget`` seconds.
+
+        :param apply: Callable receiving a list of rows.
+        :param budget: Time slice in seconds; at least one chunk is applied.
+        :return: True once every row has been applied or the load was cancelled.
+        :raises Exception: Re-raises an error that occurred on the worker thread.
+        """
+        deadline = time.perf_counter() + budget
+        while not self.done:
+            if self._cancelled.is_set():
+                return True
+            try:
+                chunk = self._queue.get_nowait()
+            except queue.Empty:
+                return False
+            if chunk is _DONE:
+                self.done = True
+            elif isinstance(chunk, Exception):
+                self.done = True
+                raise chunk
+            else:
+                apply(chunk)
+                self.rows_loaded += len(chunk)
+            if time.perf_counter() >= deadline:
+                break
+        return self.done
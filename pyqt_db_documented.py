@@ -3,11 +3,28 @@ from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QComboBox,
     QFormLayout, QLabel, QLineEdit, QPushButton, QDialog, QMessageBox,
     QWidget, QVBoxLayout, QTableWidget, QTableWidgetItem, QTabWidget,
-    QHBoxLayout, QDialogButtonBox, 
+    QHBoxLayout, QDialogButtonBox, QCheckBox,
 )
+from PyQt5.QtCore import Qt, QTimer
 import sys
 import csv
-import sqlite3
+import backup
+import change_feed
+import db
+import metrics
+import repository
+import sql_trace
+import stall_watchdog
+import write_behind
+from db import create_tables, iter_rows
+from progressive import BackgroundLoader, StartupTimer
+from sql_trace import traced_action
+
+# Storage backend, opened in __main__ from SCHOOL_BACKEND (SQLite by default)
+repo = None
+
+# Write-behind buffer of form edits in front of repo, if SCHOOL_WRITE_BEHIND is set
+writes = None
 
 def validate_email(email: str):
     """
@@ -28,9 +45,6 @@ def validate_email(email: str):
 
         
 
-conn = sqlite3.connect("lab4\\EECE435L-lab4-awh15-mmb78\\lab_db.db")
-cursor = conn.cursor()
-
 class StudentForm(QDialog):
     """
     A dialog window for adding a student to the database.
@@ -85,7 +99,7 @@ class StudentForm(QDialog):
         Adds the student to the database.
 
         This method retrieves the values from the input fields, inserts the
-        student details into the SQLite database, and commits the transaction.
+        student details into the repository.
 
         :raises ValueError: If the age input is not an integer.
         
@@ -95,8 +109,16 @@ class StudentForm(QDialog):
         age = int(self.age_input.text())
         email = self.email_input.text()
         student_id = self.student_id_input.text()
-        cursor.execute("INSERT INTO students VALUES (?, ?, ?, ?)", (student_id, name, age, email))
-        conn.commit()
+        try:
+            if writes is not None:
+                # Counted by writes.flush() once committed
+                writes.submit("add", "students", (student_id, name, age, email))
+            else:
+                repo.add("students", (student_id, name, age, email))
+                metrics.inc("school_crud_operations_total", entity="student", op="create")
+        except repository.IntegrityError as e:
+            QMessageBox.warning(self, "Error", f"Student not added: {e}")
+            return
         print(f"Student added: {name}, {age}, {email}, {student_id}")
         self.close()
 
@@ -155,7 +177,7 @@ class InstructorForm(QDialog):
         Adds the instructor to the database.
 
         This method retrieves the values from the input fields, inserts the
-        instructor details into the SQLite database, and commits the transaction.
+        instructor details into the repository.
 
         :raises ValueError: If the age input is not an integer.
         
@@ -165,8 +187,8 @@ class InstructorForm(QDialog):
         age = int(self.age_input.text())
         email = self.email_input.text()
         instructor_id = self.instructor_id_input.text()
-        cursor.execute("INSERT INTO instructors VALUES (?, ?, ?, ?)", (instructor_id, name, age, email))
-        conn.commit()
+        repo.add("instructors", (instructor_id, name, age, email))
+        metrics.inc("school_crud_operations_total", entity="instructor", op="create")
         print(f"Instructor added: {name}, {age}, {email}, {instructor_id}")
         self.close()
 
@@ -221,7 +243,7 @@ class CourseForm(QDialog):
         Adds the course to the database.
 
         This method retrieves the values from the input fields, inserts the
-        course details into the SQLite database, and commits the transaction.
+        course details into the repository.
         
         The course is added with a placeholder (`None`) for any additional course
         details that may be required later.
@@ -230,8 +252,8 @@ class CourseForm(QDialog):
         """
         course_id = self.course_id_input.text()
         course_name = self.course_name_input.text()
-        cursor.execute("INSERT INTO courses VALUES (?, ?, ?)", (course_id, course_name, None))
-        conn.commit()
+        repo.add("courses", (course_id, course_name, None))
+        metrics.inc("school_crud_operations_total", entity="course", op="create")
         print(f"Course added: {course_id}, {course_name}")
         self.close()
 
@@ -275,13 +297,11 @@ class RegisterStudentsForm(QDialog):
         self.course_input = QComboBox()
 
         # Populate student dropdown
-        cursor.execute("SELECT * FROM students")
-        for s in cursor.fetchall():
+        for s in repo.list("students"):
             self.student_input.addItem(f"{s[0]} - {s[1]}")
 
         # Populate course dropdown
-        cursor.execute("SELECT * FROM courses")
-        for c in cursor.fetchall():
+        for c in repo.list("courses"):
             self.course_input.addItem(f"{c[0]} - {c[1]}")
 
         layout.addRow(QLabel("Student:"), self.student_input)
@@ -311,14 +331,13 @@ class RegisterStudentsForm(QDialog):
         course_id = self.course_input.currentText().split("-")[0].strip()
 
         # Verify student and course exist
-        cursor.execute("SELECT * FROM students WHERE student_id=?", (student_id,))
-        s = cursor.fetchone()
-        cursor.execute("SELECT * FROM courses WHERE course_id=?", (course_id,))
-        c = cursor.fetchone()
+        s = repo.get("students", student_id)
+        c = repo.get("courses", course_id)
 
         if s and c:
-            cursor.execute("INSERT INTO student_courses VALUES (?, ?)", (student_id, course_id))
-            conn.commit()
+            repo.enroll(student_id, course_id)
+            metrics.inc("school_crud_operations_total", entity="enrollment", op="create")
+            metrics.inc("school_enrollments_total")
             print(f"Student {s[1]} has been registered in course {c[1]}.")
         else:
             print("Invalid student or course.")
@@ -366,13 +385,11 @@ class AssignInstructorsForm(QDialog):
         self.course_input = QComboBox()
 
         # Populate instructor dropdown
-        cursor.execute("SELECT * FROM instructors")
-        for i in cursor.fetchall():
+        for i in repo.list("instructors"):
             self.instructor_input.addItem(f"{i[0]} - {i[1]}")
 
         # Populate course dropdown
-        cursor.execute("SELECT * FROM courses")
-        for c in cursor.fetchall():
+        for c in repo.list("courses"):
             self.course_input.addItem(f"{c[0]} - {c[1]}")
 
         layout.addRow(QLabel("Instructor:"), self.instructor_input)
@@ -401,13 +418,12 @@ class AssignInstructorsForm(QDialog):
         course_id = self.course_input.currentText().split("-")[0].strip()
 
         # Verify instructor and course exist
-        cursor.execute("SELECT * FROM instructors WHERE instructor_id=?", (instructor_id,))
-        i = cursor.fetchone()
-        cursor.execute("SELECT * FROM courses WHERE course_id=?", (course_id,))
-        c = cursor.fetchone()
+        i = repo.get("instructors", instructor_id)
+        c = repo.get("courses", course_id)
 
         if i and c:
-            cursor.execute("UPDATE courses SET instructor_id=? WHERE course_id=?", (instructor_id, course_id))
+            repo.update("courses", (course_id, c[1], instructor_id))
+            metrics.inc("school_crud_operations_total", entity="course", op="update")
             print(f"Instructor {i[1]} has been assigned to course {c[1]}.")
         else:
             print("Invalid instructor or course.")
@@ -417,6 +433,107 @@ class AssignInstructorsForm(QDialog):
         
         
 
+class ConflictDialog(QDialog):
+    """
+    Shows a record someone else changed next to the user's edit of it.
+
+    Opened when a version-checked update is refused (see :mod:`versions`).
+    The user can overwrite the other change with their own, load the other
+    change into the edit form to edit it again, or go back to the form.
+
+    :param error: The :class:`repository.StaleRecordError` of the refused update.
+    :param mine: The record as the user edited it.
+    :param labels: Labels of the fields of the record, in order.
+    """
+
+    OVERWRITE = 2
+    RELOAD = 3
+
+    def __init__(self, error, mine, labels):
+        """
+        Initializes the ConflictDialog.
+
+        :param error: The :class:`repository.StaleRecordError` of the refused update.
+        :param mine: The record as the user edited it.
+        :param labels: Labels of the fields of the record, in order.
+        """
+        super().__init__()
+        self.setWindowTitle("Edit Conflict")
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel(f"Someone else changed {error.record_id} since you opened it."))
+
+        table = QTableWidget(len(labels), 2)
+        table.setHorizontalHeaderLabels(["Yours", "Theirs"])
+        table.setVerticalHeaderLabels(labels)
+        for row_idx, (value, other) in enumerate(zip(mine, error.current)):
+            for col_idx, data in enumerate((value, other)):
+                item = QTableWidgetItem(str(data))
+                if value != other:
+                    font = item.font()
+                    font.setBold(True)
+                    item.setFont(font)
+                table.setItem(row_idx, col_idx, item)
+        layout.addWidget(table)
+
+        button_box = QDialogButtonBox()
+        button_box.addButton("Overwrite theirs", QDialogButtonBox.AcceptRole).clicked.connect(
+            lambda: self.done(self.OVERWRITE))
+        button_box.addButton("Load theirs", QDialogButtonBox.ResetRole).clicked.connect(
+            lambda: self.done(self.RELOAD))
+        button_box.addButton("Keep editing", QDialogButtonBox.RejectRole).clicked.connect(self.reject)
+        layout.addWidget(button_box)
+        self.setLayout(layout)
+
+
+def save_edit(dialog, kind, row, version, buffered=False):
+    """
+    Saves an edit dialog's record, checked against the version it was read at.
+
+    If someone else changed the record meanwhile, a :class:`ConflictDialog`
+    asks the user what to do.
+
+    :param dialog: The edit dialog; it must have ``version``, ``labels`` and
+                   ``show_record(row)``.
+    :param kind: One of :data:`repository.KINDS`.
+    :param row: The edited record.
+    :param version: The version the record was read at.
+    :param buffered: Go through the write-behind buffer, if there is one.
+    :return: True if the record was saved.
+    """
+    try:
+        if buffered and writes is not None:
+            writes.submit("update", kind, row, version)
+        else:
+            repo.update(kind, row, version)
+        return True
+    except repository.StaleRecordError as e:
+        metrics.inc("school_edit_conflicts_total", kind=kind)
+        if e.current is None:
+            QMessageBox.warning(dialog, "Edit Conflict", f"{row[0]} was deleted by someone else.")
+            dialog.reject()
+            return False
+        choice = ConflictDialog(e, row, dialog.labels).exec_()
+        if choice == ConflictDialog.OVERWRITE:
+            dialog.version = e.version
+            return save_edit(dialog, kind, row, e.version, buffered)
+        if choice == ConflictDialog.RELOAD:
+            dialog.version = e.version
+            dialog.show_record(e.current)
+        return False
+    except repository.IntegrityError as e:
+        QMessageBox.warning(dialog, "Error", f"Not updated: {e}")
+        return False
+
+
+def edit_source():
+    """Returns where edits are read from and go to: the write-behind buffer if enabled, else the repository."""
+    return repo if writes is None else writes
+
+
+# Tab of DisplayRecordsWindow showing each table
+TAB_INDEX = {"students": 0, "instructors": 1, "courses": 2}
+
+
 class DisplayRecordsWindow(QMainWindow):
     """
     A main window for displaying and managing records in the School Management System.
@@ -434,8 +551,25 @@ class DisplayRecordsWindow(QMainWindow):
 
         This method sets the window title and dimensions, creates tabs for students,
         instructors, and courses, and sets up the respective UI elements for each tab.
+        The records are not loaded here: the visible tab is streamed in right after
+        the window is painted, and the other tabs when they are first selected.
+        Afterwards a change feed keeps the loaded tabs up to date.
         """
         super().__init__()
+        self.startup_timer = StartupTimer("DisplayRecordsWindow")
+        self.loaded_tabs = set()
+        self.loaders = {}
+        self.pending_changes = {}
+
+        # Created before any tab loads so changes committed during a load are not
+        # missed. Only the SQLite backend has a change log.
+        self.feed = None
+        if isinstance(repo, repository.SqliteRepository):
+            self.feed = change_feed.ChangeFeed(db.DB_PATH, db.CHANGE_TABLES)
+            self.feed.subscribe(self.apply_changes)
+            self.feed_timer = QTimer(self)
+            self.feed_timer.timeout.connect(self.feed.poll)
+            self.feed_timer.start(change_feed.POLL_MS)
 
         self.setWindowTitle("School Management System")
         self.setGeometry(100, 100, 800, 600)
@@ -455,12 +589,183 @@ class DisplayRecordsWindow(QMainWindow):
         self.setup_instructor_tab()
         self.setup_course_tab()
 
+        self.tabs.currentChanged.connect(self.load_tab)
+        QTimer.singleShot(0, self.first_paint)
+
+    def first_paint(self):
+        """
+        Records the first paint and starts loading the visible tab.
+        """
+        self.startup_timer.mark("first_paint")
+        self.load_tab(self.tabs.currentIndex())
+
+    def load_tab(self, index):
+        """
+        Streams the records of a tab into its table the first time it is shown.
+
+        A background loader reads the rows through its own connection while a
+        zero-interval QTimer appends them in time-sliced chunks, so the window
+        keeps repainting and handling input during the load. Rows of an
+        in-memory read replica are read right away instead.
+
+        :param index: Index of the tab in the tab widget.
+        """
+        if index in self.loaded_tabs:
+            return
+        self.loaded_tabs.add(index)
+
+        table, kind, edit, delete = self.tab_info(index)
+        table.setRowCount(0)
+        if isinstance(repo, repository.SqliteRepository) and not isinstance(repo, repository.ReplicaRepository):
+            query = f"SELECT {', '.join(repository.FIELDS[kind])} FROM {kind}"
+            source = lambda: sql_trace.iter_action("DisplayRecordsWindow.load_tab", iter_rows(query))
+        else:
+            # Other backends are not thread-safe, and the replica is in memory;
+            # take the rows here and only hand them over there.
+            rows = repo.list(kind)
+            source = lambda: rows
+        loader = self.loaders[index] = BackgroundLoader(source).start()
+        timer = QTimer(self)
+
+        def pump():
+            if loader.drain(lambda rows: self.append_rows(table, rows, edit, delete)):
+                timer.stop()
+                if self.loaders.get(index) is loader:
+                    del self.loaders[index]
+                    self.apply_tab_changes(index, self.pending_changes.pop(index, []))
+                self.startup_timer.mark("interactive")
+
+        timer.timeout.connect(pump)
+        timer.start(0)
+
+    def cancel_stream(self, index):
+        """
+        Stops a streaming load of a tab that is about to be reloaded in full.
+
+        :param index: Index of the tab in the tab widget.
+        """
+        self.loaded_tabs.add(index)
+        self.pending_changes.pop(index, None)
+        loader = self.loaders.pop(index, None)
+        if loader:
+            loader.cancel()
+
+    def tab_info(self, index):
+        """
+        Returns the table, repository kind and Edit/Delete handlers of a tab.
+
+        :param index: Index of the tab in the tab widget.
+        :return: A ``(table, kind, edit, delete)`` tuple; courses have no handlers.
+        """
+        return [
+            (self.student_table, "students", self.edit_student, self.delete_student),
+            (self.instructor_table, "instructors", self.edit_instructor, self.delete_instructor),
+            (self.course_table, "courses", None, None),
+        ][index]
+
+    def apply_changes(self, changes):
+        """
+        Applies the rows reported by the change feed to the loaded tabs.
+
+        Tabs that were never shown are skipped since they load fresh data anyway;
+        changes for a tab that is still streaming are applied once it finishes.
+
+        :param changes: List of change_feed.Change from one poll.
+        """
+        if any(change.op == "reset" for change in changes):
+            reloads = {0: self.load_students, 1: self.load_instructors, 2: self.load_courses}
+            for index in sorted(self.loaded_tabs):
+                reloads[index]()
+            return
+
+        by_tab = {}
+        for change in changes:
+            index = TAB_INDEX.get(change.table)
+            if index in self.loaded_tabs:
+                by_tab.setdefault(index, []).append(change)
+
+        for index, tab_changes in by_tab.items():
+            if index in self.loaders:
+                self.pending_changes.setdefault(index, []).extend(tab_changes)
+            else:
+                self.apply_tab_changes(index, tab_changes)
+
+    def apply_tab_changes(self, index, changes):
+        """
+        Updates, removes or appends the changed rows of one tab.
+
+        While search results are shown, rows that are not already displayed
+        are not added.
+
+        :param index: Index of the tab in the tab widget.
+        :param changes: The changes of that tab's table.
+        """
+        table, _, edit, delete = self.tab_info(index)
+        searching = bool([self.student_search_input, self.instructor_search_input,
+                          self.course_search_input][index].text())
+        for change in changes:
+            row_idx = self.find_row(table, change.key[0])
+            if change.op == "delete":
+                if row_idx is not None:
+                    table.removeRow(row_idx)
+            elif row_idx is not None:
+                self.set_row(table, row_idx, change.row, edit, delete)
+            elif not searching:
+                self.append_rows(table, [change.row], edit, delete)
+
+    def find_row(self, table, record_id):
+        """
+        Returns the index of the row whose ID column holds ``record_id``, or None.
+        """
+        for item in table.findItems(str(record_id), Qt.MatchExactly):
+            if item.column() == 0:
+                return item.row()
+        return None
+
+    def append_rows(self, table, rows, edit=None, delete=None):
+        """
+        Appends rows to a table, with Edit/Delete buttons if handlers are given.
+
+        :param table: The QTableWidget to append to.
+        :param rows: Row tuples as returned by the database.
+        :param edit: Handler called with the row when Edit is clicked, or None.
+        :param delete: Handler called with the row when Delete is clicked, or None.
+        """
+        start = table.rowCount()
+        table.setRowCount(start + len(rows))
+        for row_idx, row_data in enumerate(rows, start):
+            self.set_row(table, row_idx, row_data, edit, delete)
+
+    def set_row(self, table, row_idx, row_data, edit=None, delete=None):
+        """
+        Fills one table row, with Edit/Delete buttons if handlers are given.
+        """
+        for col_idx, data in enumerate(row_data):
+            table.setItem(row_idx, col_idx, QTableWidgetItem(str(data)))
+
+        if edit is not None:
+            edit_button = QPushButton("Edit")
+            edit_button.clicked.connect(lambda _, row=row_data: edit(row))
+            delete_button = QPushButton("Delete")
+            delete_button.clicked.connect(lambda _, row=row_data: delete(row))
+
+            table.setCellWidget(row_idx, 4, self.create_action_buttons(edit_button, delete_button))
+
+    def closeEvent(self, event):
+        """
+        Stops polling the change feed and closes its connection.
+        """
+        if self.feed is not None:
+            self.feed_timer.stop()
+            self.feed.close()
+        super().closeEvent(event)
+
     def setup_student_tab(self):
         """
         Sets up the user interface for the students tab.
 
-        This method creates a layout with a search bar and a table to display student records.
-        It populates the table with student data and connects the search functionality.
+        This method creates a layout with a search bar and a table to display student records
+        and connects the search functionality. The table is filled by `load_tab()`.
         """
         layout = QVBoxLayout()
 
@@ -468,7 +773,9 @@ class DisplayRecordsWindow(QMainWindow):
         self.student_search_input = QLineEdit()
         search_button = QPushButton("Search")
         search_button.clicked.connect(self.search_students)
+        self.student_fuzzy_box = QCheckBox("Fuzzy")
         search_layout.addWidget(self.student_search_input)
+        search_layout.addWidget(self.student_fuzzy_box)
         search_layout.addWidget(search_button)
 
         self.student_table = QTableWidget()
@@ -479,18 +786,19 @@ class DisplayRecordsWindow(QMainWindow):
         layout.addWidget(self.student_table)
 
         self.student_tab.setLayout(layout)
-        self.load_students()
 
+    @traced_action
+    @metrics.timed("school_ui_refresh_seconds", view="students")
     def load_students(self):
         """
         Loads student records from the database and populates the student table.
 
-        This method executes a query to fetch all student records, clears the current
+        This method fetches all student records from the repository, clears the current
         table contents, and inserts the new data along with action buttons for editing
         and deleting records.
         """
-        cursor.execute("SELECT * FROM students")
-        rows = cursor.fetchall()
+        self.cancel_stream(0)
+        rows = repo.list("students")
 
         self.student_table.setRowCount(len(rows))
         for row_idx, row_data in enumerate(rows):
@@ -519,18 +827,30 @@ class DisplayRecordsWindow(QMainWindow):
         container.setLayout(action_layout)
         return container
 
+    def find_records(self, kind, text, fuzzy_box):
+        """
+        Returns the records matching a search field.
+
+        :param kind: Repository kind searched.
+        :param text: The search input.
+        :param fuzzy_box: The tab's "Fuzzy" checkbox; when checked, misspelled and
+                          sound-alike names match too and the closest come first.
+        :return: A list of row tuples.
+        """
+        if fuzzy_box.isChecked():
+            return repo.fuzzy_search(kind, text)
+        return repo.search(kind, text)
+
     def search_students(self):
         """
         Searches for students based on the input in the search field.
 
-        This method retrieves students whose names or IDs match the search input and
-        updates the student table to display the results.
+        This method retrieves students whose names or IDs match the search input, or
+        the closest names when "Fuzzy" is checked, and updates the student table to display
+        the results.
         """
         search_value = self.student_search_input.text()
-
-        query = "SELECT * FROM students WHERE name LIKE ? OR student_id = ?"
-        cursor.execute(query, ('%' + search_value + '%', search_value))
-        rows = cursor.fetchall()
+        rows = self.find_records("students", search_value, self.student_fuzzy_box)
 
         self.student_table.setRowCount(len(rows))
         for row_idx, row_data in enumerate(rows):
@@ -563,16 +883,16 @@ class DisplayRecordsWindow(QMainWindow):
         confirm = QMessageBox.question(self, "Delete Student", f"Are you sure you want to delete {row[1]}?", 
                                        QMessageBox.Yes | QMessageBox.No)
         if confirm == QMessageBox.Yes:
-            cursor.execute("DELETE FROM students WHERE id=?", (row[0],))
-            conn.commit()
+            repo.delete("students", row[0])
+            metrics.inc("school_crud_operations_total", entity="student", op="delete")
             self.load_students()
 
     def setup_instructor_tab(self):
         """
         Sets up the user interface for the instructors tab.
 
-        This method creates a layout with a search bar and a table to display instructor records.
-        It populates the table with instructor data and connects the search functionality.
+        This method creates a layout with a search bar and a table to display instructor records
+        and connects the search functionality. The table is filled by `load_tab()`.
         """
         layout = QVBoxLayout()
 
@@ -580,7 +900,9 @@ class DisplayRecordsWindow(QMainWindow):
         self.instructor_search_input = QLineEdit()
         search_button = QPushButton("Search")
         search_button.clicked.connect(self.search_instructors)
+        self.instructor_fuzzy_box = QCheckBox("Fuzzy")
         search_layout.addWidget(self.instructor_search_input)
+        search_layout.addWidget(self.instructor_fuzzy_box)
         search_layout.addWidget(search_button)
 
         self.instructor_table = QTableWidget()
@@ -591,18 +913,19 @@ class DisplayRecordsWindow(QMainWindow):
         layout.addWidget(self.instructor_table)
 
         self.instructor_tab.setLayout(layout)
-        self.load_instructors()
 
+    @traced_action
+    @metrics.timed("school_ui_refresh_seconds", view="instructors")
     def load_instructors(self):
         """
         Loads instructor records from the database and populates the instructor table.
 
-        This method executes a query to fetch all instructor records, clears the current
+        This method fetches all instructor records from the repository, clears the current
         table contents, and inserts the new data along with action buttons for editing
         and deleting records.
         """
-        cursor.execute("SELECT * FROM instructors")
-        rows = cursor.fetchall()
+        self.cancel_stream(1)
+        rows = repo.list("instructors")
 
         self.instructor_table.setRowCount(len(rows))
         for row_idx, row_data in enumerate(rows):
@@ -620,14 +943,12 @@ class DisplayRecordsWindow(QMainWindow):
         """
         Searches for instructors based on the input in the search field.
 
-        This method retrieves instructors whose names or IDs match the search input and
-        updates the instructor table to display the results.
+        This method retrieves instructors whose names or IDs match the search input, or
+        the closest names when "Fuzzy" is checked, and updates the instructor table to display
+        the results.
         """
         search_value = self.instructor_search_input.text()
-
-        query = "SELECT * FROM instructors WHERE name LIKE ? OR instructor_id = ?"
-        cursor.execute(query, ('%' + search_value + '%', search_value))
-        rows = cursor.fetchall()
+        rows = self.find_records("instructors", search_value, self.instructor_fuzzy_box)
 
         self.instructor_table.setRowCount(len(rows))
         for row_idx, row_data in enumerate(rows):
@@ -660,16 +981,16 @@ class DisplayRecordsWindow(QMainWindow):
         confirm = QMessageBox.question(self, "Delete Instructor", f"Are you sure you want to delete {row[1]}?", 
                                        QMessageBox.Yes | QMessageBox.No)
         if confirm == QMessageBox.Yes:
-            cursor.execute("DELETE FROM instructors WHERE id=?", (row[0],))
-            conn.commit()
+            repo.delete("instructors", row[0])
+            metrics.inc("school_crud_operations_total", entity="instructor", op="delete")
             self.load_instructors()
 
     def setup_course_tab(self):
         """
         Sets up the user interface for the courses tab.
 
-        This method creates a layout with a search bar and a table to display course records.
-        It populates the table with course data and connects the search functionality.
+        This method creates a layout with a search bar and a table to display course records
+        and connects the search functionality. The table is filled by `load_tab()`.
         """
         layout = QVBoxLayout()
 
@@ -677,7 +998,9 @@ class DisplayRecordsWindow(QMainWindow):
         self.course_search_input = QLineEdit()
         search_button = QPushButton("Search")
         search_button.clicked.connect(self.search_courses)
+        self.course_fuzzy_box = QCheckBox("Fuzzy")
         search_layout.addWidget(self.course_search_input)
+        search_layout.addWidget(self.course_fuzzy_box)
         search_layout.addWidget(search_button)
 
         self.course_table = QTableWidget()
@@ -688,17 +1011,18 @@ class DisplayRecordsWindow(QMainWindow):
         layout.addWidget(self.course_table)
 
         self.course_tab.setLayout(layout)
-        self.load_courses()
 
+    @traced_action
+    @metrics.timed("school_ui_refresh_seconds", view="courses")
     def load_courses(self):
         """
         Loads course records from the database and populates the course table.
 
-        This method executes a query to fetch all course records, clears the current
+        This method fetches all course records from the repository, clears the current
         table contents, and inserts the new data.
         """
-        cursor.execute("SELECT * FROM courses")
-        rows = cursor.fetchall()
+        self.cancel_stream(2)
+        rows = repo.list("courses")
 
         self.course_table.setRowCount(len(rows))
         for row_idx, row_data in enumerate(rows):
@@ -709,14 +1033,12 @@ class DisplayRecordsWindow(QMainWindow):
         """
         Searches for courses based on the input in the search field.
 
-        This method retrieves courses whose names or IDs match the search input and
-        updates the course table to display the results.
+        This method retrieves courses whose names or IDs match the search input, or
+        the closest names when "Fuzzy" is checked, and updates the course table to display
+        the results.
         """
         search_value = self.course_search_input.text()
-
-        query = "SELECT * FROM courses WHERE course_name LIKE ? OR course_id = ?"
-        cursor.execute(query, ('%' + search_value + '%', search_value))
-        rows = cursor.fetchall()
+        rows = self.find_records("courses", search_value, self.course_fuzzy_box)
 
         self.course_table.setRowCount(len(rows))
         for row_idx, row_data in enumerate(rows):
@@ -736,22 +1058,30 @@ class EditStudentDialog(QDialog):
     :param student_data: A tuple containing the current data of the student to be edited.
     """
 
+    labels = ["ID", "Name", "Age", "Email"]
+
     def __init__(self, student_data):
         """
         Initializes the EditStudentDialog.
 
+        The student is read again along with its version, as the table may
+        not show the latest changes yet.
+
         :param student_data: A tuple containing the current data of the student to be edited.
         """
         super().__init__()
 
-        self.student_data = student_data
+        # Read before the record, see repository.Repository.version
+        self.version = edit_source().version("students", student_data[0])
+        self.student_data = edit_source().get("students", student_data[0]) or student_data
 
         self.setWindowTitle("Edit Student")
         layout = QFormLayout()
 
         self.id_field = QLabel(str(student_data[0]))
-        self.name_field = QLineEdit(student_data[1])
-        self.age_field = QLineEdit(str(student_data[2]))
+        self.name_field = QLineEdit()
+        self.age_field = QLineEdit()
+        self.show_record(self.student_data)
 
         layout.addRow("ID", self.id_field)
         layout.addRow("Name", self.name_field)
@@ -764,17 +1094,31 @@ class EditStudentDialog(QDialog):
 
         self.setLayout(layout)
 
+    def show_record(self, student_data):
+        """
+        Fills the input fields from a student record.
+
+        :param student_data: A tuple containing the data of the student.
+        """
+        self.student_data = student_data
+        self.name_field.setText(student_data[1])
+        self.age_field.setText(str(student_data[2]))
+
     def accept(self):
         """
         Updates the student record in the database with the new values from the input fields.
 
-        This method is called when the user clicks the OK button. It executes an UPDATE
-        query to change the name and age of the student in the database based on the
-        provided student ID.
-        """
-        cursor.execute("UPDATE students SET name=?, age=? WHERE student_id=?", 
-                       (self.name_field.text(), self.age_field.text(), self.student_data[0]))
-        conn.commit()
+        This method is called when the user clicks the OK button. It updates the
+        name and age of the student with the provided student ID in the repository,
+        unless someone else changed the student since the dialog read it; the
+        user then resolves the conflict in a :class:`ConflictDialog`.
+        """
+        row = (self.student_data[0], self.name_field.text(), int(self.age_field.text()), self.student_data[3])
+        if not save_edit(self, "students", row, self.version, buffered=True):
+            return
+        if writes is None:
+            # Counted by writes.flush() once committed otherwise
+            metrics.inc("school_crud_operations_total", entity="student", op="update")
         super().accept()
 
 
@@ -783,32 +1127,40 @@ class EditInstructorDialog(QDialog):
     A dialog for editing instructor records.
 
     This class provides a user interface for editing instructor information, allowing
-    the user to change the name and subject of a selected instructor.
+    the user to change the name and age of a selected instructor.
 
     :param QDialog: Inherits from QDialog to provide a modal dialog interface.
     :param instructor_data: A tuple containing the current data of the instructor to be edited.
     """
 
+    labels = ["ID", "Name", "Age", "Email"]
+
     def __init__(self, instructor_data):
         """
         Initializes the EditInstructorDialog.
 
+        The instructor is read again along with its version, as the table may
+        not show the latest changes yet.
+
         :param instructor_data: A tuple containing the current data of the instructor to be edited.
         """
         super().__init__()
 
-        self.instructor_data = instructor_data
+        # Read before the record, see repository.Repository.version
+        self.version = repo.version("instructors", instructor_data[0])
+        self.instructor_data = repo.get("instructors", instructor_data[0]) or instructor_data
 
         self.setWindowTitle("Edit Instructor")
         layout = QFormLayout()
 
         self.id_field = QLabel(str(instructor_data[0]))
-        self.name_field = QLineEdit(instructor_data[1])
-        self.subject_field = QLineEdit(instructor_data[2])
+        self.name_field = QLineEdit()
+        self.age_field = QLineEdit()
+        self.show_record(self.instructor_data)
 
         layout.addRow("ID", self.id_field)
         layout.addRow("Name", self.name_field)
-        layout.addRow("Subject", self.subject_field)
+        layout.addRow("Age", self.age_field)
 
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         button_box.accepted.connect(self.accept)
@@ -817,17 +1169,29 @@ class EditInstructorDialog(QDialog):
 
         self.setLayout(layout)
 
+    def show_record(self, instructor_data):
+        """
+        Fills the input fields from an instructor record.
+
+        :param instructor_data: A tuple containing the data of the instructor.
+        """
+        self.instructor_data = instructor_data
+        self.name_field.setText(instructor_data[1])
+        self.age_field.setText(str(instructor_data[2]))
+
     def accept(self):
         """
         Updates the instructor record in the database with the new values from the input fields.
 
-        This method is called when the user clicks the OK button. It executes an UPDATE
-        query to change the name and subject of the instructor in the database based on the
-        provided instructor ID.
+        This method is called when the user clicks the OK button. It updates the
+        name and age of the instructor with the provided instructor ID in the repository,
+        unless someone else changed the instructor since the dialog read it; the
+        user then resolves the conflict in a :class:`ConflictDialog`.
         """
-        cursor.execute("UPDATE instructors SET name=?, subject=? WHERE instructor_id=?", 
-                       (self.name_field.text(), self.subject_field.text(), self.instructor_data[0]))
-        conn.commit()
+        row = (self.instructor_data[0], self.name_field.text(), int(self.age_field.text()), self.instructor_data[3])
+        if not save_edit(self, "instructors", row, self.version):
+            return
+        metrics.inc("school_crud_operations_total", entity="instructor", op="update")
         super().accept()
    
         
@@ -850,11 +1214,34 @@ class MainWindow(QMainWindow):
     def __init__(self):
         """
         Initializes the MainWindow and sets up the UI.
+
+        With a write-behind buffer, a timer commits the buffered edits in
+        groups; the change feed of the records window then shows them. With
+        an in-memory read replica, another timer copies in the changes of
+        other apps.
         """
         super().__init__()
         self.setWindowTitle("School Management System")
         self.setGeometry(100, 100, 400, 200)
         self.init_ui()
+        if writes is not None:
+            writes.on_error = self.show_write_error
+            self.flush_timer = QTimer(self)
+            self.flush_timer.timeout.connect(writes.flush)
+            self.flush_timer.start(write_behind.FLUSH_MS)
+        if isinstance(repo, repository.ReplicaRepository):
+            self.sync_timer = QTimer(self)
+            self.sync_timer.timeout.connect(repo.sync)
+            self.sync_timer.start(repository.REPLICA_SYNC_MS)
+
+    def show_write_error(self, op, kind, row, error):
+        """
+        Reports a buffered edit that could not be committed.
+
+        It passed validation when submitted, so another app must have changed
+        the same record since.
+        """
+        QMessageBox.warning(self, "Edit lost", f"Could not {op} {row[0]} in {kind}: {error}")
 
     def init_ui(self):
         """
@@ -960,6 +1347,8 @@ class MainWindow(QMainWindow):
         students, instructors, and courses, including enrolled students for each course.
         """
         file_path = "lab2/school_data.csv"
+        if writes is not None:
+            writes.flush()
 
         try:
             with open(file_path, mode='w', newline='') as file:
@@ -967,27 +1356,23 @@ class MainWindow(QMainWindow):
 
                 writer.writerow(["Students"])
                 writer.writerow(["Name", "Age", "Email", "Student ID"])
-                cursor.execute("SELECT * FROM students")
-                for student in cursor.fetchall():
+                for student in repo.list("students"):
                     writer.writerow([student[1], student[2], student[3], student[0]])
 
                 writer.writerow([])
 
                 writer.writerow(["Instructors"])
                 writer.writerow(["Name", "Age", "Email", "Instructor ID"])
-                cursor.execute("SELECT * FROM instructors")
-                for instructor in cursor.fetchall():
+                for instructor in repo.list("instructors"):
                     writer.writerow([instructor[1], instructor[2], instructor[3], instructor[0]])
 
                 writer.writerow([])
 
                 writer.writerow(["Courses"])
                 writer.writerow(["Course ID", "Course Name", "Instructor", "Enrolled Students"])
-                cursor.execute("SELECT * FROM courses")
-                for course in cursor.fetchall():
-                    instructor_name = cursor.execute("SELECT name FROM instructors WHERE instructor_id = ?", (course[2],)).fetchone()[0] if course[2] else "None"
-                    cursor.execute("SELECT * FROM student_courses WHERE course_id = ?", (course[0],))
-                    enrolled_students_names = ', '.join([s[0] for s in cursor.fetchall()])
+                for course in repo.list("courses"):
+                    instructor_name = repo.get("instructors", course[2])[1] if course[2] else "None"
+                    enrolled_students_names = ', '.join(repo.enrolled_students(course[0]))
                     writer.writerow([course[0], course[1], instructor_name, enrolled_students_names])
 
             QMessageBox.information(self, "Success", f"Data exported successfully to {file_path}.")
@@ -997,7 +1382,20 @@ class MainWindow(QMainWindow):
 
 
 if __name__ == "__main__":
+    metrics.start_from_env()
+    repo = repository.from_env(db.DB_PATH, "student_courses")
+    if isinstance(repo, repository.SqliteRepository):
+        create_tables()
+        backup.start_from_env(db.DB_PATH)
+    writes = write_behind.from_env(repo, getattr(repo, "path", db.DB_PATH) + ".edits")
     app = QApplication(sys.argv)
+    watchdog = stall_watchdog.from_env(stall_watchdog.QtWatchdog)
     main_window = MainWindow()
     main_window.show()
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    if writes is not None:
+        writes.close()
+    if sql_trace.is_enabled():
+        print(sql_trace.report())
+        print(sql_trace.n_plus_one_report())
+    sys.exit(exit_code)
@@ -1,341 +1,53 @@
-import json
-import re
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QComboBox,
     QFormLayout, QLabel, QLineEdit, QPushButton, QDialog, QMessageBox,
-    QTabWidget, QVBoxLayout, QTableWidget, QTableWidgetItem
+    QTabWidget, QVBoxLayout, QTableView, QAbstractItemView, QHBoxLayout, QCheckBox
 )
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer
 
 import sys
 import csv
+import db_mmb78
+import repository
+import school_data
+import stall_watchdog
+from fuzzy_index import FuzzyIndex
+from trigram_index import TrigramIndex
+from school_data import Student, Instructor, Course, students, instructors, courses, load_data
 
-class Person:
-    """
-    Represents a person with a name, age, and email address.
-
-    :param name: The name of the person.
-    :param age: The age of the person.
-    :param email: The email address of the person.
-    """
-
-    def __init__(self, name: str, age: int, email: str):
-        """
-        Initializes a new Person instance.
-
-        :param name: The name of the person.
-        :param age: The age of the person (must be non-negative).
-        :param email: The email address of the person (must be valid).
-        """
-        self.name = name
-        self.age = self.validate_age(age)
-        self._email = self.validate_email(email)
-
-    def introduce(self):
-        """
-        Introduces the person by printing their name and age.
-        """
-        print(f"Hello, my name is {self.name}. I am {self.age} years old.")
-
-    @staticmethod
-    def validate_email(email: str):
-        """
-        Validates the format of an email address.
-
-        :param email: The email address to validate.
-        :raises ValueError: If the email format is invalid.
-        :return: The validated email address.
-        """
-        if re.match(r'^[\w\.-]+@[\w\.-]+\.\w+$', email):
-            return email
-        else:
-            raise ValueError("Invalid email format")
-
-    @staticmethod
-    def validate_age(age: int):
-        """
-        Validates the age of a person.
-
-        :param age: The age to validate.
-        :raises ValueError: If the age is negative.
-        :return: The validated age.
-        """
-        if age < 0:
-            raise ValueError("Age cannot be negative")
-        return age
-
-    def to_dict(self):
-        """
-        Converts the Person instance to a dictionary.
-
-        :return: A dictionary representation of the person.
-        """
-        return {
-            'name': self.name,
-            'age': self.age,
-            'email': self._email
-        }
-
-    @classmethod
-    def from_dict(cls, data):
-        """
-        Creates a Person instance from a dictionary.
-
-        :param data: A dictionary containing the person's data.
-        :return: A new Person instance.
-        """
-        return cls(data['name'], data['age'], data['email'])
-
-
-class Student(Person):
-    """
-    Represents a student, inheriting from the Person class.
-
-    :param name: The name of the student.
-    :param age: The age of the student.
-    :param email: The email address of the student.
-    :param student_id: The unique identifier for the student.
-    """
-
-    def __init__(self, name: str, age: int, email: str, student_id: str):
-        """
-        Initializes a new Student instance.
-
-        :param name: The name of the student.
-        :param age: The age of the student (must be non-negative).
-        :param email: The email address of the student (must be valid).
-        :param student_id: The unique identifier for the student.
-        """
-        super().__init__(name, age, email)
-        self.student_id = student_id
-        self.registered_courses = []
-
-    def register_course(self, course):
-        """
-        Registers a course for the student.
-
-        :param course: The course to register.
-        """
-        self.registered_courses.append(course)
-        course.add_student(self)
-        print(f"Course {course.course_name} has been registered for student {self.name}.")
-
-    def to_dict(self):
-        """
-        Converts the Student instance to a dictionary.
-
-        :return: A dictionary representation of the student.
-        """
-        return {
-            **super().to_dict(),
-            'student_id': self.student_id,
-            'registered_courses': [course.course_id for course in self.registered_courses]
-        }
-
-    @classmethod
-    def from_dict(cls, data):
-        """
-        Creates a Student instance from a dictionary.
-
-        :param data: A dictionary containing the student's data.
-        :return: A new Student instance.
-        """
-        student = cls(data['name'], data['age'], data['email'], data['student_id'])
-        return student
-
-
-class Instructor(Person):
-    """
-    Represents an instructor, inheriting from the Person class.
-
-    :param name: The name of the instructor.
-    :param age: The age of the instructor.
-    :param email: The email address of the instructor.
-    :param instructor_id: The unique identifier for the instructor.
-    """
-
-    def __init__(self, name: str, age: int, email: str, instructor_id: str):
-        """
-        Initializes a new Instructor instance.
-
-        :param name: The name of the instructor.
-        :param age: The age of the instructor (must be non-negative).
-        :param email: The email address of the instructor (must be valid).
-        :param instructor_id: The unique identifier for the instructor.
-        """
-        super().__init__(name, age, email)
-        self.instructor_id = instructor_id
-        self.assigned_courses = []
-
-    def assign_course(self, course):
-        """
-        Assigns a course to the instructor.
-
-        :param course: The course to assign.
-        """
-        self.assigned_courses.append(course)
-        course.instructor = self
-        print(f"Instructor {self.name} has been assigned to course {course.course_name}.")
-
-    def to_dict(self):
-        """
-        Converts the Instructor instance to a dictionary.
-
-        :return: A dictionary representation of the instructor.
-        """
-        return {
-            **super().to_dict(),
-            'instructor_id': self.instructor_id,
-            'assigned_courses': [course.course_id for course in self.assigned_courses]
-        }
-
-    @classmethod
-    def from_dict(cls, data):
-        """
-        Creates an Instructor instance from a dictionary.
-
-        :param data: A dictionary containing the instructor's data.
-        :return: A new Instructor instance.
-        """
-        instructor = cls(data['name'], data['age'], data['email'], data['instructor_id'])
-        return instructor
-
-
-class Course:
-    """
-    Represents a course in the school management system.
+# Milliseconds without typing before a search box filters its table.
+FILTER_DELAY_MS = 150
 
-    :param course_id: The unique identifier for the course.
-    :param course_name: The name of the course.
-    """
-
-    def __init__(self, course_id: str, course_name: str):
-        """
-        Initializes a new Course instance.
-
-        :param course_id: The unique identifier for the course.
-        :param course_name: The name of the course.
-        """
-        self.course_id = course_id
-        self.course_name = course_name
-        self.instructor = None
-        self.enrolled_students = []
-
-    def add_student(self, student):
-        """
-        Adds a student to the course.
-
-        :param student: The student to add to the course.
-        """
-        self.enrolled_students.append(student)
-        print(f"Student {student.name} has been added to course {self.course_name}.")
-
-    def to_dict(self):
-        """
-        Converts the Course instance to a dictionary.
-
-        :return: A dictionary representation of the course.
-        """
-        return {
-            'course_id': self.course_id,
-            'course_name': self.course_name,
-            'instructor': self.instructor.instructor_id if self.instructor else None,
-            'enrolled_students': [student.student_id for student in self.enrolled_students]
-        }
-
-    @classmethod
-    def from_dict(cls, data):
-        """
-        Creates a Course instance from a dictionary.
-
-        :param data: A dictionary containing the course's data.
-        :return: A new Course instance.
-        """
-        course = cls(data['course_id'], data['course_name'])
-        return course
-
-    
-students = []
-instructors = []
-courses = []
+# Storage backend picked by SCHOOL_BACKEND, or None for the JSON data file
+repo = None
 
 
 def save_data():
     """
-    Save the current state of students, instructors, and courses to a JSON file.
+    Save the current records and confirm with a message box.
 
-    The function gathers data from the global lists of students, instructors, and courses,
-    formats it into a dictionary structure, and writes it to a JSON file. The file path
-    is set to a specific location on the user's machine.
+    The data is written by :func:`school_data.save_data`, which appends the
+    records changed since the last save to the file's journal, or with
+    ``SCHOOL_BACKEND`` set by :func:`school_data.save_repository`.
 
     Raises:
         IOError: If there is an issue opening or writing to the file.
     """
-    data = {
-        "students": [{"name": s.name, "age": s.age, "email": s._email, "student_id": s.student_id} for s in students],
-        "instructors": [{"name": i.name, "age": i.age, "email": i._email, "instructor_id": i.instructor_id, "assigned_courses": [c.course_id for c in i.assigned_courses]} for i in instructors],
-        "courses": [{"course_id": c.course_id, "course_name": c.course_name, "enrolled_students": [s.student_id for s in c.enrolled_students], "instructor": c.instructor.instructor_id if c.instructor else None} for c in courses]
-    }
-    file_path = "C:\\Users\\Lenovo\\OneDrive - American University of Beirut\\EECE 435L\\lab2\\data.json"
-    if file_path:
-        with open(file_path, 'w') as file:
-            json.dump(data, file)
-        msg = QMessageBox()
-        msg.setWindowTitle("Save")
-        msg.setText("Save successful.")
-        msg.setIcon(QMessageBox.Information)
-        msg.setStandardButtons(QMessageBox.Ok)
-
-        msg.exec_()
-
-
-def load_data():
-    """
-    Load student, instructor, and course data from a JSON file.
-
-    This function reads data from a specified JSON file, clears the existing lists of
-    students, instructors, and courses, and populates them with the loaded data. The
-    function creates instances of `Student`, `Instructor`, and `Course` based on the
-    data structure defined in the JSON file. It also establishes relationships between
-    instructors and courses, as well as between students and courses.
-
-    Raises:
-        FileNotFoundError: If the specified file does not exist.
-        json.JSONDecodeError: If the file contents cannot be parsed as JSON.
-    """
-    file_path = "C:\\Users\\Lenovo\\OneDrive - American University of Beirut\\EECE 435L\\lab2\\data.json"
-    if file_path:
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-
-        students.clear()
-        instructors.clear()
-        courses.clear()
-
-        for s_data in data["students"]:
-            student = Student(s_data["name"], s_data["age"], s_data["email"], s_data["student_id"])
-            students.append(student)
-
-        for i_data in data["instructors"]:
-            instructor = Instructor(i_data["name"], i_data["age"], i_data["email"], i_data["instructor_id"])
-            for course_id in i_data["assigned_courses"]:
-                course = next((c for c in courses if c.course_id == course_id), None)
-                if course:
-                    instructor.assign_course(course)
-            instructors.append(instructor)
-
-        for c_data in data["courses"]:
-            course = Course(c_data["course_id"], c_data["course_name"])
-            for student_id in c_data["enrolled_students"]:
-                student = next((s for s in students if s.student_id == student_id), None)
-                if student:
-                    course.add_student(student)
-            courses.append(course)
-            if c_data["instructor"]:
-                instructor = next((i for i in instructors if i.instructor_id == c_data["instructor"]), None)
-                if instructor:
-                    course.instructor = instructor
-                    instructor.assign_course(course)
+    if repo is None:
+        school_data.save_data()
+    else:
+        try:
+            school_data.save_repository(repo)
+        except repository.IntegrityError as e:
+            QMessageBox.critical(None, "Save", f"Not saved: {e}")
+            return
+    msg = QMessageBox()
+    msg.setWindowTitle("Save")
+    msg.setText("Save successful.")
+    msg.setIcon(QMessageBox.Information)
+    msg.setStandardButtons(QMessageBox.Ok)
 
+    msg.exec_()
 
 
 class StudentForm(QDialog):
@@ -667,7 +379,219 @@ class EditRecordDialog(QDialog):
             i.age = int(self.age.text())
             i._email = self.email.text()
         
-        self.close()
+        self.accept()
+
+
+def student_values(student):
+    """Return the column values of a student."""
+    return (student.student_id, student.name, student.age, student._email)
+
+
+def instructor_values(instructor):
+    """Return the column values of an instructor."""
+    return (instructor.instructor_id, instructor.name, instructor.age, instructor._email)
+
+
+def search_text(person):
+    """Return the text of a student or instructor matched by the search box: name and email."""
+    return f"{person.name}\n{person._email}"
+
+
+def person_name(person):
+    """Return the name of a student or instructor, matched by fuzzy search."""
+    return person.name
+
+
+def course_name(course):
+    """Return the name of a course, matched by the search box and fuzzy search."""
+    return course.course_name
+
+
+def course_values(course):
+    """Return the column values of a course."""
+    return (course.course_id, course.course_name, course.instructor.name if course.instructor else "None")
+
+
+class RecordTableModel(QAbstractTableModel):
+    """
+    Table model over one of the record lists of :mod:`school_data`.
+
+    The column values and the lowercase search key of every record are
+    computed once, so the view only asks for the rows on screen. Queries of
+    three or more characters are answered by a :class:`TrigramIndex` over the
+    search keys, shorter ones by a substring test per record, and a query
+    that extends the previous one only tests the rows that matched before.
+    Only the matching rows are exposed, in the current sort order.
+
+    In fuzzy mode the query is matched against the record names by a
+    :class:`FuzzyIndex`, built the first time the mode is used, and the
+    closest names are shown best first instead.
+
+    Attributes:
+        records (list): The record list, shared with :mod:`school_data`.
+        fields (list): The column headers.
+        visible (list): Indexes into ``records`` of the shown rows, in display order.
+    """
+
+    def __init__(self, records, fields, values, search_key, name, parent=None):
+        """
+        Parameters:
+            records (list): The records to show.
+            fields (list): The column headers.
+            values (callable): Returns the tuple of column values of a record.
+            search_key (callable): Returns the text of a record matched by the filter.
+            name (callable): Returns the name of a record matched in fuzzy mode.
+            parent (QObject): The parent object.
+        """
+        super().__init__(parent)
+        self.records = records
+        self.fields = fields
+        self.values_of = values
+        self.search_key = search_key
+        self.name_of = name
+        self.query = ""
+        self.fuzzy = False
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+        self.rebuild()
+
+    def rebuild(self):
+        """Recompute the cached values of all records, e.g. after records were added."""
+        self.beginResetModel()
+        self.values = [self.values_of(record) for record in self.records]
+        self.keys = [self.search_key(record).lower() for record in self.records]
+        self.search_index = TrigramIndex()
+        for record, key in zip(self.records, self.keys):
+            self.search_index.add(id(record), key)
+        self.name_index = None
+        self.position = {id(record): i for i, record in enumerate(self.records)}
+        self.order = self.sorted_order()
+        self.update_rank()
+        self.visible = self.matching(self.order, self.query)
+        self.endResetModel()
+
+    def sorted_order(self):
+        """Return the indexes of all records in the current sort order."""
+        order = list(range(len(self.records)))
+        if self.sort_column >= 0:
+            values, column = self.values, self.sort_column
+            order.sort(key=lambda i: values[i][column], reverse=self.sort_order == Qt.DescendingOrder)
+        return order
+
+    def update_rank(self):
+        """Record the display position of each record, used to put index hits in sort order."""
+        self.rank = [0] * len(self.order)
+        for position, i in enumerate(self.order):
+            self.rank[i] = position
+
+    def matching(self, rows, query):
+        """Return the indexes in ``rows`` whose search key contains ``query``."""
+        if not query:
+            return list(rows)
+        if self.fuzzy:
+            if self.name_index is None:
+                self.name_index = FuzzyIndex()
+                for record in self.records:
+                    self.name_index.add(id(record), self.name_of(record))
+            return [self.position[key] for key in self.name_index.search(query)]
+        if rows is self.order and len(query) >= 3:
+            hits = [self.position[key] for key in self.search_index.search(query)]
+            hits.sort(key=self.rank.__getitem__)
+            return hits
+        keys = self.keys
+        return [i for i in rows if query in keys[i]]
+
+    def set_filter(self, text):
+        """
+        Show only the records whose search key contains ``text``, ignoring case.
+
+        Parameters:
+            text (str): The search text; empty shows every record.
+        """
+        query = text.lower()
+        if query == self.query:
+            return
+        # Records without the previous query cannot contain a query that extends it.
+        narrowing = self.query and self.query in query and not self.fuzzy
+        rows = self.visible if narrowing else self.order
+        self.beginResetModel()
+        self.visible = self.matching(rows, query)
+        self.query = query
+        self.endResetModel()
+
+    def set_fuzzy(self, enabled):
+        """
+        Switch between substring filtering and fuzzy name search, keeping the query.
+
+        Parameters:
+            enabled (bool): Match misspelled and sound-alike names, best first.
+        """
+        if enabled == self.fuzzy:
+            return
+        self.beginResetModel()
+        self.fuzzy = enabled
+        self.visible = self.matching(self.order, self.query)
+        self.endResetModel()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Sort the records by a column; a negative column restores the list order."""
+        self.beginResetModel()
+        self.sort_column = column
+        self.sort_order = order
+        self.order = self.sorted_order()
+        self.update_rank()
+        self.visible = self.matching(self.order, self.query)
+        self.endResetModel()
+
+    def record(self, row):
+        """Return the record shown in ``row``."""
+        return self.records[self.visible[row]]
+
+    def update_row(self, row):
+        """
+        Refresh the cached values of the record shown in ``row`` after it was edited.
+
+        The row stays visible and in place until the filter or sort order changes.
+        """
+        index = self.visible[row]
+        self.values[index] = self.values_of(self.records[index])
+        self.keys[index] = self.search_key(self.records[index]).lower()
+        self.search_index.add(id(self.records[index]), self.keys[index])
+        if self.name_index is not None:
+            self.name_index.add(id(self.records[index]), self.name_of(self.records[index]))
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.fields) - 1))
+
+    def remove_row(self, row):
+        """Delete the record shown in ``row`` from its list."""
+        index = self.visible[row]
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self.search_index.remove(id(self.records[index]))
+        if self.name_index is not None:
+            self.name_index.remove(id(self.records[index]))
+        del self.records[index]
+        del self.values[index]
+        del self.keys[index]
+        self.position = {id(record): i for i, record in enumerate(self.records)}
+        self.order = [i - (i > index) for i in self.order if i != index]
+        self.update_rank()
+        self.visible = [i - (i > index) for i in self.visible if i != index]
+        self.endRemoveRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.visible)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.fields)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return str(self.values[self.visible[index.row()]][index.column()])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.fields[section]
+        return None
 
 
 class DisplayRecordsWindow(QMainWindow):
@@ -675,7 +599,9 @@ class DisplayRecordsWindow(QMainWindow):
     Main window for displaying records of students, instructors, and courses.
 
     This window contains tabs for each type of record, and allows users to 
-    view, edit, and delete records.
+    view, sort, search, edit, and delete records. Each tab shows a
+    :class:`RecordTableModel` in a ``QTableView``, which only creates the
+    cells on screen.
 
     Attributes:
         tab_widget (QTabWidget): Widget for holding multiple tabs.
@@ -689,20 +615,30 @@ class DisplayRecordsWindow(QMainWindow):
 
         self.tab_widget = QTabWidget()
 
-        self.tab_widget.addTab(self.create_table_tab("Students", students, ["student_id", "name", "age", "email"]), "Students")
-        self.tab_widget.addTab(self.create_table_tab("Instructors", instructors, ["instructor_id", "name", "age", "email"]), "Instructors")
-        self.tab_widget.addTab(self.create_table_tab("Courses", courses, ["course_id", "course_name", "instructor"]), "Courses")
+        self.tab_widget.addTab(self.create_table_tab("Students", students, ["student_id", "name", "age", "email"],
+                                                     student_values, search_text, person_name), "Students")
+        self.tab_widget.addTab(self.create_table_tab("Instructors", instructors, ["instructor_id", "name", "age", "email"],
+                                                     instructor_values, search_text, person_name), "Instructors")
+        self.tab_widget.addTab(self.create_table_tab("Courses", courses, ["course_id", "course_name", "instructor"],
+                                                     course_values, course_name, course_name), "Courses")
 
         self.setCentralWidget(self.tab_widget)
 
-    def create_table_tab(self, tab_name, records, fields):
+    def create_table_tab(self, tab_name, records, fields, values, search_key, name):
         """
-        Create a tab with a table for displaying records.
+        Create a tab with a search box, a table of records and Edit/Delete buttons.
+
+        The search box filters the table once typing pauses for
+        ``FILTER_DELAY_MS``, so fast typing filters once rather than per key.
+        Its "Fuzzy" checkbox switches to typo-tolerant name search.
 
         Parameters:
             tab_name (str): The name of the tab (e.g., "Students").
             records (list): The list of records to display.
             fields (list): The fields of the records.
+            values (callable): Returns the column values of a record.
+            search_key (callable): Returns the text matched by the search box.
+            name (callable): Returns the name matched by fuzzy search.
 
         Returns:
             QWidget: The created tab.
@@ -710,83 +646,60 @@ class DisplayRecordsWindow(QMainWindow):
         tab = QWidget()
         layout = QVBoxLayout()
 
-        search_bar = QLineEdit()
-        search_bar.setPlaceholderText(f"Search {tab_name}")
-        search_bar.textChanged.connect(lambda: self.filter_table(search_bar, table, records))
+        model = RecordTableModel(records, fields, values, search_key, name, tab)
 
-        table = QTableWidget()
-        table.setRowCount(len(records))
-        table.setColumnCount(len(fields) + 2)
-        table.setHorizontalHeaderLabels(fields + ["Edit", "Delete"])
+        table = QTableView()
+        table.setModel(model)
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table.setSelectionMode(QAbstractItemView.SingleSelection)
+        table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        table.setSortingEnabled(True)
+        table.doubleClicked.connect(lambda index: self.edit_record(model, index.row()))
 
-        self.populate_table(table, records, fields, tab_name)
-
-        layout.addWidget(search_bar)
+        search_bar = QLineEdit()
+        search_bar.setPlaceholderText(f"Search {tab_name}")
+        filter_timer = QTimer(tab)
+        filter_timer.setSingleShot(True)
+        filter_timer.setInterval(FILTER_DELAY_MS)
+        filter_timer.timeout.connect(lambda: model.set_filter(search_bar.text()))
+        search_bar.textChanged.connect(lambda: filter_timer.start())
+        fuzzy_box = QCheckBox("Fuzzy")
+        fuzzy_box.toggled.connect(model.set_fuzzy)
+        search_layout = QHBoxLayout()
+        search_layout.addWidget(search_bar)
+        search_layout.addWidget(fuzzy_box)
+
+        edit_button = QPushButton("Edit")
+        edit_button.clicked.connect(lambda: self.edit_record(model, self.selected_row(table)))
+        delete_button = QPushButton("Delete")
+        delete_button.clicked.connect(lambda: self.delete_record(model, self.selected_row(table)))
+        buttons = QHBoxLayout()
+        buttons.addWidget(edit_button)
+        buttons.addWidget(delete_button)
+
+        layout.addLayout(search_layout)
         layout.addWidget(table)
+        layout.addLayout(buttons)
         tab.setLayout(layout)
         return tab
 
-    def populate_table(self, table, records, fields, tab_name):
-        """
-        Fill the table with data and add Edit/Delete buttons.
+    def selected_row(self, table):
+        """Return the selected row of a table, or -1 if none is selected."""
+        rows = table.selectionModel().selectedRows()
+        return rows[0].row() if rows else -1
 
-        Parameters:
-            table (QTableWidget): The table to populate.
-            records (list): The list of records.
-            fields (list): The fields to display.
-            tab_name (str): The name of the tab (e.g., "Students").
-        """
-        table.setRowCount(len(records))
-        for row, record in enumerate(records):
-            if tab_name == "Courses":
-                table.setItem(row, 0, QTableWidgetItem(record.course_id))
-                table.setItem(row, 1, QTableWidgetItem(record.course_name))
-                table.setItem(row, 2, QTableWidgetItem(record.instructor.name if record.instructor else "None"))
-            elif tab_name == "Students":
-                table.setItem(row, 0, QTableWidgetItem(record.student_id))
-                table.setItem(row, 1, QTableWidgetItem(record.name))
-                table.setItem(row, 2, QTableWidgetItem(str(record.age)))
-                table.setItem(row, 3, QTableWidgetItem(record._email))
-            else:
-                table.setItem(row, 0, QTableWidgetItem(record.instructor_id))
-                table.setItem(row, 1, QTableWidgetItem(record.name))
-                table.setItem(row, 2, QTableWidgetItem(str(record.age)))
-                table.setItem(row, 3, QTableWidgetItem(record._email))
-
-            edit_button = QPushButton("Edit")
-            edit_button.clicked.connect(lambda _, r=record, f=fields: self.edit_record(r, f, table))
-            table.setCellWidget(row, len(fields), edit_button)
-
-            delete_button = QPushButton("Delete")
-            delete_button.clicked.connect(lambda _, r=row: self.delete_record(r, records, table, tab_name))
-            table.setCellWidget(row, len(fields) + 1, delete_button)
-
-    def filter_table(self, search_bar, table, records):
-        """Filter the table based on search input."""
-        search_text = search_bar.text().lower()
-        for row, record in enumerate(records):
-            try:
-                if search_text in record.name.lower():
-                    table.setRowHidden(row, False)
-                else:
-                    table.setRowHidden(row, True)
-            except AttributeError:
-                if search_text in record.course_name.lower():
-                    table.setRowHidden(row, False)
-                else:
-                    table.setRowHidden(row, True)
-
-    def edit_record(self, record, fields, table):
-        """Open an edit dialog to modify the selected record."""
-        dialog = EditRecordDialog(record, fields)
+    def edit_record(self, model, row):
+        """Open an edit dialog to modify the record shown in ``row``."""
+        if row < 0:
+            return
+        dialog = EditRecordDialog(model.record(row), model.fields, self)
         if dialog.exec_():
-            self.populate_table(table, students, fields)
-        self.close()
+            model.update_row(row)
 
-    def delete_record(self, row, records, table, tab_name):
-        """Delete a record and update the table."""
-        records.pop(row)
-        self.populate_table(table, records, [table.horizontalHeaderItem(i).text() for i in range(table.columnCount() - 2)], tab_name)
+    def delete_record(self, model, row):
+        """Delete the record shown in ``row`` and remove it from the table."""
+        if row >= 0:
+            model.remove_row(row)
 
 class MainWindow(QMainWindow):
     """
@@ -918,8 +831,19 @@ class MainWindow(QMainWindow):
 
 
 if __name__ == "__main__":
-    load_data()
+    # The JSON data file unless SCHOOL_BACKEND names a backend; SQLite shares the Tk app's database
+    repo = repository.from_env(db_mmb78.DB_PATH, default=None)
+    if repo is None:
+        load_data()
+        # Folds the save journal into the data file once it has grown
+        compactor = school_data.Compactor()
+        compactor.start()
+    else:
+        if isinstance(repo, repository.SqliteRepository):
+            repo.create_schema()
+        school_data.load_repository(repo)
     app = QApplication(sys.argv)
+    watchdog = stall_watchdog.from_env(stall_watchdog.QtWatchdog)
     main_window = MainWindow()
     main_window.show()
     sys.exit(app.exec_())
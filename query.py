@@ -0,0 +1,502 @@
+"""
+Composable queries over the school tables.
+
+A :class:`Query` describes one ``SELECT`` on a base table with filters,
+joins through enrollments, counts of related records, ordering, a
+projection and keyset pagination. Every method returns a new query, so a
+partial query can be kept and extended::
+
+    older = db_mmb78.select("students").where(age__gt=20, courses__course_id="C1")
+    older.order_by("-age").select("name", "age").rows()
+    db_mmb78.select("courses").where(instructor_id__isnull=True).objects()
+    db_mmb78.select("instructors").with_count("courses", "load").order_by("-load").rows()
+
+Filters are keyword lookups ``[table__]column[__operator]=value``. Naming a
+column of another table joins it along students - enrollments - courses -
+instructors; when such a join can repeat base rows the query becomes
+``SELECT DISTINCT``. Table and column names are checked against the schema
+and values are always bound as parameters, so lookups built from user input
+are safe. Whatever is combined, a query runs as one statement, shown by
+:meth:`Query.sql`.
+
+Pages are fetched with :meth:`Query.page`: instead of an ``OFFSET``, which
+makes SQLite step over every earlier row, the next page starts after the
+sort key of the last row seen, so deep pages cost as much as the first.
+:meth:`Query.iter_rows` and :meth:`Query.iter_objects` stream the results
+through :func:`iter_rows` instead of building a list.
+"""
+import copy
+from collections import namedtuple
+from functools import lru_cache
+
+import metrics
+import relations
+
+COLUMNS = {
+    "students": ("student_id", "name", "age", "email"),
+    "instructors": ("instructor_id", "name", "age", "email"),
+    "courses": ("course_id", "course_name", "instructor_id"),
+    "enrollments": ("student_id", "course_id"),
+}
+
+# Columns identifying a row of each table.
+KEYS = {
+    "students": ("student_id",),
+    "instructors": ("instructor_id",),
+    "courses": ("course_id",),
+    "enrollments": ("student_id", "course_id"),
+}
+
+# Foreign keys as (one side, many side, column); joining from the one side
+# to the many side can repeat rows.
+EDGES = (
+    ("students", "enrollments", "student_id"),
+    ("courses", "enrollments", "course_id"),
+    ("instructors", "courses", "instructor_id"),
+)
+
+# Rows fetched from SQLite per batch by the streaming methods.
+ARRAYSIZE = 500
+
+# Entity label of the CRUD counter in metrics.py.
+ENTITIES = {"students": "student", "instructors": "instructor", "courses": "course", "enrollments": "enrollment"}
+
+COMPARISONS = {"exact": "=", "ne": "!=", "lt": "<", "lte": "<=", "gt": ">", "gte": ">=", "like": "LIKE"}
+OPERATORS = set(COMPARISONS) | {"contains", "in", "isnull"}
+
+Page = namedtuple("Page", "items cursor")
+Page.__doc__ = """
+One page of results.
+
+``cursor`` is passed as ``after`` to :meth:`Query.page` for the next page,
+and is None on the last page.
+"""
+
+
+def _edge(a, b):
+    for one, many, column in EDGES:
+        if {a, b} == {one, many}:
+            return column, a == one
+    return None
+
+
+def _path(start, end):
+    """Returns the tables joined to get from ``start`` to ``end``, excluding ``start``."""
+    paths = {start: []}
+    queue = [start]
+    while queue:
+        table = queue.pop(0)
+        for other in COLUMNS:
+            if other not in paths and _edge(table, other):
+                paths[other] = paths[table] + [other]
+                queue.append(other)
+    return paths[end]
+
+
+def _condition(a, b):
+    column = _edge(a, b)[0]
+    return f"{a}.{column} = {b}.{column}"
+
+
+def iter_rows(connect, sql, params=(), arraysize=ARRAYSIZE):
+    """
+    Yields the rows of a statement, fetched ``arraysize`` at a time.
+
+    Only one batch is held in memory, whatever the size of the result. The
+    connection is closed when the generator is exhausted or closed; a
+    consumer that stops early should close it, e.g. with
+    ``contextlib.closing``, rather than wait for garbage collection.
+
+    :param connect: Returns a new connection, used only by this generator.
+    :param sql: The SELECT statement.
+    :param params: Parameters for the statement.
+    :param arraysize: Rows fetched from SQLite per batch.
+    """
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.arraysize = arraysize
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+@lru_cache(maxsize=None)
+def _row_type(fields):
+    return namedtuple("Row", fields, rename=True)
+
+
+class Query:
+    """
+    A ``SELECT`` on one table, built up by chaining methods.
+
+    :param table: The base table, a key of :data:`COLUMNS`.
+    :param connect: Returns a new connection to run the query on; it is closed afterwards.
+    """
+
+    def __init__(self, table, connect):
+        if table not in COLUMNS:
+            raise ValueError(f"unknown table {table!r}")
+        self.table = table
+        self._connect = connect
+        self._joins = []
+        self._distinct = False
+        self._filters = []
+        self._counts = {}
+        self._order = []
+        self._columns = None
+        self._limit = None
+
+    def _copy(self):
+        query = copy.copy(self)
+        query._joins = list(self._joins)
+        query._filters = list(self._filters)
+        query._counts = dict(self._counts)
+        query._order = list(self._order)
+        return query
+
+    def _join(self, table):
+        previous = self.table
+        for step in _path(self.table, table):
+            if all(step != joined for joined, _ in self._joins):
+                self._joins.append((step, _condition(previous, step)))
+                self._distinct = self._distinct or _edge(previous, step)[1]
+            previous = step
+
+    def _resolve(self, name):
+        """Returns the SQL expression of a column or count name and its table, joining it if needed."""
+        parts = name.split("__")
+        if len(parts) == 1 and name in self._counts:
+            return self._counts[name], None
+        table, column = (self.table, name) if len(parts) == 1 else parts if len(parts) == 2 else (None, None)
+        if column not in COLUMNS.get(table, ()):
+            raise ValueError(f"unknown column {name!r} for a query on {self.table}")
+        if table != self.table:
+            self._join(table)
+        return f"{table}.{column}", table
+
+    def _lookup(self, key, value):
+        parts = key.split("__")
+        op = parts.pop() if len(parts) > 1 and parts[-1] in OPERATORS else "exact"
+        expr, _ = self._resolve("__".join(parts))
+        if op == "isnull" or (op == "exact" and value is None):
+            return f"{expr} IS {'' if value or op == 'exact' else 'NOT '}NULL", []
+        if op == "in":
+            values = list(value)
+            return f"{expr} IN ({', '.join('?' * len(values))})", values
+        if op == "contains":
+            escaped = str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            return f"{expr} LIKE ? ESCAPE '\\'", ["%" + escaped + "%"]
+        return f"{expr} {COMPARISONS[op]} ?", [value]
+
+    def where(self, **lookups):
+        """
+        Keeps the rows matching all lookups.
+
+        Lookups are ``column=value`` for equality, or ``column__op=value`` with
+        ``op`` one of ``ne``, ``lt``, ``lte``, ``gt``, ``gte``, ``like``,
+        ``contains`` (substring, ignoring case like ``LIKE``), ``in`` (any of an
+        iterable) and ``isnull`` (True or False). A column of another table is
+        written ``table__column`` and joins that table; a count added by
+        :meth:`with_count` can be filtered by its name.
+
+        :raises ValueError: For an unknown table or column.
+        """
+        query = self._copy()
+        for key, value in lookups.items():
+            query._filters.append(query._lookup(key, value))
+        return query
+
+    def exclude(self, **lookups):
+        """
+        Drops the rows matching all lookups; see :meth:`where`.
+
+        Lookups on other tables become a correlated ``NOT EXISTS``: a student
+        is dropped if any of its courses matches, and kept if it has none.
+        """
+        query = self._copy()
+        # Compiled on their own, so their joins go into the subquery.
+        scratch = Query(self.table, self._connect)
+        scratch._counts = self._counts
+        conditions = [scratch._lookup(key, value) for key, value in lookups.items()]
+        if not conditions:
+            return query
+        condition = " AND ".join(sql for sql, _ in conditions)
+        params = [param for _, values in conditions for param in values]
+        if scratch._joins:
+            (first, correlation), *joins = scratch._joins
+            condition = (f"NOT EXISTS (SELECT 1 FROM {first}"
+                         + "".join(f" JOIN {table} ON {on}" for table, on in joins)
+                         + f" WHERE {correlation} AND {condition})")
+        else:
+            condition = f"NOT ({condition})"
+        query._filters.append((condition, params))
+        return query
+
+    def with_count(self, table, name):
+        """
+        Adds a column ``name`` counting the related records of ``table``.
+
+        The count is a correlated subquery, so it does not change which rows
+        the query returns; e.g. ``select("instructors").with_count("courses",
+        "load")`` also returns instructors without courses, with a load of 0.
+
+        :raises ValueError: For an unknown table or a name already in use.
+        """
+        if table not in COLUMNS or table == self.table:
+            raise ValueError(f"cannot count {table!r} for a query on {self.table}")
+        if name in COLUMNS[self.table] or name in self._counts or not name.isidentifier():
+            raise ValueError(f"count name {name!r} is invalid or already used")
+        path = _path(self.table, table)
+        joins = "".join(f" JOIN {step} ON {_condition(previous, step)}" for previous, step in zip(path, path[1:]))
+        counted = f"COUNT(DISTINCT {table}.{KEYS[table][0]})" if len(KEYS[table]) == 1 else "COUNT(*)"
+        query = self._copy()
+        query._counts[name] = (f"(SELECT {counted} FROM {path[0]}{joins} "
+                               f"WHERE {_condition(self.table, path[0])})")
+        return query
+
+    def order_by(self, *names):
+        """
+        Sorts by the given columns or counts, replacing any earlier order.
+
+        Prefix a name with ``-`` to sort descending. The key of the base table
+        is added as a final tiebreaker so the order, and paging, is stable.
+        """
+        query = self._copy()
+        query._order = []
+        for name in names:
+            descending = name.startswith("-")
+            expr, _ = query._resolve(name.lstrip("-"))
+            query._order.append((expr, descending))
+        return query
+
+    def select(self, *names):
+        """
+        Returns only the given columns or counts, in this order.
+
+        The fields of the returned rows are named after them, with ``__``
+        replaced by ``_`` (``courses__course_name`` becomes ``courses_course_name``).
+        Without a projection, rows hold the base table's columns and the counts.
+        """
+        query = self._copy()
+        query._columns = []
+        for name in names:
+            expr, table = query._resolve(name)
+            query._columns.append((expr, name.replace("__", "_"), table))
+        return query
+
+    def limit(self, count):
+        """Returns at most ``count`` rows."""
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def _projection(self):
+        if self._columns is not None:
+            return list(self._columns)
+        columns = [(f"{self.table}.{column}", column, self.table) for column in COLUMNS[self.table]]
+        return columns + [(expr, name, None) for name, expr in self._counts.items()]
+
+    def _sort_key(self, columns):
+        """Returns the ordering with tiebreakers: the keys of the base table and of the projected tables."""
+        order = list(self._order)
+        tables = [self.table] + [table for _, _, table in columns if table not in (None, self.table)]
+        for table in dict.fromkeys(tables):
+            for column in KEYS[table]:
+                if (f"{table}.{column}", False) not in order and (f"{table}.{column}", True) not in order:
+                    order.append((f"{table}.{column}", False))
+        return order
+
+    def _compile(self, columns, order, after=None, limit=None, extra_joins="", keys=False):
+        """
+        Returns ``(sql, params)`` selecting ``columns`` in ``order``.
+
+        :param after: Sort key values to start after, for :meth:`page`.
+        :param keys: Select the sort key values after the columns too.
+        """
+        source = [" FROM ", self.table]
+        source += [f" JOIN {table} ON {condition}" for table, condition in self._joins]
+        source.append(extra_joins)
+        if self._distinct and order:
+            return self._compile_grouped(columns, order, after, limit, source, keys)
+        filters = list(self._filters)
+        if after is not None:
+            filters.append(_after(order, after))
+        params = [param for _, values in filters for param in values]
+        selected = columns + [expr for expr, _ in order] if keys else columns
+        sql = ["SELECT DISTINCT " if self._distinct else "SELECT ", ", ".join(selected)] + source
+        if filters:
+            sql.append(" WHERE " + " AND ".join(condition for condition, _ in filters))
+        if order:
+            sql.append(" ORDER BY " + ", ".join(expr + (" DESC" if descending else "") for expr, descending in order))
+        if limit is not None:
+            sql.append(" LIMIT ?")
+            params.append(limit)
+        return "".join(sql), params
+
+    def _compile_grouped(self, columns, order, after, limit, source, keys):
+        """
+        Compiles a sorted query with a join that repeats base rows.
+
+        ``SELECT DISTINCT`` cannot also select the sort key, which may differ
+        between the repeats (a student's courses), so the rows are grouped by
+        the columns instead, each group sorted by the least of its values, or
+        the greatest when descending, and paged outside the grouping.
+        """
+        names = [f"c{i}" for i in range(len(columns))]
+        key_names = [f"k{i}" for i in range(len(order))]
+        inner = ["SELECT ", ", ".join(
+            [f"{expr} AS {name}" for expr, name in zip(columns, names)]
+            + [f"{'MAX' if descending else 'MIN'}({expr}) AS {name}"
+               for (expr, descending), name in zip(order, key_names)])] + source
+        params = [param for _, values in self._filters for param in values]
+        if self._filters:
+            inner.append(" WHERE " + " AND ".join(condition for condition, _ in self._filters))
+        inner.append(" GROUP BY " + ", ".join(str(i + 1) for i in range(len(columns))))
+        outer_order = [(name, descending) for name, (_, descending) in zip(key_names, order)]
+        sql = ["SELECT ", ", ".join(names + key_names if keys else names), " FROM (", "".join(inner), ")"]
+        if after is not None:
+            condition, after_params = _after(outer_order, after)
+            sql.append(" WHERE " + condition)
+            params += after_params
+        sql.append(" ORDER BY " + ", ".join(name + (" DESC" if descending else "") for name, descending in outer_order))
+        if limit is not None:
+            sql.append(" LIMIT ?")
+            params.append(limit)
+        return "".join(sql), params
+
+    def sql(self):
+        """Returns the ``(sql, params)`` run by :meth:`rows`."""
+        columns = self._projection()
+        order = self._sort_key(columns) if self._order else []
+        return self._compile([expr for expr, _, _ in columns], order, limit=self._limit)
+
+    def _run(self, sql, params):
+        metrics.inc("school_crud_operations_total", entity=ENTITIES[self.table], op="read")
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def rows(self):
+        """Returns the results as named tuples; see :meth:`select` for the fields."""
+        row_type = _row_type(tuple(name for _, name, _ in self._projection()))
+        return [row_type(*row) for row in self._run(*self.sql())]
+
+    def iter_rows(self, arraysize=ARRAYSIZE):
+        """Yields the rows of :meth:`rows` one at a time, streamed through :func:`iter_rows`."""
+        metrics.inc("school_crud_operations_total", entity=ENTITIES[self.table], op="read")
+        row_type = _row_type(tuple(name for _, name, _ in self._projection()))
+        for row in iter_rows(self._connect, *self.sql(), arraysize=arraysize):
+            yield row_type(*row)
+
+    def count(self):
+        """Returns the number of rows :meth:`rows` would return."""
+        sql, params = self.sql()
+        return self._run(f"SELECT COUNT(*) FROM ({sql})", params)[0][0]
+
+    def _object_query(self):
+        if self.table == "enrollments":
+            raise ValueError("enrollments have no object type; use rows()")
+        columns = [f"{self.table}.{column}" for column in COLUMNS[self.table]]
+        extra_joins = ""
+        if self.table == "courses":
+            # Its own alias, so filters joining instructors are not affected.
+            columns += [f"course_instructor.{column}" for column in COLUMNS["instructors"]]
+            extra_joins = " LEFT JOIN instructors AS course_instructor ON course_instructor.instructor_id = courses.instructor_id"
+        return columns, extra_joins
+
+    def _to_object(self, row, loader):
+        if self.table == "students":
+            return loader.student(row)
+        if self.table == "instructors":
+            return loader.instructor(row)
+        instructor = loader.instructor(row[3:7]) if row[3] is not None else None
+        return loader.course(row[:3], instructor)
+
+    def objects(self):
+        """
+        Returns the matching records as ``lab2_mmb78`` objects.
+
+        Courses come with their instructor, read in the same statement; other
+        relationships load on first access (see :mod:`relations`). Projections
+        and counts are ignored.
+        """
+        loader = relations.Loader(self._connect)
+        return [self._to_object(row, loader) for row in self._run(*self._objects_sql())]
+
+    def iter_objects(self, arraysize=ARRAYSIZE):
+        """Yields the objects of :meth:`objects` one at a time, streamed through :func:`iter_rows`."""
+        metrics.inc("school_crud_operations_total", entity=ENTITIES[self.table], op="read")
+        loader = relations.Loader(self._connect, arraysize)
+        rows = iter_rows(self._connect, *self._objects_sql(), arraysize=arraysize)
+        yield from relations.iter_batched(rows, lambda row: self._to_object(row, loader), arraysize)
+
+    def _objects_sql(self):
+        columns, extra_joins = self._object_query()
+        order = self._sort_key([]) if self._order else []
+        return self._compile(columns, order, limit=self._limit, extra_joins=extra_joins)
+
+    def page(self, size, after=None, objects=False):
+        """
+        Returns one page of results in the query's order.
+
+        :param size: Number of rows per page.
+        :param after: The cursor of the previous page, or None for the first page.
+        :param objects: Return ``lab2_mmb78`` objects instead of rows.
+        :return: A :class:`Page`.
+        """
+        if objects:
+            columns, extra_joins = self._object_query()
+            order = self._sort_key([])
+        else:
+            projection = self._projection()
+            columns, extra_joins = [expr for expr, _, _ in projection], ""
+            order = self._sort_key(projection)
+        # The sort key of each row is selected too, to make the next cursor.
+        sql, params = self._compile(columns, order, after, size + 1, extra_joins, keys=True)
+        found = self._run(sql, params)
+        width = len(columns)
+        if objects:
+            loader = relations.Loader(self._connect)
+            items = [self._to_object(row, loader) for row in found[:size]]
+        else:
+            row_type = _row_type(tuple(name for _, name, _ in projection))
+            items = [row_type(*row[:width]) for row in found[:size]]
+        cursor = tuple(found[size - 1][width:]) if len(found) > size else None
+        return Page(items, cursor)
+
+
+def _after(order, values):
+    """
+    Returns the condition selecting the rows sorted after ``values``.
+
+    SQLite sorts NULL first in ascending and last in descending order, which
+    plain comparisons with NULL would get wrong.
+    """
+    alternatives = []
+    params = []
+    equal = []
+    equal_params = []
+    for (expr, descending), value in zip(order, values):
+        if value is None:
+            later = "0" if descending else f"{expr} IS NOT NULL"
+            later_params = []
+        elif descending:
+            later, later_params = f"({expr} < ? OR {expr} IS NULL)", [value]
+        else:
+            later, later_params = f"{expr} > ?", [value]
+        alternatives.append("(" + " AND ".join(equal + [later]) + ")")
+        params += equal_params + later_params
+        if value is None:
+            equal.append(f"{expr} IS NULL")
+        else:
+            equal.append(f"{expr} = ?")
+            equal_params = equal_params + [value]
+    return "(" + " OR ".join(alternatives) + ")", params
@@ -0,0 +1,281 @@
+"""
+Course capacities and waitlists for the db_mmb78 database.
+
+A course with a row in ``course_capacity`` takes at most that many students;
+courses without one are unlimited. :func:`enroll` checks for a free seat and
+takes it in a single ``INSERT ... SELECT``, inside a ``BEGIN IMMEDIATE``
+transaction that also puts the student on the waitlist when the course is
+full. The write lock is taken before anything is read, so two registrants
+can never both see the last seat free, and a student registering for two
+courses at once cannot slip past the schedule check of :mod:`schedule`.
+
+The ``waitlist`` table keeps students in arrival order. Promotion is done by
+triggers, so it happens in the same transaction as whatever freed the seat:
+a drop through :func:`drop`, a deleted student (cascading to their
+enrollments) or a raised or removed capacity.
+
+``bench_registration.py`` runs concurrent registrants against it.
+"""
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+import metrics
+import schedule
+
+# Held by threads of this process around their registration transactions.
+# SQLite lets one writer in at a time anyway, but a thread that finds the
+# database locked sleeps in growing steps before retrying, so under a rush
+# some registrants wait seconds while others get through; queueing on a
+# lock serves them in turn. Other processes still wait on SQLite's lock.
+_write_lock = threading.Lock()
+
+ENROLLED = "enrolled"
+WAITLISTED = "waitlisted"
+FULL = "full"
+
+Registration = namedtuple("Registration", "status position")
+Registration.__doc__ = """
+Outcome of :func:`enroll`.
+
+``status`` is :data:`ENROLLED`, :data:`WAITLISTED` or :data:`FULL` (course
+full and no waitlisting asked for); ``position`` is the 1-based place on the
+waitlist, or None.
+"""
+
+class CourseFull(ValueError):
+    """
+    Raised when a student is to be enrolled in a course without a free seat.
+
+    :param student_id: The student.
+    :param course_id: The course.
+    """
+
+    def __init__(self, student_id, course_id):
+        super().__init__(f"{course_id} has no free seat for {student_id}")
+        self.student_id = student_id
+        self.course_id = course_id
+
+
+# Moves the first waitlisted students of a course into the seats left free.
+_PROMOTE_SQL = """
+    INSERT INTO enrollments (student_id, course_id)
+        SELECT student_id, course_id FROM waitlist WHERE course_id = {course}
+        ORDER BY seq
+        LIMIT max(0, (SELECT capacity FROM course_capacity WHERE course_id = {course})
+                     - (SELECT COUNT(*) FROM enrollments WHERE course_id = {course}));
+    DELETE FROM waitlist WHERE course_id = {course}
+        AND student_id IN (SELECT student_id FROM enrollments WHERE course_id = {course});
+"""
+
+# Deleting a course cascades to its enrollments; nothing is promoted then.
+_COURSE_EXISTS = "EXISTS (SELECT 1 FROM courses WHERE course_id = {course})"
+
+_ENROLL_SQL = """
+    INSERT INTO enrollments (student_id, course_id)
+        SELECT :student, :course
+        WHERE COALESCE((SELECT COUNT(*) FROM enrollments WHERE course_id = :course)
+                       < (SELECT capacity FROM course_capacity WHERE course_id = :course), 1)
+"""
+
+
+def create(conn):
+    """
+    Creates the capacity and waitlist tables and the promotion triggers if missing.
+
+    Must run after :func:`schema.create`, which may rebuild ``enrollments``
+    and drop its triggers.
+
+    :param conn: An open connection; the caller commits.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS course_capacity (
+            course_id TEXT PRIMARY KEY REFERENCES courses(course_id) ON DELETE CASCADE,
+            capacity INTEGER NOT NULL CHECK (capacity >= 0)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS waitlist (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id TEXT NOT NULL REFERENCES courses(course_id) ON DELETE CASCADE,
+            student_id TEXT NOT NULL REFERENCES students(student_id) ON DELETE CASCADE,
+            UNIQUE (course_id, student_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS waitlist_student ON waitlist (student_id)")
+
+    old, new = "OLD.course_id", "NEW.course_id"
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS enrollments_promote AFTER DELETE ON enrollments
+        WHEN EXISTS (SELECT 1 FROM course_capacity WHERE course_id = {old})
+            AND {_COURSE_EXISTS.format(course=old)}
+        BEGIN {_PROMOTE_SQL.format(course=old)} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS course_capacity_promote_insert AFTER INSERT ON course_capacity
+        BEGIN {_PROMOTE_SQL.format(course=new)} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS course_capacity_promote_update AFTER UPDATE OF capacity ON course_capacity
+        BEGIN {_PROMOTE_SQL.format(course=new)} END
+    """)
+    # An unlimited course has room for the whole waitlist.
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS course_capacity_promote_delete AFTER DELETE ON course_capacity
+        WHEN {_COURSE_EXISTS.format(course=old)}
+        BEGIN
+            INSERT INTO enrollments (student_id, course_id)
+                SELECT student_id, course_id FROM waitlist WHERE course_id = {old} ORDER BY seq;
+            DELETE FROM waitlist WHERE course_id = {old};
+        END
+    """)
+
+
+def set_capacity(conn, course_id, capacity):
+    """
+    Limits a course to ``capacity`` students, or lifts the limit.
+
+    Raising or lifting the limit promotes waitlisted students right away.
+    Lowering it below the current enrollment keeps everyone enrolled and only
+    stops new enrollments.
+
+    :param conn: An open connection; the caller commits.
+    :param course_id: The course.
+    :param capacity: Number of seats, or None for no limit.
+    """
+    if capacity is None:
+        conn.execute("DELETE FROM course_capacity WHERE course_id = ?", (course_id,))
+    else:
+        conn.execute("""
+            INSERT INTO course_capacity (course_id, capacity) VALUES (?, ?)
+            ON CONFLICT (course_id) DO UPDATE SET capacity = excluded.capacity
+        """, (course_id, capacity))
+
+
+def get_capacity(conn, course_id):
+    """Returns the number of seats of a course, or None if it is unlimited."""
+    row = conn.execute("SELECT capacity FROM course_capacity WHERE course_id = ?", (course_id,)).fetchone()
+    return row[0] if row else None
+
+
+def enroll(conn, student_id, course_id, waitlist=True, allow_conflicts=False):
+    """
+    Enrolls a student if the course has a free seat, atomically.
+
+    Enrolling a student who is already enrolled changes nothing; a student
+    already on the waitlist keeps their place. A course whose meetings
+    overlap the student's courses is refused, and not waitlisted either.
+    Promotion from the waitlist does not check the schedule again.
+
+    :param conn: An open connection with no transaction in progress; this
+                 function commits.
+    :param student_id: The student.
+    :param course_id: The course.
+    :param waitlist: Put the student on the waitlist if the course is full.
+    :param allow_conflicts: Skip the schedule check.
+    :return: A :class:`Registration`.
+    :raises sqlite3.IntegrityError: If the student or the course does not exist.
+    :raises schedule.ScheduleConflict: If the course overlaps the student's schedule.
+    """
+    try:
+        with _write_lock:
+            result = _enroll(conn, student_id, course_id, waitlist, allow_conflicts)
+    except schedule.ScheduleConflict:
+        metrics.inc("school_registrations_total", result="conflict")
+        raise
+    metrics.inc("school_registrations_total", result=result.status)
+    return result
+
+
+def _enroll(conn, student_id, course_id, waitlist, allow_conflicts):
+    with _transaction(conn):
+        if take_seat(conn, student_id, course_id, allow_conflicts):
+            return Registration(ENROLLED, None)
+        if waitlist:
+            conn.execute("INSERT OR IGNORE INTO waitlist (course_id, student_id) VALUES (?, ?)",
+                         (course_id, student_id))
+            return Registration(WAITLISTED, waitlist_position(conn, student_id, course_id))
+        return Registration(FULL, None)
+
+
+@contextmanager
+def _transaction(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+@contextmanager
+def transaction(conn):
+    """
+    Runs a write transaction that may take seats with :func:`take_seat`.
+
+    The write lock is taken up front with ``BEGIN IMMEDIATE``, queueing on
+    the registration lock of this process first. Commits at the end of the
+    block, or rolls back if it raises.
+
+    :param conn: An open connection with no transaction in progress.
+    """
+    with _write_lock, _transaction(conn):
+        yield conn
+
+
+def take_seat(conn, student_id, course_id, allow_conflicts=False):
+    """
+    Enrolls a student if the course has a free seat, within a :func:`transaction`.
+
+    A student who is enrolled already keeps their seat; one who gets a seat
+    leaves the course's waitlist.
+
+    :return: True if the student is enrolled, False if the course is full.
+    :raises sqlite3.IntegrityError: If the student or the course does not exist.
+    :raises schedule.ScheduleConflict: If the course overlaps the student's
+                                       schedule and ``allow_conflicts`` is false.
+    """
+    params = {"student": student_id, "course": course_id}
+    enrolled = conn.execute("SELECT 1 FROM enrollments WHERE student_id = :student AND course_id = :course",
+                            params).fetchone()
+    if not enrolled and not allow_conflicts:
+        clashes = schedule.conflicts(conn, student_id, course_id)
+        if clashes:
+            raise schedule.ScheduleConflict(student_id, course_id, clashes)
+    if enrolled or conn.execute(_ENROLL_SQL, params).rowcount:
+        conn.execute("DELETE FROM waitlist WHERE student_id = :student AND course_id = :course", params)
+        return True
+    return False
+
+
+def drop(conn, student_id, course_id):
+    """
+    Drops a student from a course, or from its waitlist.
+
+    The first waitlisted student takes the freed seat in the same transaction.
+
+    :param conn: An open connection with no transaction in progress; this
+                 function commits.
+    :return: True if the student was enrolled or waitlisted.
+    """
+    params = (student_id, course_id)
+    with transaction(conn):
+        dropped = conn.execute("DELETE FROM enrollments WHERE student_id = ? AND course_id = ?", params).rowcount
+        dropped += conn.execute("DELETE FROM waitlist WHERE student_id = ? AND course_id = ?", params).rowcount
+    return dropped > 0
+
+
+def waitlist_position(conn, student_id, course_id):
+    """Returns the 1-based waitlist place of a student, or None if not waitlisted."""
+    row = conn.execute("""
+        SELECT COUNT(*) FROM waitlist
+        WHERE course_id = ? AND seq <= (SELECT seq FROM waitlist WHERE course_id = ? AND student_id = ?)
+    """, (course_id, course_id, student_id)).fetchone()
+    return row[0] or None
+
+
+def get_waitlist(conn, course_id):
+    """Returns the IDs of the students waiting for a course, first in line first."""
+    return [row[0] for row in conn.execute("SELECT student_id FROM waitlist WHERE course_id = ? ORDER BY seq",
+                                           (course_id,))]
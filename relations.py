@@ -0,0 +1,155 @@
+"""
+Lazy loading of the relationships of the lab2_mmb78 models read by db_mmb78.
+
+Records read by db_mmb78 and :mod:`query` come without their related
+records: ``Course.instructor``, ``Course.enrolled_students``,
+``Student.registered_courses`` and ``Instructor.assigned_courses`` are
+loaded on first access instead, so a dropdown or list that only shows names
+runs no more than its own query.
+
+The records read together form a :class:`Batch` of up to
+:data:`BATCH_SIZE` objects of one model. The first access to a relationship
+of one of them loads it for the whole batch in one statement, so looping
+over the enrolled students of every course costs one query per batch rather
+than one per course (the N+1 pattern). The records loaded this way join a
+batch of their own, and within a :class:`Loader` each record is one object,
+so a relationship read twice, or from the other side, shares the objects
+loaded the first time.
+"""
+import weakref
+
+import metrics
+from lab2_mmb78 import Student, Instructor, Course
+
+# Objects of one model whose relationships are loaded together. Also the
+# number of keys bound in one IN (...) list.
+BATCH_SIZE = 500
+
+
+def iter_batched(rows, make, size=BATCH_SIZE):
+    """
+    Yields ``make(row)`` for each row, making ``size`` objects ahead.
+
+    A stream that made each object only when asked for would have a batch of
+    one object when the first relationship is read; this fills the batch first.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(make(row))
+        if len(chunk) == size:
+            yield from chunk
+            chunk = []
+    yield from chunk
+
+
+class Batch(list):
+    """Objects of one model read together, whose relationships load together."""
+
+    def __init__(self, loader):
+        super().__init__()
+        self.loader = loader
+        # course_id -> instructor_id of the courses, for Course.instructor
+        self.instructor_ids = {}
+
+    def load(self, name):
+        """Loads the relationship ``name`` of every object in the batch that lacks it."""
+        pending = [obj for obj in self if name not in obj.__dict__]
+        if pending:
+            self.loader.load(type(pending[0]), name, pending, self)
+
+
+class Loader:
+    """
+    Makes model objects from rows and loads their relationships on demand.
+
+    Keep one loader for the records of one read, e.g. a list of courses; the
+    objects keep it alive for as long as any of them may still load something.
+    Records are kept in the identity map only while they are in use, so a
+    stream of records through one loader stays flat in memory.
+
+    :param connect: Function returning a new connection, e.g. ``db_mmb78.connect``.
+    :param batch_size: Objects per batch.
+    """
+
+    def __init__(self, connect, batch_size=BATCH_SIZE):
+        self.connect = connect
+        self.batch_size = batch_size
+        self._identity = weakref.WeakValueDictionary()
+        self._batches = {}
+
+    def _track(self, cls, key, make):
+        obj = self._identity.get((cls, key))
+        if obj is not None:
+            metrics.cache_hit("identity_map")
+        else:
+            metrics.cache_miss("identity_map")
+            obj = make()
+            batch = self._batches.get(cls)
+            if batch is None or len(batch) >= self.batch_size:
+                batch = self._batches[cls] = Batch(self)
+            batch.append(obj)
+            obj.__dict__["_batch"] = batch
+            self._identity[cls, key] = obj
+        return obj
+
+    def student(self, row):
+        """Returns the student of a ``students`` row."""
+        return self._track(Student, row[0], lambda: Student(name=row[1], age=row[2], email=row[3], student_id=row[0]))
+
+    def instructor(self, row):
+        """Returns the instructor of an ``instructors`` row."""
+        return self._track(Instructor, row[0],
+                           lambda: Instructor(name=row[1], age=row[2], email=row[3], instructor_id=row[0]))
+
+    def course(self, row, instructor=None, capacity=None, meetings=None):
+        """
+        Returns the course of a ``courses`` row.
+
+        :param instructor: Its instructor if already read, else loaded on first access.
+        """
+        course = self._track(Course, row[0], lambda: Course(course_id=row[0], course_name=row[1], instructor=instructor,
+                                                            capacity=capacity, meetings=meetings))
+        if "instructor" not in course.__dict__:
+            course.__dict__["_batch"].instructor_ids[row[0]] = row[2]
+        return course
+
+    # Loading
+
+    def load(self, cls, name, objects, batch):
+        """Sets the relationship ``name`` of ``objects`` from one query."""
+        if cls is Course and name == "instructor":
+            keys = {batch.instructor_ids.get(course.course_id) for course in objects} - {None}
+            found = {row[0]: self.instructor(row) for row in self._query(
+                "SELECT * FROM instructors WHERE instructor_id IN ({})", keys, "instructor")}
+            for course in objects:
+                course.__dict__[name] = found.get(batch.instructor_ids.get(course.course_id))
+            return
+        sql, entity, make, attr = {
+            (Course, "enrolled_students"): (
+                "SELECT e.course_id, s.* FROM enrollments e JOIN students s ON s.student_id = e.student_id "
+                "WHERE e.course_id IN ({})", "enrollment", self.student, "course_id"),
+            (Student, "registered_courses"): (
+                "SELECT e.student_id, c.* FROM enrollments e JOIN courses c ON c.course_id = e.course_id "
+                "WHERE e.student_id IN ({})", "enrollment", self.course, "student_id"),
+            (Instructor, "assigned_courses"): (
+                "SELECT instructor_id, * FROM courses WHERE instructor_id IN ({})", "course", self.course,
+                "instructor_id"),
+        }[cls, name]
+        related = {getattr(obj, attr): [] for obj in objects}
+        for row in self._query(sql, related, entity):
+            related[row[0]].append(make(row[1:]))
+        for obj in objects:
+            obj.__dict__[name] = related[getattr(obj, attr)]
+
+    def _query(self, sql, keys, entity):
+        """Returns the rows of ``sql`` with its ``{}`` replaced by placeholders for ``keys``."""
+        keys = list(keys)
+        if not keys:
+            return []
+        conn = self.connect()
+        try:
+            rows = conn.execute(sql.format(", ".join("?" * len(keys))), keys).fetchall()
+        finally:
+            conn.close()
+        metrics.inc("school_crud_operations_total", entity=entity, op="read")
+        return rows
@@ -0,0 +1,671 @@
+"""
+Storage backends behind one repository interface.
+
+A :class:`Repository` stores students, instructors, courses and enrollments
+and offers lookups, exact and typo-tolerant name search and bulk operations.
+Records are plain tuples in the column order of the SQLite tables, so rows
+read from any backend can be shown by the same widgets:
+
+- students and instructors: ``(id, name, age, email)``
+- courses: ``(course_id, course_name, instructor_id)``
+
+Every record has a version, raised by each update and by its delete.
+:meth:`Repository.update` takes the version read with the record and then
+refuses to overwrite a record someone else changed meanwhile, raising
+:class:`StaleRecordError` (see :mod:`versions`).
+
+Four implementations are provided:
+
+- :class:`MemoryRepository` keeps everything in dicts and indexes.
+- :class:`JsonRepository` is a memory repository persisted to a JSON file
+  after every change, or once per :meth:`~Repository.transaction`.
+- :class:`SqliteRepository` works on the SQLite schema of ``db_mmb78``
+  (``enrollments``) or ``db`` (``student_courses``).
+- :class:`ReplicaRepository` is a SQLite repository reading from an
+  in-memory copy of the database.
+
+:func:`from_env` picks one from ``SCHOOL_BACKEND`` (``sqlite``, ``replica``,
+``json`` or ``memory``); ``bench_repository.py`` runs the same workload on
+each and ``bench_replica.py`` compares reads with and without the replica.
+"""
+import copy
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import fuzzy_index
+import schema
+import metrics
+import sql_trace
+import versions
+from versions import StaleRecordError
+
+KINDS = ("students", "instructors", "courses")
+
+# Interval of the GUI timer calling ReplicaRepository.sync().
+REPLICA_SYNC_MS = int(os.environ.get("SCHOOL_REPLICA_SYNC_MS", "1000"))
+
+# Column names of each kind; the first column is the key.
+FIELDS = {
+    "students": ("student_id", "name", "age", "email"),
+    "instructors": ("instructor_id", "name", "age", "email"),
+    "courses": ("course_id", "course_name", "instructor_id"),
+}
+
+# Column matched by search().
+NAME_FIELD = {"students": "name", "instructors": "name", "courses": "course_name"}
+
+
+class IntegrityError(Exception):
+    """Raised for a duplicate key or a reference to a missing record."""
+
+
+class Repository:
+    """
+    Interface shared by all storage backends.
+
+    ``kind`` is one of :data:`KINDS`. Deleting a student or course also
+    removes its enrollments; deleting an instructor unassigns their courses.
+    Outside :meth:`transaction` every call is committed on its own.
+    """
+
+    def add(self, kind, row):
+        """
+        Adds a record.
+
+        :raises IntegrityError: If the key exists or a referenced record does not.
+        """
+        self.add_many(kind, [row])
+
+    def add_many(self, kind, rows):
+        """Adds several records in one transaction."""
+        raise NotImplementedError
+
+    def get(self, kind, record_id):
+        """Returns the record with the given key, or None."""
+        raise NotImplementedError
+
+    def list(self, kind):
+        """Returns all records of a kind."""
+        raise NotImplementedError
+
+    def update(self, kind, row, version=None):
+        """
+        Replaces the record whose key is ``row[0]``.
+
+        :param version: If given, the record is only replaced if it is still
+                        at this version, as returned by :meth:`version`.
+        :return: True if the record existed.
+        :raises StaleRecordError: If ``version`` is given and the record was
+                                  changed or deleted since.
+        """
+        raise NotImplementedError
+
+    def version(self, kind, record_id):
+        """
+        Returns the version of a record; 0 if it was never updated or deleted.
+
+        Read it before the record to edit: a change in between then fails the
+        update instead of being overwritten.
+        """
+        raise NotImplementedError
+
+    def delete(self, kind, record_id):
+        """
+        Deletes a record and what depends on it.
+
+        :return: True if the record existed.
+        """
+        return self.delete_many(kind, [record_id]) == 1
+
+    def delete_many(self, kind, record_ids):
+        """
+        Deletes several records in one transaction.
+
+        :return: The number of records deleted.
+        """
+        raise NotImplementedError
+
+    def search(self, kind, text):
+        """
+        Returns the records whose name contains ``text`` (ignoring case) or
+        whose key equals ``text``.
+        """
+        raise NotImplementedError
+
+    def fuzzy_search(self, kind, text, limit=fuzzy_index.LIMIT):
+        """
+        Returns the records whose name best matches ``text``, best first.
+
+        Misspelled and sound-alike names match too, see :mod:`fuzzy_index`.
+        The index of a kind is built on first use and kept current by this
+        repository's own writes.
+        """
+        index = self._name_indexes.get(kind)
+        if index is None:
+            index = self._name_indexes[kind] = fuzzy_index.FuzzyIndex()
+            position = FIELDS[kind].index(NAME_FIELD[kind])
+            for row in self.list(kind):
+                index.add(row[0], str(row[position]))
+        rows = (self.get(kind, key) for key in index.search(text, limit))
+        return [row for row in rows if row is not None]
+
+    def _index_names(self, kind, rows):
+        index = self._name_indexes.get(kind)
+        if index is not None:
+            position = FIELDS[kind].index(NAME_FIELD[kind])
+            for row in rows:
+                index.add(row[0], str(row[position]))
+
+    def _unindex_names(self, kind, record_ids):
+        index = self._name_indexes.get(kind)
+        if index is not None:
+            for record_id in record_ids:
+                if record_id in index:
+                    index.remove(record_id)
+
+    def enroll(self, student_id, course_id):
+        """
+        Enrolls a student in a course.
+
+        :raises IntegrityError: If the student or the course does not exist.
+        """
+        self.enroll_many([(student_id, course_id)])
+
+    def enroll_many(self, pairs):
+        """Adds ``(student_id, course_id)`` enrollments in one transaction."""
+        raise NotImplementedError
+
+    def unenroll(self, student_id, course_id):
+        """
+        Removes an enrollment.
+
+        :return: True if the student was enrolled.
+        """
+        raise NotImplementedError
+
+    def enrolled_students(self, course_id):
+        """Returns the IDs of the students enrolled in a course."""
+        raise NotImplementedError
+
+    def courses_of(self, student_id):
+        """Returns the IDs of the courses a student is enrolled in."""
+        raise NotImplementedError
+
+    def enrollments(self):
+        """Returns every enrollment as a ``(student_id, course_id)`` pair."""
+        raise NotImplementedError
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups calls into one transaction, rolled back if the block raises.
+
+        Transactions nest; only the outermost one commits.
+        """
+        raise NotImplementedError
+        yield
+
+    def close(self):
+        pass
+
+
+class MemoryRepository(Repository):
+    """
+    Keeps all records in dicts, with enrollment indexes in both directions.
+
+    A transaction snapshots the data when it starts, so rolling back costs a
+    copy of the dataset; bulk methods validate before changing anything and
+    need no snapshot.
+    """
+
+    def __init__(self):
+        self._records = {kind: {} for kind in KINDS}
+        self._versions = {kind: {} for kind in KINDS}
+        self._students_of = {}
+        self._courses_of = {}
+        self._name_indexes = {}
+        self._depth = 0
+
+    def _check_refs(self, kind, row):
+        if kind == "courses" and row[2] is not None and row[2] not in self._records["instructors"]:
+            raise IntegrityError(f"unknown instructor {row[2]!r}")
+
+    def add_many(self, kind, rows):
+        records = self._records[kind]
+        rows = [tuple(row) for row in rows]
+        seen = set()
+        for row in rows:
+            if row[0] in records or row[0] in seen:
+                raise IntegrityError(f"duplicate key {row[0]!r} in {kind}")
+            seen.add(row[0])
+            self._check_refs(kind, row)
+        for row in rows:
+            records[row[0]] = row
+        self._index_names(kind, rows)
+        self._changed()
+
+    def get(self, kind, record_id):
+        return self._records[kind].get(record_id)
+
+    def version(self, kind, record_id):
+        return self._versions[kind].get(record_id, 0)
+
+    def list(self, kind):
+        return list(self._records[kind].values())
+
+    def update(self, kind, row, version=None):
+        row = tuple(row)
+        records = self._records[kind]
+        current = self._versions[kind].get(row[0], 0)
+        if version is not None and current != version:
+            raise StaleRecordError(kind, row[0], records.get(row[0]), current)
+        if row[0] not in records:
+            return False
+        self._check_refs(kind, row)
+        records[row[0]] = row
+        self._versions[kind][row[0]] = current + 1
+        self._index_names(kind, [row])
+        self._changed()
+        return True
+
+    def delete_many(self, kind, record_ids):
+        records = self._records[kind]
+        deleted = 0
+        for record_id in record_ids:
+            if records.pop(record_id, None) is None:
+                continue
+            deleted += 1
+            self._versions[kind][record_id] = self._versions[kind].get(record_id, 0) + 1
+            self._unindex_names(kind, [record_id])
+            if kind == "students":
+                for course_id in self._courses_of.pop(record_id, ()):
+                    self._students_of[course_id].discard(record_id)
+            elif kind == "courses":
+                for student_id in self._students_of.pop(record_id, ()):
+                    self._courses_of[student_id].discard(record_id)
+            else:
+                courses = self._records["courses"]
+                for course_id, course in courses.items():
+                    if course[2] == record_id:
+                        courses[course_id] = course[:2] + (None,)
+                        self._versions["courses"][course_id] = self._versions["courses"].get(course_id, 0) + 1
+        if deleted:
+            self._changed()
+        return deleted
+
+    def search(self, kind, text):
+        needle = text.lower()
+        position = FIELDS[kind].index(NAME_FIELD[kind])
+        return [row for row in self._records[kind].values()
+                if needle in str(row[position]).lower() or row[0] == text]
+
+    def enroll_many(self, pairs):
+        pairs = list(pairs)
+        for student_id, course_id in pairs:
+            if student_id not in self._records["students"]:
+                raise IntegrityError(f"unknown student {student_id!r}")
+            if course_id not in self._records["courses"]:
+                raise IntegrityError(f"unknown course {course_id!r}")
+        for student_id, course_id in pairs:
+            self._students_of.setdefault(course_id, set()).add(student_id)
+            self._courses_of.setdefault(student_id, set()).add(course_id)
+        self._changed()
+
+    def unenroll(self, student_id, course_id):
+        students = self._students_of.get(course_id, set())
+        if student_id not in students:
+            return False
+        students.discard(student_id)
+        self._courses_of[student_id].discard(course_id)
+        self._changed()
+        return True
+
+    def enrolled_students(self, course_id):
+        return list(self._students_of.get(course_id, ()))
+
+    def courses_of(self, student_id):
+        return list(self._courses_of.get(student_id, ()))
+
+    def enrollments(self):
+        return [(student_id, course_id) for course_id, students in self._students_of.items() for student_id in students]
+
+    @contextmanager
+    def transaction(self):
+        if self._depth:
+            self._depth += 1
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+            return
+        snapshot = copy.deepcopy((self._records, self._versions, self._students_of, self._courses_of))
+        self._depth = 1
+        try:
+            yield self
+        except BaseException:
+            self._records, self._versions, self._students_of, self._courses_of = snapshot
+            self._name_indexes.clear()
+            raise
+        finally:
+            self._depth = 0
+        self._commit()
+
+    def _changed(self):
+        if not self._depth:
+            self._commit()
+
+    def _commit(self):
+        pass
+
+
+class JsonRepository(MemoryRepository):
+    """
+    A memory repository saved to a JSON file after each committed change.
+
+    The file is rewritten through a temporary file, so a crash leaves either
+    the old or the new version.
+
+    :param path: Path of the JSON file; loaded if it exists.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as file:
+                data = json.load(file)
+            for kind in KINDS:
+                self._records[kind] = {row[0]: tuple(row) for row in data.get(kind, [])}
+                self._versions[kind] = data.get("versions", {}).get(kind, {})
+            for student_id, course_id in data.get("enrollments", []):
+                self._students_of.setdefault(course_id, set()).add(student_id)
+                self._courses_of.setdefault(student_id, set()).add(course_id)
+
+    def _commit(self):
+        data = {kind: list(self._records[kind].values()) for kind in KINDS}
+        data["versions"] = self._versions
+        data["enrollments"] = [(student_id, course_id)
+                               for course_id, students in self._students_of.items()
+                               for student_id in students]
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(data, file)
+        os.replace(tmp, self.path)
+
+
+class SqliteRepository(Repository):
+    """
+    A repository over the SQLite schema used by the apps.
+
+    :param path: Path of the database file.
+    :param enrollment_table: ``"enrollments"`` (db_mmb78) or ``"student_courses"`` (db).
+    :param create: Create the tables if they do not exist.
+    """
+
+    def __init__(self, path, enrollment_table="enrollments", create=False):
+        self.path = path
+        self.enrollment_table = enrollment_table
+        self._conn = sql_trace.connect(path)
+        self._conn.execute("PRAGMA foreign_keys = 1")
+        # Connection the lookups read from.
+        self._reader = self._conn
+        self._name_indexes = {}
+        self._names_version = None
+        self._depth = 0
+        if create:
+            self.create_schema()
+
+    def create_schema(self):
+        schema.create(self._conn, self.enrollment_table)
+        versions.create(self._conn)
+        self._conn.commit()
+
+    @contextmanager
+    def transaction(self):
+        if self._depth:
+            self._depth += 1
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+            return
+        self._depth = 1
+        try:
+            self._conn.execute("BEGIN")
+            yield self
+        except BaseException:
+            self._conn.rollback()
+            self._name_indexes.clear()
+            raise
+        else:
+            self._conn.commit()
+        finally:
+            self._depth = 0
+
+    def _write(self, sql, params_seq):
+        try:
+            with self.transaction():
+                cursor = self._conn.executemany(sql, params_seq)
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+        return cursor.rowcount
+
+    def add_many(self, kind, rows):
+        fields = FIELDS[kind]
+        placeholders = ", ".join("?" * len(fields))
+        rows = [tuple(row) for row in rows]
+        self._write(f"INSERT INTO {kind} ({', '.join(fields)}) VALUES ({placeholders})", rows)
+        self._index_names(kind, rows)
+
+    def get(self, kind, record_id):
+        fields = FIELDS[kind]
+        return self._reader.execute(f"SELECT {', '.join(fields)} FROM {kind} WHERE {fields[0]} = ?",
+                                    (record_id,)).fetchone()
+
+    def version(self, kind, record_id):
+        return versions.get(self._reader, kind, record_id)
+
+    def list(self, kind):
+        return self._reader.execute(f"SELECT {', '.join(FIELDS[kind])} FROM {kind}").fetchall()
+
+    def update(self, kind, row, version=None):
+        fields = FIELDS[kind]
+        assignments = ", ".join(f"{field} = ?" for field in fields[1:])
+        row = tuple(row)
+        if version is None:
+            updated = self._write(f"UPDATE {kind} SET {assignments} WHERE {fields[0]} = ?", [row[1:] + row[:1]])
+        else:
+            updated = self._write(f"UPDATE {kind} SET {assignments} WHERE {fields[0]} = ? AND {versions.matches(kind)}",
+                                  [row[1:] + row[:1] + (version,)])
+            if updated != 1:
+                raise versions.stale(self._conn, kind, row[0], ", ".join(fields))
+        if updated != 1:
+            return False
+        self._index_names(kind, [row])
+        return True
+
+    def delete_many(self, kind, record_ids):
+        ids = [(record_id,) for record_id in record_ids]
+        if self._depth:
+            deleted = self._delete_chunk(kind, ids)
+        else:
+            # Outside a transaction, commit in chunks so other writers are not locked out.
+            deleted = sum(self._delete_chunk(kind, ids[start:start + schema.CHUNK_SIZE])
+                          for start in range(0, len(ids), schema.CHUNK_SIZE))
+        self._unindex_names(kind, [record_id for record_id, in ids])
+        return deleted
+
+    def _delete_chunk(self, kind, ids):
+        key = FIELDS[kind][0]
+        # Also done by the schema's cascades, but kept for databases not upgraded yet.
+        with self.transaction():
+            if kind == "students" or kind == "courses":
+                self._write(f"DELETE FROM {self.enrollment_table} WHERE {key} = ?", ids)
+            else:
+                self._write("UPDATE courses SET instructor_id = NULL WHERE instructor_id = ?", ids)
+            return self._write(f"DELETE FROM {kind} WHERE {key} = ?", ids)
+
+    def search(self, kind, text):
+        fields = FIELDS[kind]
+        return self._reader.execute(
+            f"SELECT {', '.join(fields)} FROM {kind} WHERE {NAME_FIELD[kind]} LIKE ? OR {fields[0]} = ?",
+            ("%" + text + "%", text)).fetchall()
+
+    def fuzzy_search(self, kind, text, limit=fuzzy_index.LIMIT):
+        # data_version only changes when another connection committed; rebuild then.
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._names_version:
+            self._name_indexes.clear()
+            self._names_version = version
+        return super().fuzzy_search(kind, text, limit)
+
+    def enroll_many(self, pairs):
+        self._write(f"INSERT INTO {self.enrollment_table} (student_id, course_id) VALUES (?, ?)", pairs)
+
+    def unenroll(self, student_id, course_id):
+        return self._write(f"DELETE FROM {self.enrollment_table} WHERE student_id = ? AND course_id = ?",
+                           [(student_id, course_id)]) > 0
+
+    def enrolled_students(self, course_id):
+        return [row[0] for row in self._reader.execute(
+            f"SELECT DISTINCT student_id FROM {self.enrollment_table} WHERE course_id = ?", (course_id,))]
+
+    def courses_of(self, student_id):
+        return [row[0] for row in self._reader.execute(
+            f"SELECT DISTINCT course_id FROM {self.enrollment_table} WHERE student_id = ?", (student_id,))]
+
+    def enrollments(self):
+        return self._reader.execute(f"SELECT DISTINCT student_id, course_id FROM {self.enrollment_table}").fetchall()
+
+    def close(self):
+        self._conn.close()
+
+
+class ReplicaRepository(SqliteRepository):
+    """
+    A SQLite repository that reads from an in-memory replica of the database.
+
+    The replica is copied from the file with SQLite's backup API when the
+    repository is opened. Writes go to the file and, once they succeeded
+    there, run again on the replica in a transaction mirroring the file's,
+    so the replica follows this repository's own changes without reading
+    the file back. Changes committed by other connections are picked up by
+    :meth:`sync`, which the apps call every :data:`REPLICA_SYNC_MS`.
+
+    Reads thus lag other apps' commits by up to that interval. Edits stay
+    safe: versions are read from the replica along with the records, so an
+    edit based on a lagging replica fails its version check in the file.
+    A write changing a different number of rows in the replica than in the
+    file shows the replica had missed a change; it is copied again after
+    the transaction.
+
+    :param path: Path of the database file.
+    :param enrollment_table: ``"enrollments"`` (db_mmb78) or ``"student_courses"`` (db).
+    :param create: Create the tables if they do not exist.
+    """
+
+    def __init__(self, path, enrollment_table="enrollments", create=False):
+        super().__init__(path, enrollment_table, create)
+        if self._reader is self._conn:
+            self.reload()
+
+    def create_schema(self):
+        super().create_schema()
+        self.reload()
+
+    def reload(self):
+        """Copies the database into the replica again."""
+        # Read first: a commit during the copy then triggers another one.
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        with metrics.timer("school_replica_sync_seconds"):
+            replica = sql_trace.connect(":memory:")
+            self._conn.backup(replica)
+            replica.execute("PRAGMA foreign_keys = 1")
+        if self._reader is not self._conn:
+            self._reader.close()
+        self._reader = replica
+        self._data_version = version
+        self._stale = False
+        self._name_indexes.clear()
+        metrics.inc("school_replica_syncs_total")
+
+    def sync(self):
+        """
+        Copies the database again if another connection committed since the last copy.
+
+        Only the check, one ``PRAGMA data_version``, runs when nothing changed.
+
+        :return: True if the replica was copied.
+        """
+        if self._depth:
+            return False
+        if not self._stale and self._conn.execute("PRAGMA data_version").fetchone()[0] == self._data_version:
+            return False
+        self.reload()
+        return True
+
+    @contextmanager
+    def transaction(self):
+        if self._depth:
+            with super().transaction():
+                yield self
+            return
+        self._reader.execute("BEGIN")
+        try:
+            with super().transaction():
+                yield self
+        except BaseException:
+            self._reader.rollback()
+            raise
+        self._reader.commit()
+        if self._stale:
+            self.reload()
+
+    def _write(self, sql, params_seq):
+        params_seq = list(params_seq)
+        with self.transaction():
+            count = super()._write(sql, params_seq)
+            try:
+                if self._reader.executemany(sql, params_seq).rowcount != count:
+                    self._stale = True
+            except sqlite3.Error:
+                self._stale = True
+        return count
+
+    def fuzzy_search(self, kind, text, limit=fuzzy_index.LIMIT):
+        # The name indexes are rebuilt from each new copy.
+        return Repository.fuzzy_search(self, kind, text, limit)
+
+    def close(self):
+        self._reader.close()
+        super().close()
+
+
+def from_env(sqlite_path, enrollment_table="enrollments", default="sqlite"):
+    """
+    Opens the backend selected by ``SCHOOL_BACKEND``.
+
+    ``sqlite`` opens ``sqlite_path``; ``replica`` opens it with an in-memory
+    read replica (see :class:`ReplicaRepository`); ``json`` opens
+    ``SCHOOL_REPO_PATH`` (default ``school_repo.json``); ``memory`` starts empty.
+
+    :param sqlite_path: Database file used by the SQLite backend.
+    :param enrollment_table: Enrollment table of that database.
+    :param default: Backend used if ``SCHOOL_BACKEND`` is not set, or None
+                    to return None then, for an app with storage of its own.
+    :return: A :class:`Repository`, or None.
+    """
+    backend = os.environ.get("SCHOOL_BACKEND", default)
+    if backend is None:
+        return None
+    if backend == "sqlite":
+        return SqliteRepository(sqlite_path, enrollment_table)
+    if backend == "replica":
+        return ReplicaRepository(sqlite_path, enrollment_table)
+    if backend == "json":
+        return JsonRepository(os.environ.get("SCHOOL_REPO_PATH", "school_repo.json"))
+    if backend == "memory":
+        return MemoryRepository()
+    raise ValueError(f"unknown SCHOOL_BACKEND {backend!r}")
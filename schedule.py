@@ -0,0 +1,198 @@
+"""
+Course meeting times and schedule conflicts for the db_mmb78 database.
+
+A course meets in weekly slots, each a :class:`Meeting` on one day, stored in
+the ``course_meetings`` table. Two courses conflict when any of their
+meetings share a day and overlap in time; meetings that only touch, one
+ending at 10:00 and the other starting then, do not.
+
+:func:`conflicts` checks one registration against the student's courses with
+a single join driven by the indexes on ``enrollments (student_id)`` and
+``course_meetings (course_id, day)``, so its cost depends on the size of that
+student's schedule, not on the number of enrollments. :func:`enroll` in
+``registration.py`` runs it in the enrollment transaction.
+
+:func:`conflict_report` finds every conflict across all enrollments. Courses
+are far fewer than enrollments, so it first finds the pairs of courses that
+conflict with one sweep over the meetings of each day, then streams the
+enrollments student by student and only looks the pairs of their courses up.
+``bench_schedule.py`` times both.
+"""
+import heapq
+import itertools
+import re
+from collections import namedtuple
+
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+Meeting = namedtuple("Meeting", "day start end")
+Meeting.__doc__ = """
+A weekly meeting of a course.
+
+``day`` is 0 for Monday to 6 for Sunday; ``start`` and ``end`` are minutes
+after midnight, ``start < end``.
+"""
+
+Conflict = namedtuple("Conflict", "student_id course_id other_course_id")
+Conflict.__doc__ = """A student enrolled in two courses whose meetings overlap."""
+
+_MEETING = re.compile(r"^\s*([A-Za-z]{3})[a-z]*\s+(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$")
+
+
+class ScheduleConflict(ValueError):
+    """
+    Raised when a registration would overlap courses the student already takes.
+
+    ``clashes`` lists ``(course_id, meeting, other_meeting)`` tuples: a course
+    the student is enrolled in, its meeting and the overlapping meeting of the
+    course being registered.
+    """
+
+    def __init__(self, student_id, course_id, clashes):
+        self.student_id = student_id
+        self.course_id = course_id
+        self.clashes = clashes
+        courses = ", ".join(sorted({course for course, _, _ in clashes}))
+        super().__init__(f"{course_id} overlaps {courses} in the schedule of {student_id}")
+
+
+def parse_meetings(text):
+    """
+    Parses meetings written like ``"Mon 09:00-10:15, Wed 09:00-10:15"``.
+
+    :param text: Comma-separated meetings; empty for none.
+    :return: A list of :class:`Meeting`.
+    :raises ValueError: If a meeting is malformed or ends before it starts.
+    """
+    meetings = []
+    for part in filter(str.strip, text.split(",")):
+        match = _MEETING.match(part)
+        day = match and match.group(1).title()
+        if not match or day not in DAYS:
+            raise ValueError(f"invalid meeting {part.strip()!r}, expected e.g. 'Mon 09:00-10:15'")
+        start_h, start_m, end_h, end_m = map(int, match.groups()[1:])
+        if start_h > 23 or end_h > 24 or start_m > 59 or end_m > 59:
+            raise ValueError(f"invalid time in meeting {part.strip()!r}")
+        meeting = Meeting(DAYS.index(day), start_h * 60 + start_m, end_h * 60 + end_m)
+        if meeting.start >= meeting.end:
+            raise ValueError(f"meeting {part.strip()!r} ends before it starts")
+        meetings.append(meeting)
+    return meetings
+
+
+def format_meetings(meetings):
+    """Returns meetings in the form read by :func:`parse_meetings`."""
+    return ", ".join(f"{DAYS[m.day]} {m.start // 60:02d}:{m.start % 60:02d}-{m.end // 60:02d}:{m.end % 60:02d}"
+                     for m in meetings)
+
+
+def create(conn):
+    """
+    Creates the ``course_meetings`` table if missing.
+
+    :param conn: An open connection; the caller commits.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS course_meetings (
+            course_id TEXT NOT NULL REFERENCES courses(course_id) ON DELETE CASCADE,
+            day INTEGER NOT NULL CHECK (day BETWEEN 0 AND 6),
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            CHECK (start_minute < end_minute)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS course_meetings_course ON course_meetings (course_id, day)")
+
+
+def set_meetings(conn, course_id, meetings):
+    """
+    Replaces the meetings of a course.
+
+    Students already enrolled stay enrolled even if the new times conflict;
+    :func:`conflict_report` lists them.
+
+    :param conn: An open connection; the caller commits.
+    :param course_id: The course.
+    :param meetings: An iterable of :class:`Meeting`.
+    """
+    conn.execute("DELETE FROM course_meetings WHERE course_id = ?", (course_id,))
+    conn.executemany("INSERT INTO course_meetings (course_id, day, start_minute, end_minute) VALUES (?, ?, ?, ?)",
+                     [(course_id,) + tuple(meeting) for meeting in meetings])
+
+
+def get_meetings(conn, course_id):
+    """Returns the meetings of a course in weekly order."""
+    return [Meeting(*row) for row in conn.execute("""
+        SELECT day, start_minute, end_minute FROM course_meetings WHERE course_id = ?
+        ORDER BY day, start_minute
+    """, (course_id,))]
+
+
+def conflicts(conn, student_id, course_id):
+    """
+    Returns the meetings of a student's courses that overlap a course's meetings.
+
+    :param conn: An open connection.
+    :param student_id: The student.
+    :param course_id: The course the student wants to take; it is not
+                      compared with itself if already enrolled.
+    :return: A list of ``(course_id, meeting, other_meeting)`` tuples, see
+             :class:`ScheduleConflict`.
+    """
+    rows = conn.execute("""
+        SELECT taken.course_id, taken.day, taken.start_minute, taken.end_minute,
+               wanted.start_minute, wanted.end_minute
+        FROM course_meetings AS wanted
+        JOIN enrollments ON enrollments.student_id = :student AND enrollments.course_id != :course
+        JOIN course_meetings AS taken ON taken.course_id = enrollments.course_id AND taken.day = wanted.day
+        WHERE wanted.course_id = :course
+            AND taken.start_minute < wanted.end_minute AND wanted.start_minute < taken.end_minute
+        ORDER BY taken.course_id, taken.day, taken.start_minute
+    """, {"student": student_id, "course": course_id})
+    return [(row[0], Meeting(*row[1:4]), Meeting(row[1], *row[4:])) for row in rows]
+
+
+def clashing_courses(conn):
+    """
+    Returns the pairs of courses whose meetings overlap.
+
+    Sweeps the meetings of each day in order of start, keeping the meetings
+    still running in a heap by end.
+
+    :return: A dict of course ID to the set of IDs of the courses it conflicts with.
+    """
+    clashes = {}
+    rows = conn.execute("""
+        SELECT day, start_minute, end_minute, course_id FROM course_meetings ORDER BY day, start_minute
+    """)
+    for _, meetings in itertools.groupby(rows, key=lambda row: row[0]):
+        running = []
+        for _, start, end, course_id in meetings:
+            while running and running[0][0] <= start:
+                heapq.heappop(running)
+            for _, other in running:
+                if other != course_id:
+                    clashes.setdefault(course_id, set()).add(other)
+                    clashes.setdefault(other, set()).add(course_id)
+            heapq.heappush(running, (end, course_id))
+    return clashes
+
+
+def conflict_report(conn):
+    """
+    Yields every pair of overlapping courses a student is enrolled in.
+
+    :param conn: An open connection, read until the generator is exhausted.
+    :return: An iterator of :class:`Conflict`, by student; each pair once.
+    """
+    clashes = clashing_courses(conn)
+    if not clashes:
+        return
+    rows = conn.execute("SELECT student_id, course_id FROM enrollments ORDER BY student_id")
+    for student_id, enrolled in itertools.groupby(rows, key=lambda row: row[0]):
+        taken = sorted(course_id for _, course_id in enrolled if course_id in clashes)
+        for i, course_id in enumerate(taken):
+            others = clashes[course_id]
+            for other in taken[i + 1:]:
+                if other in others:
+                    yield Conflict(student_id, course_id, other)
@@ -0,0 +1,143 @@
+"""
+Schema and set-based deletes shared by the SQLite data layers.
+
+:func:`create` makes the school tables. Deleting a student or a course
+cascades to its enrollments and deleting an instructor unassigns their
+courses. SQLite cannot change a foreign key in place, so databases created
+before the cascades existed are rebuilt by :func:`ensure_on_delete`.
+
+:func:`delete_ids` and :func:`delete_where` delete in chunks, committing
+after each one, so removing a whole graduating class never holds the write
+lock for longer than one chunk. With ``PRAGMA foreign_keys`` on, the cascades
+declared in the schema remove dependent rows in the same chunk.
+"""
+import logging
+
+logger = logging.getLogger("schema")
+
+CHUNK_SIZE = 500
+
+COURSES_SQL = (
+    "CREATE TABLE IF NOT EXISTS {name} (course_id TEXT PRIMARY KEY, course_name TEXT, instructor_id TEXT, "
+    "FOREIGN KEY(instructor_id) REFERENCES instructors(instructor_id) ON DELETE SET NULL)"
+)
+
+ENROLLMENTS_SQL = (
+    "CREATE TABLE IF NOT EXISTS {name} (student_id TEXT, course_id TEXT, "
+    "FOREIGN KEY(student_id) REFERENCES students(student_id) ON DELETE CASCADE, "
+    "FOREIGN KEY(course_id) REFERENCES courses(course_id) ON DELETE CASCADE)"
+)
+
+
+def create(conn, enrollment_table="enrollments"):
+    """
+    Creates the school tables if missing and upgrades older ones to cascading deletes.
+
+    Enrollments are indexed on both columns so the cascades, and the lookups
+    of a course's students or a student's courses, do not scan the table.
+    Triggers on a rebuilt table are lost, so the change feed must be
+    installed afterwards.
+
+    :param conn: An open connection; the tables are committed.
+    :param enrollment_table: ``"enrollments"`` (db_mmb78) or ``"student_courses"`` (db).
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS students (student_id TEXT PRIMARY KEY, name TEXT, age INTEGER, email TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS instructors (instructor_id TEXT PRIMARY KEY, name TEXT, age INTEGER, email TEXT)")
+    conn.execute(COURSES_SQL.format(name="courses"))
+    conn.execute(ENROLLMENTS_SQL.format(name=enrollment_table))
+    ensure_on_delete(conn, "courses", COURSES_SQL, {"instructor_id": "SET NULL"})
+    # Enrollments of already deleted students or courses would fail the new checks.
+    ensure_on_delete(conn, enrollment_table, ENROLLMENTS_SQL, {"student_id": "CASCADE", "course_id": "CASCADE"},
+                     keep_where="student_id IN (SELECT student_id FROM students) "
+                                "AND course_id IN (SELECT course_id FROM courses)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {enrollment_table}_student ON {enrollment_table} (student_id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {enrollment_table}_course ON {enrollment_table} (course_id)")
+    conn.commit()
+
+
+def ensure_on_delete(conn, table, create_sql, actions, keep_where=None):
+    """
+    Rebuilds ``table`` if its foreign keys lack the wanted ``ON DELETE`` actions.
+
+    Rows are copied to a table created from ``create_sql``, the old table is
+    dropped and the copy renamed, in one transaction with foreign key checks
+    off. Triggers on the old table are dropped with it and must be recreated.
+
+    :param conn: An open connection; pending changes are committed first.
+    :param table: Name of the table.
+    :param create_sql: ``CREATE TABLE`` statement with ``{name}`` in place of the name.
+    :param actions: Mapping of foreign key column to action, e.g. ``{"student_id": "CASCADE"}``.
+    :param keep_where: Optional condition selecting the rows to copy, used to
+                       drop rows that already violate the foreign keys.
+    :return: True if the table was rebuilt.
+    """
+    current = {row[3]: row[6] for row in conn.execute(f"PRAGMA foreign_key_list({table})")}
+    if not current or all(current.get(column) == action for column, action in actions.items()):
+        return False
+
+    columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA table_info({table})"))
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys = 0")
+    try:
+        conn.execute("BEGIN")
+        try:
+            conn.execute(create_sql.format(name=f"{table}_rebuild"))
+            copied = conn.execute(f"INSERT INTO {table}_rebuild ({columns}) SELECT {columns} FROM {table}"
+                                  + (f" WHERE {keep_where}" if keep_where else "")).rowcount
+            total = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {table}_rebuild RENAME TO {table}")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    finally:
+        conn.execute("PRAGMA foreign_keys = 1")
+    logger.info("rebuilt %s with ON DELETE %s; dropped %d orphaned rows", table, actions, total - copied)
+    return True
+
+
+def delete_ids(conn, table, key, ids, chunk_size=CHUNK_SIZE):
+    """
+    Deletes the rows whose ``key`` is in ``ids``, one transaction per chunk.
+
+    :param conn: An open connection with foreign keys enabled.
+    :param table: Name of the table.
+    :param key: Name of the key column.
+    :param ids: The key values to delete.
+    :param chunk_size: Rows deleted per transaction.
+    :return: The number of rows deleted.
+    """
+    ids = list(ids)
+    deleted = 0
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        placeholders = ", ".join("?" * len(chunk))
+        with conn:
+            deleted += conn.execute(f"DELETE FROM {table} WHERE {key} IN ({placeholders})", chunk).rowcount
+    return deleted
+
+
+def delete_where(conn, table, where, params=(), chunk_size=CHUNK_SIZE):
+    """
+    Deletes the rows matching a condition, one transaction per chunk.
+
+    :param conn: An open connection with foreign keys enabled.
+    :param table: Name of the table.
+    :param where: SQL condition; it is inserted into the statement as is, so
+                  it must come from code, never from user input. Values go in
+                  ``params``.
+    :param params: Parameters of the condition.
+    :param chunk_size: Rows deleted per transaction.
+    :return: The number of rows deleted.
+    """
+    deleted = 0
+    while True:
+        with conn:
+            count = conn.execute(
+                f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)",
+                tuple(params) + (chunk_size,),
+            ).rowcount
+        deleted += count
+        if count < chunk_size:
+            return deleted
@@ -0,0 +1,698 @@
+"""
+Data layer of the JSON-backed school management app.
+
+Holds the Person/Student/Instructor/Course model, the in-memory lists the
+PyQt front-end edits, and loading and saving them as JSON. Nothing here
+imports PyQt5, so scripts can work with the data without starting a GUI.
+
+The JSON file defaults to ``data.json`` next to this module and can be
+moved with the ``SCHOOL_DATA_PATH`` environment variable.
+
+The file is a snapshot with a journal next to it, ``<file>.log``: once the
+data is loaded, :func:`save_data` appends one line per record added,
+changed or removed since the last save instead of writing every record
+again, so a save costs as much as the change (plus a pass over the IDs of
+a list records were added to or removed from). Records changed by setting
+their attributes, ``add_student`` and ``assign_course`` are noticed by
+themselves, and so are records added to or removed from the lists; a change
+made by mutating a record's lists directly needs :func:`mark_changed`.
+:func:`load_data` reads the snapshot and replays the journal over it, and
+:func:`compact` folds the journal into a new snapshot, from a
+:class:`Compactor` thread in the app, once it is a sizable fraction of it.
+
+:func:`load_repository` and :func:`save_repository` keep the lists in a
+``repository.Repository`` instead, such as the one ``SCHOOL_BACKEND`` picks;
+a save then writes the same changes as a journal entry would, in one
+transaction.
+"""
+import json
+import logging
+import os
+import re
+import threading
+
+DATA_PATH = os.environ.get("SCHOOL_DATA_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.json"))
+
+# Seconds between checks of the background compactor.
+COMPACT_SECONDS = float(os.environ.get("SCHOOL_COMPACT_SECONDS", "60"))
+
+# The compactor folds the journal into the snapshot once the journal is at
+# least this fraction of the snapshot's size, which bounds the replay at load.
+COMPACT_RATIO = 0.25
+
+logger = logging.getLogger("school_data")
+
+# Records changed since the last save or load, by id(); see mark_changed().
+_changed = {}
+
+
+class Person:
+    """
+    Represents a person with a name, age, and email address.
+
+    :param name: The name of the person.
+    :param age: The age of the person.
+    :param email: The email address of the person.
+    """
+
+    def __init__(self, name: str, age: int, email: str):
+        """
+        Initializes a new Person instance.
+
+        :param name: The name of the person.
+        :param age: The age of the person (must be non-negative).
+        :param email: The email address of the person (must be valid).
+        """
+        self.name = name
+        self.age = self.validate_age(age)
+        self._email = self.validate_email(email)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        _changed[id(self)] = self
+
+    def introduce(self):
+        """
+        Introduces the person by printing their name and age.
+        """
+        print(f"Hello, my name is {self.name}. I am {self.age} years old.")
+
+    @staticmethod
+    def validate_email(email: str):
+        """
+        Validates the format of an email address.
+
+        :param email: The email address to validate.
+        :raises ValueError: If the email format is invalid.
+        :return: The validated email address.
+        """
+        if re.match(r'^[\w\.-]+@[\w\.-]+\.\w+$', email):
+            return email
+        else:
+            raise ValueError("Invalid email format")
+
+    @staticmethod
+    def validate_age(age: int):
+        """
+        Validates the age of a person.
+
+        :param age: The age to validate.
+        :raises ValueError: If the age is negative.
+        :return: The validated age.
+        """
+        if age < 0:
+            raise ValueError("Age cannot be negative")
+        return age
+
+    def to_dict(self):
+        """
+        Converts the Person instance to a dictionary.
+
+        :return: A dictionary representation of the person.
+        """
+        return {
+            'name': self.name,
+            'age': self.age,
+            'email': self._email
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a Person instance from a dictionary.
+
+        :param data: A dictionary containing the person's data.
+        :return: A new Person instance.
+        """
+        return cls(data['name'], data['age'], data['email'])
+
+
+class Student(Person):
+    """
+    Represents a student, inheriting from the Person class.
+
+    :param name: The name of the student.
+    :param age: The age of the student.
+    :param email: The email address of the student.
+    :param student_id: The unique identifier for the student.
+    """
+
+    def __init__(self, name: str, age: int, email: str, student_id: str):
+        """
+        Initializes a new Student instance.
+
+        :param name: The name of the student.
+        :param age: The age of the student (must be non-negative).
+        :param email: The email address of the student (must be valid).
+        :param student_id: The unique identifier for the student.
+        """
+        super().__init__(name, age, email)
+        self.student_id = student_id
+        self.registered_courses = []
+
+    def register_course(self, course):
+        """
+        Registers a course for the student.
+
+        :param course: The course to register.
+        """
+        self.registered_courses.append(course)
+        course.add_student(self)
+        print(f"Course {course.course_name} has been registered for student {self.name}.")
+
+    def to_dict(self):
+        """
+        Converts the Student instance to a dictionary.
+
+        :return: A dictionary representation of the student.
+        """
+        return {
+            **super().to_dict(),
+            'student_id': self.student_id,
+            'registered_courses': [course.course_id for course in self.registered_courses]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a Student instance from a dictionary.
+
+        :param data: A dictionary containing the student's data.
+        :return: A new Student instance.
+        """
+        student = cls(data['name'], data['age'], data['email'], data['student_id'])
+        return student
+
+
+class Instructor(Person):
+    """
+    Represents an instructor, inheriting from the Person class.
+
+    :param name: The name of the instructor.
+    :param age: The age of the instructor.
+    :param email: The email address of the instructor.
+    :param instructor_id: The unique identifier for the instructor.
+    """
+
+    def __init__(self, name: str, age: int, email: str, instructor_id: str):
+        """
+        Initializes a new Instructor instance.
+
+        :param name: The name of the instructor.
+        :param age: The age of the instructor (must be non-negative).
+        :param email: The email address of the instructor (must be valid).
+        :param instructor_id: The unique identifier for the instructor.
+        """
+        super().__init__(name, age, email)
+        self.instructor_id = instructor_id
+        self.assigned_courses = []
+
+    def assign_course(self, course):
+        """
+        Assigns a course to the instructor.
+
+        :param course: The course to assign.
+        """
+        self.assigned_courses.append(course)
+        _changed[id(self)] = self
+        course.instructor = self
+        print(f"Instructor {self.name} has been assigned to course {course.course_name}.")
+
+    def to_dict(self):
+        """
+        Converts the Instructor instance to a dictionary.
+
+        :return: A dictionary representation of the instructor.
+        """
+        return {
+            **super().to_dict(),
+            'instructor_id': self.instructor_id,
+            'assigned_courses': [course.course_id for course in self.assigned_courses]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates an Instructor instance from a dictionary.
+
+        :param data: A dictionary containing the instructor's data.
+        :return: A new Instructor instance.
+        """
+        instructor = cls(data['name'], data['age'], data['email'], data['instructor_id'])
+        return instructor
+
+
+class Course:
+    """
+    Represents a course in the school management system.
+
+    :param course_id: The unique identifier for the course.
+    :param course_name: The name of the course.
+    """
+
+    def __init__(self, course_id: str, course_name: str):
+        """
+        Initializes a new Course instance.
+
+        :param course_id: The unique identifier for the course.
+        :param course_name: The name of the course.
+        """
+        self.course_id = course_id
+        self.course_name = course_name
+        self.instructor = None
+        self.enrolled_students = []
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        _changed[id(self)] = self
+
+    def add_student(self, student):
+        """
+        Adds a student to the course.
+
+        :param student: The student to add to the course.
+        """
+        self.enrolled_students.append(student)
+        _changed[id(self)] = self
+        print(f"Student {student.name} has been added to course {self.course_name}.")
+
+    def to_dict(self):
+        """
+        Converts the Course instance to a dictionary.
+
+        :return: A dictionary representation of the course.
+        """
+        return {
+            'course_id': self.course_id,
+            'course_name': self.course_name,
+            'instructor': self.instructor.instructor_id if self.instructor else None,
+            'enrolled_students': [student.student_id for student in self.enrolled_students]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a Course instance from a dictionary.
+
+        :param data: A dictionary containing the course's data.
+        :return: A new Course instance.
+        """
+        course = cls(data['course_id'], data['course_name'])
+        return course
+
+
+class _Records(list):
+    """A list of records that notes whether records were added or removed since the last save."""
+
+    touched = False
+
+
+def _touching(method):
+    def touch(self, *args):
+        self.touched = True
+        return method(self, *args)
+    return touch
+
+
+for _name in ("append", "extend", "insert", "remove", "pop", "clear", "__setitem__", "__delitem__", "__iadd__"):
+    setattr(_Records, _name, _touching(getattr(list, _name)))
+
+
+students = _Records()
+instructors = _Records()
+courses = _Records()
+
+# Key attribute of the records of each list.
+KEYS = {"students": "student_id", "instructors": "instructor_id", "courses": "course_id"}
+
+# Serializes save_data() and the compactor's swap of the files.
+_lock = threading.Lock()
+# File the lists were last loaded from or saved to, whose journal save_data() appends to.
+_journal_path = None
+# The records in the lists at the last save or load, per kind: id() -> (record, key).
+_saved = {kind: {} for kind in KEYS}
+# Snapshots written by save_data() in full, so the compactor can tell its fold is outdated.
+_snapshots = 0
+
+
+def _records():
+    return {"students": students, "instructors": instructors, "courses": courses}
+
+
+def _entry(kind, record):
+    """Returns the JSON object of a record in the snapshot and the journal."""
+    if kind == "students":
+        return {"name": record.name, "age": record.age, "email": record._email, "student_id": record.student_id}
+    if kind == "instructors":
+        return {"name": record.name, "age": record.age, "email": record._email, "instructor_id": record.instructor_id,
+                "assigned_courses": [c.course_id for c in record.assigned_courses]}
+    return {"course_id": record.course_id, "course_name": record.course_name,
+            "enrolled_students": [s.student_id for s in record.enrolled_students],
+            "instructor": record.instructor.instructor_id if record.instructor else None}
+
+
+def mark_changed(*records):
+    """
+    Has the next :func:`save_data` write these records again.
+
+    Only needed after changing a list inside a record, e.g.
+    ``course.enrolled_students.remove(student)``; setting attributes and
+    adding or removing records from the lists are noticed by themselves.
+    """
+    for record in records:
+        _changed[id(record)] = record
+
+
+def _mark_saved(path):
+    global _journal_path
+    _journal_path = path
+    for kind, records in _records().items():
+        _saved[kind] = {id(record): (record, getattr(record, KEYS[kind])) for record in records}
+        records.touched = False
+    _changed.clear()
+
+
+def _changes():
+    """
+    Returns the journal entries of the changes since the last save or load,
+    and what to update in ``_saved`` once they are written.
+    """
+    entries, updates = [], []
+    for kind, records in _records().items():
+        saved = _saved[kind]
+        if records.touched:
+            current = set(map(id, records))
+            removed = saved.keys() - current
+            added = current - saved.keys()
+        else:
+            # Only edits: no pass over the list.
+            current = saved
+            removed = added = ()
+        changed = {record_id: record for record_id, record in _changed.items()
+                   if record_id in current and record_id in saved}
+        if added:
+            changed.update((id(record), record) for record in records if id(record) in added)
+        for record_id in removed:
+            entries.append(["delete", kind, saved[record_id][1]])
+        for record_id, record in changed.items():
+            if record_id in saved and saved[record_id][1] != getattr(record, KEYS[kind]):
+                # Its key changed: the record under the old key is gone.
+                entries.append(["delete", kind, saved[record_id][1]])
+            entries.append(["put", kind, _entry(kind, record)])
+        updates.append((kind, removed, changed))
+    return entries, updates
+
+
+def _write_json(path, data):
+    """Replaces a file with the JSON of ``data``, so a crash leaves the old or the new file."""
+    with open(path + ".tmp", "w") as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def save_data(file_path=None):
+    """
+    Save the changes to students, instructors, and courses since the last save.
+
+    If the lists were loaded from or last saved to this file, each record
+    added, changed or removed since is appended to its journal,
+    ``<file>.log``. Otherwise the whole data is written as a new snapshot
+    and any old journal is removed.
+
+    Parameters:
+        file_path (str): Destination file; defaults to ``DATA_PATH``.
+
+    Raises:
+        IOError: If there is an issue opening or writing to the file.
+    """
+    global _snapshots
+    path = os.path.abspath(file_path or DATA_PATH)
+    with _lock:
+        if path != _journal_path or not os.path.exists(path):
+            data = {kind: [_entry(kind, record) for record in records] for kind, records in _records().items()}
+            _write_json(path, data)
+            if os.path.exists(path + ".log"):
+                os.remove(path + ".log")
+            _snapshots += 1
+            _mark_saved(path)
+        else:
+            entries, updates = _changes()
+            if entries:
+                with open(path + ".log", "a") as log:
+                    log.write("".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries))
+                    log.flush()
+                    os.fsync(log.fileno())
+            _mark_written(updates)
+
+
+def _mark_written(updates):
+    for kind, removed, changed in updates:
+        _records()[kind].touched = False
+        for record_id in removed:
+            del _saved[kind][record_id]
+        for record_id, record in changed.items():
+            _saved[kind][record_id] = (record, getattr(record, KEYS[kind]))
+    _changed.clear()
+
+
+def _read_log(path, size=None):
+    """Returns the entries of a journal, or of its first ``size`` bytes."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as log:
+        text = log.read() if size is None else log.read(size)
+    entries = []
+    for line in text.decode("utf-8").splitlines():
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # A line cut short by a crash was never saved.
+            break
+    return entries
+
+
+def _replay(data, entries):
+    """Applies journal entries to snapshot data, in place."""
+    tables = {kind: {entry[KEYS[kind]]: entry for entry in data.get(kind, [])} for kind in KEYS}
+    for op, kind, value in entries:
+        if op == "put":
+            tables[kind][value[KEYS[kind]]] = value
+        else:
+            tables[kind].pop(value, None)
+    for kind in KEYS:
+        data[kind] = list(tables[kind].values())
+
+
+def load_data(file_path=None):
+    """
+    Load student, instructor, and course data from a JSON file.
+
+    This function reads the snapshot in the JSON file and replays its
+    journal over it, clears the existing lists of students, instructors, and
+    courses, and populates them with the loaded data. The function creates
+    instances of `Student`, `Instructor`, and `Course` based on the data
+    structure defined in the JSON file. It also establishes relationships
+    between instructors and courses, as well as between students and courses.
+
+    Parameters:
+        file_path (str): Source file; defaults to ``DATA_PATH``.
+
+    Raises:
+        FileNotFoundError: If the specified file does not exist.
+        json.JSONDecodeError: If the file contents cannot be parsed as JSON.
+    """
+    path = os.path.abspath(file_path or DATA_PATH)
+    with _lock:
+        with open(path, 'r') as file:
+            data = json.load(file)
+        _replay(data, _read_log(path + ".log"))
+    _populate(data)
+    _mark_saved(path)
+
+
+def _populate(data):
+    """Replaces the lists with the records of snapshot data."""
+    students.clear()
+    instructors.clear()
+    courses.clear()
+
+    for s_data in data["students"]:
+        student = Student(s_data["name"], s_data["age"], s_data["email"], s_data["student_id"])
+        students.append(student)
+    students_by_id = {}
+    for student in students:
+        students_by_id.setdefault(student.student_id, student)
+
+    for i_data in data["instructors"]:
+        instructor = Instructor(i_data["name"], i_data["age"], i_data["email"], i_data["instructor_id"])
+        # Courses are assigned below, once they exist.
+        instructors.append(instructor)
+    instructors_by_id = {}
+    for instructor in instructors:
+        instructors_by_id.setdefault(instructor.instructor_id, instructor)
+
+    for c_data in data["courses"]:
+        course = Course(c_data["course_id"], c_data["course_name"])
+        for student_id in c_data["enrolled_students"]:
+            student = students_by_id.get(student_id)
+            if student:
+                course.add_student(student)
+        courses.append(course)
+        if c_data["instructor"]:
+            instructor = instructors_by_id.get(c_data["instructor"])
+            if instructor:
+                course.instructor = instructor
+                instructor.assign_course(course)
+
+
+def load_repository(repo):
+    """
+    Load the lists from a repository instead of the JSON file.
+
+    Each kind of record is read in one call, and the enrollments in one more.
+
+    Parameters:
+        repo (repository.Repository): The storage to read.
+    """
+    enrolled = {}
+    for student_id, course_id in repo.enrollments():
+        enrolled.setdefault(course_id, []).append(student_id)
+    _populate({
+        "students": [{"student_id": row[0], "name": row[1], "age": row[2], "email": row[3]}
+                     for row in repo.list("students")],
+        "instructors": [{"instructor_id": row[0], "name": row[1], "age": row[2], "email": row[3]}
+                        for row in repo.list("instructors")],
+        "courses": [{"course_id": row[0], "course_name": row[1], "instructor": row[2],
+                     "enrolled_students": enrolled.get(row[0], [])}
+                    for row in repo.list("courses")],
+    })
+    # A later save_data() writes a whole snapshot.
+    _mark_saved(None)
+
+
+def save_repository(repo):
+    """
+    Save the changes since the last load or save to a repository.
+
+    The records added, changed or removed are written in one transaction,
+    as rows of the repository's tables, along with the enrollments of the
+    courses saved.
+
+    Parameters:
+        repo (repository.Repository): The storage to write.
+
+    Raises:
+        repository.IntegrityError: If a course refers to an instructor the
+            repository does not have; nothing is written then.
+    """
+    with _lock:
+        entries, updates = _changes()
+        with repo.transaction():
+            for op, kind, value in entries:
+                if op == "delete":
+                    repo.delete(kind, value)
+                    continue
+                if kind == "courses":
+                    row = (value["course_id"], value["course_name"], value["instructor"])
+                else:
+                    row = (value[KEYS[kind]], value["name"], value["age"], value["email"])
+                if not repo.update(kind, row):
+                    repo.add(kind, row)
+                if kind == "courses":
+                    wanted = {student_id for student_id in value["enrolled_students"]
+                              if repo.get("students", student_id) is not None}
+                    stored = set(repo.enrolled_students(row[0]))
+                    for student_id in stored - wanted:
+                        repo.unenroll(student_id, row[0])
+                    repo.enroll_many([(student_id, row[0]) for student_id in wanted - stored])
+        _mark_written(updates)
+
+
+def compact(file_path=None):
+    """
+    Folds the journal of a data file into a new snapshot.
+
+    Runs alongside the app: saves made meanwhile are kept in the journal.
+    A crash at any point leaves files that load to the same data.
+
+    :param file_path: Data file; defaults to ``DATA_PATH``.
+    :return: True if there was a journal to fold.
+    """
+    path = os.path.abspath(file_path or DATA_PATH)
+    log_path = path + ".log"
+    with _lock:
+        size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        snapshots = _snapshots
+    if not size:
+        return False
+    with open(path) as file:
+        data = json.load(file)
+    _replay(data, _read_log(log_path, size))
+    with open(path + ".compact", "w") as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+
+    with _lock:
+        if snapshots != _snapshots:
+            # save_data() wrote a whole snapshot meanwhile; this fold is outdated.
+            os.remove(path + ".compact")
+            return False
+        with open(log_path, "rb") as log:
+            log.seek(size)
+            rest = log.read()
+        # If the app dies between the two replaces, the new snapshot is read
+        # with the whole old journal, whose entries are safe to apply twice.
+        os.replace(path + ".compact", path)
+        with open(log_path + ".tmp", "wb") as log:
+            log.write(rest)
+            log.flush()
+            os.fsync(log.fileno())
+        os.replace(log_path + ".tmp", log_path)
+    logger.info("compacted %d journal bytes into %s", size, path)
+    return True
+
+
+class Compactor(threading.Thread):
+    """
+    Background thread running :func:`compact` when the journal has grown.
+
+    Every ``interval`` seconds, folds the journal once it reaches ``ratio``
+    of the snapshot's size. Only the files are read, never the lists, so it
+    needs no coordination with the GUI thread beyond :func:`save_data`'s lock.
+
+    :param file_path: Data file; defaults to ``DATA_PATH``.
+    :param interval: Seconds between checks.
+    :param ratio: Size of the journal relative to the snapshot that triggers a fold.
+    """
+
+    def __init__(self, file_path=None, interval=COMPACT_SECONDS, ratio=COMPACT_RATIO):
+        super().__init__(name="school-data-compactor", daemon=True)
+        self.file_path = file_path
+        self.interval = interval
+        self.ratio = ratio
+        self._stopped = threading.Event()
+
+    def due(self):
+        """Returns True if the journal is large enough to fold."""
+        path = os.path.abspath(self.file_path or DATA_PATH)
+        try:
+            log_size = os.path.getsize(path + ".log")
+            return log_size > 0 and log_size >= self.ratio * os.path.getsize(path)
+        except OSError:
+            return False
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                if self.due():
+                    compact(self.file_path)
+            except (OSError, ValueError):
+                # Tried again at the next interval; the journal still holds everything.
+                logger.exception("compacting %s failed", self.file_path or DATA_PATH)
+
+    def stop(self):
+        """Stops the thread after the current check."""
+        self._stopped.set()
@@ -0,0 +1,138 @@
+"""
+Normalized JSON documents of the lab2_mmb78 model graph.
+
+``Course.to_dict`` embeds its instructor and students whole, so a catalog
+serialized course by course repeats every student once per course, and
+``from_dict`` makes a separate object of each copy. :func:`to_document`
+writes every student, instructor and course reachable from the given
+objects once, under its ID, with relationships as lists of IDs::
+
+    {"format": 1,
+     "students": {"S1": {"name": "Ann", "age": 20, "email": "ann@school.edu",
+                         "registered_courses": ["C1"]}},
+     "instructors": {"I1": {"name": "Bob", "age": 40, "email": "bob@school.edu",
+                            "assigned_courses": ["C1"]}},
+     "courses": {"C1": {"course_name": "Math", "capacity": 30, "meetings": "Mon 09:00-10:00",
+                        "instructor": "I1", "enrolled_students": ["S1"]}}}
+
+Cycles, such as a course whose student is registered in it, are only IDs.
+:func:`from_document` makes every object first and then resolves the IDs in
+one pass, so each record is one object and the relationships point at each
+other as they did. Only relationships that are loaded are followed and
+written (see ``lab2_mmb78.relationship``), so serializing records read by
+db_mmb78 does not read the rest of the database; one not written keeps its
+default when read back.
+"""
+import json
+from collections import namedtuple
+
+import schedule
+from lab2_mmb78 import Student, Instructor, Course, is_loaded
+
+FORMAT = 1
+
+# Model, document section, key attribute, and section of each relationship.
+_KINDS = (
+    (Student, "students", "student_id", {"registered_courses": "courses"}),
+    (Instructor, "instructors", "instructor_id", {"assigned_courses": "courses"}),
+    (Course, "courses", "course_id", {"instructor": "instructors", "enrolled_students": "students"}),
+)
+
+# Key attribute of the objects of each section.
+_KEYS = {section: key for _, section, key, _ in _KINDS}
+
+Graph = namedtuple("Graph", "students instructors courses")
+Graph.__doc__ = """
+The objects of a document, each a dict from ID to object.
+"""
+
+
+def _kind(obj):
+    for kind in _KINDS:
+        if isinstance(obj, kind[0]):
+            return kind
+    raise TypeError(f"not a model object: {obj!r}")
+
+
+def _fields(obj):
+    if isinstance(obj, Course):
+        meetings = schedule.format_meetings(obj.meetings) if obj.meetings is not None else None
+        return {"course_name": obj.course_name, "capacity": obj.capacity, "meetings": meetings}
+    return {"name": obj.name, "age": obj.age, "email": obj.get_email()}
+
+
+def to_document(objects):
+    """
+    Returns the normalized document of some objects and those they refer to.
+
+    :param objects: Students, instructors and courses, in any mix.
+    :return: A dict ready for ``json.dump``.
+    :raises TypeError: If an object is not a model object.
+    """
+    document = {"format": FORMAT, "students": {}, "instructors": {}, "courses": {}}
+    pending = list(objects)
+    while pending:
+        obj = pending.pop()
+        _, section, key, relations = _kind(obj)
+        entries = document[section]
+        if getattr(obj, key) in entries:
+            continue
+        entry = entries[getattr(obj, key)] = _fields(obj)
+        for name, target in relations.items():
+            if not is_loaded(obj, name):
+                continue
+            value = getattr(obj, name)
+            related = value if isinstance(value, list) else [] if value is None else [value]
+            # Lists built by from_dict() hold IDs rather than objects.
+            ids = [item if isinstance(item, str) else getattr(item, _KEYS[target]) for item in related]
+            entry[name] = ids if isinstance(value, list) else ids[0] if ids else None
+            seen = document[target]
+            pending.extend(item for item, ref in zip(related, ids) if ref not in seen and not isinstance(item, str))
+    return document
+
+
+def from_document(document):
+    """
+    Makes the objects of a document from :func:`to_document`.
+
+    IDs that refer to no record of the document are kept as IDs, as
+    ``from_dict`` does.
+
+    :return: A :class:`Graph`.
+    :raises ValueError: If the document is of another format.
+    """
+    if document.get("format") != FORMAT:
+        raise ValueError(f"unsupported document format {document.get('format')!r}")
+    graph = Graph(
+        {record_id: Student(entry["name"], entry["age"], entry["email"], record_id)
+         for record_id, entry in document["students"].items()},
+        {record_id: Instructor(entry["name"], entry["age"], entry["email"], record_id)
+         for record_id, entry in document["instructors"].items()},
+        {record_id: Course(record_id, entry["course_name"], capacity=entry["capacity"],
+                           meetings=schedule.parse_meetings(entry["meetings"]) if entry["meetings"] is not None else None)
+         for record_id, entry in document["courses"].items()},
+    )
+    for _, section, _, relations in _KINDS:
+        objects = getattr(graph, section)
+        for record_id, entry in document[section].items():
+            obj = objects[record_id]
+            for name, target in relations.items():
+                if name not in entry:
+                    continue
+                found = getattr(graph, target)
+                value = entry[name]
+                if isinstance(value, list):
+                    setattr(obj, name, [found.get(ref, ref) for ref in value])
+                else:
+                    setattr(obj, name, None if value is None else found.get(value, value))
+    return graph
+
+
+def dump(objects, file):
+    """Writes the document of :func:`to_document` to an open text file as JSON."""
+    json.dump(to_document(objects), file, separators=(",", ":"))
+
+
+def load(file):
+    """Reads a document written by :func:`dump`; returns a :class:`Graph`."""
+    return from_document(json.load(file))
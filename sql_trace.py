@@ -0,0 +1,492 @@
+"""
+Opt-in SQL tracing for the school management apps.
+
+Tracing is off by default. When it is enabled (``SQL_TRACE=1`` in the
+environment or :func:`enable`), connections opened through :func:`connect`
+time every statement, count the rows it touched, and register a sqlite3
+trace callback so implicit statements (``BEGIN``, ``COMMIT``, trigger bodies)
+are counted as well. Statements slower than the slow-query threshold are
+logged together with the function that issued them.
+
+Statements are grouped by *shape*: the SQL text with literals and ``IN``
+lists collapsed, so ``get_student_by_id('1')`` and ``get_student_by_id('2')``
+land in the same bucket. Wrapping a UI handler in :func:`action` counts the
+shapes it executes, which is what the N+1 report is built from.
+
+Independently of tracing, ``SQL_RECORD=<file>`` (or :func:`record`) writes
+every statement with its parameters, and every commit and rollback, to a
+workload file that ``tuning.py`` replays to pick the PRAGMA settings. Each
+database is copied next to the file when it is first opened, so the replay
+starts from the same data. Connections opened through :func:`connect` also
+get the PRAGMA profile chosen for their database, see :mod:`tuning`.
+"""
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import tuning
+
+logger = logging.getLogger("sql_trace")
+
+# Upper bounds (in milliseconds) of the latency histogram buckets.
+BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+N_PLUS_ONE_THRESHOLD = 10
+
+_enabled = os.environ.get("SQL_TRACE", "") not in ("", "0")
+_slow_ms = float(os.environ.get("SQL_SLOW_MS", "50"))
+_lock = threading.Lock()
+_stats = {}
+_trace_counts = {}
+_n_plus_one = {}
+_current = threading.local()
+_recorder = None
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+class StatementStats:
+    """
+    Aggregated timings for one statement shape.
+
+    :param shape: The normalized SQL text.
+    """
+
+    __slots__ = ("shape", "count", "total_ms", "max_ms", "rows", "buckets")
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def record(self, elapsed_ms, rows):
+        """
+        Adds one execution to the aggregate.
+
+        :param elapsed_ms: Wall-clock time spent in ``execute``.
+        :param rows: Rows modified by the statement (0 for queries).
+        """
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.rows += rows
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.count if self.count else 0.0
+
+
+def normalize(sql):
+    """
+    Reduces a statement to its shape.
+
+    String and numeric literals become ``?``, ``IN (?, ?, ...)`` becomes
+    ``IN (...)`` and runs of whitespace collapse to one space.
+
+    :param sql: The SQL text as passed to ``execute``.
+    :return: The normalized statement.
+    """
+    shape = _STRING_LITERAL.sub("?", sql)
+    shape = _NUMBER_LITERAL.sub("?", shape)
+    shape = _IN_LIST.sub("IN (...)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+def _caller():
+    """Returns ``module.function:line`` of the first frame outside this module and sqlite3."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module != __name__ and not module.startswith("sqlite3"):
+            code = frame.f_code
+            name = getattr(code, "co_qualname", code.co_name)
+            return f"{module}.{name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "<unknown>"
+
+
+def _record(sql, elapsed_ms, rows):
+    shape = normalize(sql)
+    with _lock:
+        stats = _stats.get(shape)
+        if stats is None:
+            stats = _stats[shape] = StatementStats(shape)
+        stats.record(elapsed_ms, rows)
+    counts = getattr(_current, "counts", None)
+    if counts is not None:
+        counts[shape] = counts.get(shape, 0) + 1
+    if elapsed_ms >= _slow_ms:
+        logger.warning("slow query (%.1f ms) from %s: %s", elapsed_ms, _caller(), shape)
+    return stats
+
+
+def _add_rows(stats, rows):
+    if stats is not None and rows:
+        with _lock:
+            stats.rows += rows
+
+
+def _on_trace(sql):
+    shape = normalize(sql)
+    with _lock:
+        _trace_counts[shape] = _trace_counts.get(shape, 0) + 1
+
+
+class Recorder:
+    """
+    Writes the statements run on traced connections to a workload file.
+
+    The file has one JSON object per line: ``{"database", "snapshot"}`` the
+    first time a database is opened, then ``{"c", "open"}`` for each
+    connection and ``{"c", "sql", "params"}`` (``"many"`` for
+    ``executemany``) or ``{"c", "op"}`` for ``commit``, ``rollback`` and
+    ``close``, ``c`` numbering the connections. Statements are written once
+    they return, so their order is one the database actually ran them in.
+
+    :param path: The workload file, overwritten.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._snapshots = {}
+
+    def open(self, conn, database):
+        """Numbers a new connection, copying its database on first sight."""
+        database = os.path.abspath(database)
+        with self._lock:
+            if database not in self._snapshots:
+                snapshot = f"{self.path}.{len(self._snapshots)}.db"
+                src = sqlite3.connect(database)
+                dst = sqlite3.connect(snapshot)
+                try:
+                    src.backup(dst)
+                finally:
+                    dst.close()
+                    src.close()
+                self._snapshots[database] = snapshot
+                self._write({"database": database, "snapshot": os.path.basename(snapshot)})
+            conn._recorder = self
+            conn._record_id = next(self._ids)
+            self._write({"c": conn._record_id, "open": database})
+
+    def statement(self, conn, sql, parameters, many=False):
+        with self._lock:
+            self._write({"c": conn._record_id, "sql": sql, "many" if many else "params": parameters})
+
+    def event(self, conn, op):
+        with self._lock:
+            self._write({"c": conn._record_id, "op": op})
+
+    def _write(self, entry):
+        # Connections opened before stop_recording() may outlive the file.
+        if self._file.closed:
+            return
+        # Values JSON lacks, like bytes, are written as text.
+        self._file.write(json.dumps(entry, default=str) + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class TracedCursor(sqlite3.Cursor):
+    """
+    A cursor that times each statement and counts the rows it returns.
+    """
+
+    _stats = None
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._stats = _record(sql, elapsed_ms, max(self.rowcount, 0))
+            if self.connection._recorder is not None:
+                self.connection._recorder.statement(self.connection, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if self.connection._recorder is not None:
+            seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._stats = _record(sql, elapsed_ms, max(self.rowcount, 0))
+            if self.connection._recorder is not None:
+                self.connection._recorder.statement(self.connection, sql, seq_of_parameters, many=True)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            _add_rows(self._stats, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        _add_rows(self._stats, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        _add_rows(self._stats, len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        _add_rows(self._stats, 1)
+        return row
+
+
+class TracedConnection(sqlite3.Connection):
+    """
+    A connection whose cursors are :class:`TracedCursor` instances.
+
+    ``Connection.execute`` normally bypasses the cursor class, so it is
+    routed through :meth:`cursor` here. While recording, transaction ends
+    are written to the workload too; ``with conn:`` does not go through
+    :meth:`commit`, so :meth:`__exit__` reports its own.
+    """
+
+    _recorder = None
+    _record_id = None
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        super().commit()
+        if self._recorder is not None:
+            self._recorder.event(self, "commit")
+
+    def rollback(self):
+        super().rollback()
+        if self._recorder is not None:
+            self._recorder.event(self, "rollback")
+
+    def close(self):
+        super().close()
+        if self._recorder is not None:
+            self._recorder.event(self, "close")
+            self._recorder = None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        result = super().__exit__(exc_type, exc_value, traceback)
+        if self._recorder is not None:
+            self._recorder.event(self, "commit" if exc_type is None else "rollback")
+        return result
+
+
+def connect(database, **kwargs):
+    """
+    Opens a SQLite connection, traced if tracing or recording is enabled.
+
+    The PRAGMA profile of the database, if any, is applied first (see
+    :func:`tuning.apply_profile`); it is not recorded.
+
+    :param database: Path of the database file.
+    :param kwargs: Extra keyword arguments for ``sqlite3.connect``.
+    :return: An open connection.
+    """
+    if not _enabled and _recorder is None:
+        conn = sqlite3.connect(database, **kwargs)
+        tuning.apply_profile(conn, database)
+        return conn
+    conn = sqlite3.connect(database, factory=TracedConnection, **kwargs)
+    tuning.apply_profile(conn, database)
+    if _enabled:
+        conn.set_trace_callback(_on_trace)
+    recorder = _recorder
+    if recorder is not None and database != ":memory:":
+        recorder.open(conn, database)
+    return conn
+
+
+def enable(slow_ms=None):
+    """
+    Turns tracing on for connections opened from now on.
+
+    :param slow_ms: Optional slow-query threshold in milliseconds.
+    """
+    global _enabled, _slow_ms
+    _enabled = True
+    if slow_ms is not None:
+        _slow_ms = slow_ms
+
+
+def disable():
+    """Turns tracing off for connections opened from now on."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def record(path):
+    """
+    Starts recording the workload of connections opened from now on.
+
+    :param path: The workload file, see :class:`Recorder`.
+    """
+    global _recorder
+    stop_recording()
+    _recorder = Recorder(path)
+
+
+def stop_recording():
+    """Stops recording and closes the workload file."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None:
+        recorder.close()
+
+
+def reset():
+    """Discards all collected statistics."""
+    with _lock:
+        _stats.clear()
+        _trace_counts.clear()
+        _n_plus_one.clear()
+
+
+@contextmanager
+def action(name):
+    """
+    Attributes the statements executed inside the block to a UI action.
+
+    When a statement shape runs at least :data:`N_PLUS_ONE_THRESHOLD` times
+    within a single action it is recorded for :func:`n_plus_one_report`.
+
+    :param name: Name of the action, e.g. ``"display_records"``.
+    """
+    if not _enabled or getattr(_current, "counts", None) is not None:
+        yield
+        return
+    _current.counts = counts = {}
+    try:
+        yield
+    finally:
+        _current.counts = None
+        with _lock:
+            suspects = _n_plus_one.setdefault(name, {})
+            for shape, count in counts.items():
+                if count >= N_PLUS_ONE_THRESHOLD and count > suspects.get(shape, 0):
+                    suspects[shape] = count
+
+
+def iter_action(name, rows):
+    """
+    Generator form of :func:`action` for rows read lazily.
+
+    The action covers the iteration itself, on whichever thread consumes the
+    generator, so a background loader's statements are attributed too.
+
+    :param name: Name of the action.
+    :param rows: A lazy iterable, e.g. a generator that runs the queries.
+    """
+    with action(name):
+        yield from rows
+
+
+def traced_action(func):
+    """
+    Decorator form of :func:`action` using the function name as action name.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        with action(func.__qualname__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def stats():
+    """
+    Returns the per-shape statistics, slowest total time first.
+
+    :return: A list of :class:`StatementStats`.
+    """
+    with _lock:
+        return sorted(_stats.values(), key=lambda s: s.total_ms, reverse=True)
+
+
+def trace_counts():
+    """
+    Returns how often SQLite ran each statement shape, implicit ones included.
+
+    :return: A dict mapping shape to execution count.
+    """
+    with _lock:
+        return dict(_trace_counts)
+
+
+def n_plus_one_report():
+    """
+    Formats the statement shapes repeated within single UI actions.
+
+    :return: The report as text, one action per block.
+    """
+    lines = []
+    with _lock:
+        for name, suspects in sorted(_n_plus_one.items()):
+            if not suspects:
+                continue
+            lines.append(f"{name}:")
+            for shape, count in sorted(suspects.items(), key=lambda item: item[1], reverse=True):
+                lines.append(f"  {count:6d}x  {shape}")
+    return "\n".join(lines) if lines else "No repeated statements detected."
+
+
+def report(limit=20):
+    """
+    Formats the slowest statement shapes with their latency histograms.
+
+    :param limit: Maximum number of shapes to include.
+    :return: The report as text.
+    """
+    header = "  ".join(f"<={b:g}" for b in BUCKETS_MS) + "  >"
+    lines = []
+    for s in stats()[:limit]:
+        lines.append(f"{s.count:7d} calls  {s.total_ms:10.2f} ms total  {s.mean_ms:8.3f} ms avg  "
+                     f"{s.max_ms:8.2f} ms max  {s.rows:8d} rows  {s.shape}")
+        lines.append(f"        {header}")
+        lines.append("        " + "  ".join(str(n) for n in s.buckets))
+    return "\n".join(lines)
+
+
+if os.environ.get("SQL_RECORD"):
+    record(os.environ["SQL_RECORD"])
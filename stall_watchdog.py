@@ -0,0 +1,213 @@
+"""
+Event-loop stall watchdog for the Tk and PyQt front-ends.
+
+A heartbeat scheduled on the GUI event loop (``after()`` for Tk, a
+``QTimer`` for Qt) records when the loop last got to run. A background thread
+checks the heartbeat; when the loop has not run for longer than the
+threshold, the main thread's stack is captured and a stall report naming the
+handler that is blocking the loop is written.
+
+Enable it with ``SCHOOL_STALL_REPORT=<path>``; ``SCHOOL_STALL_MS`` sets the
+threshold (default 500 ms). Reports are appended to the file as JSON lines
+and logged through the ``stall_watchdog`` logger.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+logger = logging.getLogger("stall_watchdog")
+
+# Frames from these modules are never reported as the stalled handler.
+LIBRARY_MODULES = ("tkinter", "PyQt5", "threading", "runpy", "importlib",
+                   "sqlite3", "sql_trace", "metrics", "stall_watchdog")
+# Modules whose frames dispatch event-loop callbacks into the application.
+TOOLKIT_MODULES = ("tkinter", "PyQt5")
+
+
+def _is_library(frame):
+    module = frame.f_globals.get("__name__", "")
+    return module.split(".")[0] in LIBRARY_MODULES or frame.f_code.co_name == "<module>"
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return getattr(code, "co_qualname", code.co_name)
+
+
+def describe_stack(frame):
+    """
+    Finds the handler responsible for a stall in a captured stack.
+
+    :param frame: The innermost frame of the main thread.
+    :return: A tuple ``(handler, innermost)``: the first application frame
+             below the innermost toolkit frame, i.e. the callback the event
+             loop dispatched rather than the ``main()`` that started the loop,
+             and the innermost application frame, i.e. where it is currently
+             spending time.
+    """
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    dispatched = 0
+    for i, f in enumerate(frames):
+        if f.f_globals.get("__name__", "").split(".")[0] in TOOLKIT_MODULES:
+            dispatched = i + 1
+    # PyQt calls slots straight from C++, so there may be no toolkit frame at all.
+    app_frames = ([f for f in frames[dispatched:] if not _is_library(f)]
+                  or [f for f in frames if not _is_library(f)])
+    if not app_frames:
+        return None, None
+    return _frame_name(app_frames[0]), _frame_name(app_frames[-1])
+
+
+class Watchdog:
+    """
+    Detects stalls of an event loop driven by :meth:`beat`.
+
+    Subclasses schedule :meth:`beat` on their toolkit's event loop.
+
+    :param threshold: Seconds without a heartbeat before a stall is reported.
+    :param interval: Seconds between heartbeats and between checks.
+    :param report_path: File the stall reports are appended to, or None.
+    """
+
+    def __init__(self, threshold=0.5, interval=0.1, report_path=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.report_path = report_path
+        self.reports = []
+        self.max_lag = 0.0
+        self._main_ident = threading.main_thread().ident
+        self._last_beat = time.monotonic()
+        self._expected = self._last_beat + interval
+        self._stall = None
+        self._stall_started = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def beat(self):
+        """
+        Records that the event loop ran; called from the GUI thread.
+        """
+        now = time.monotonic()
+        lag = max(now - self._expected, 0.0)
+        self.max_lag = max(self.max_lag, lag)
+        metrics.observe("school_event_loop_lag_seconds", lag)
+        with self._lock:
+            stall, self._stall = self._stall, None
+            self._last_beat = now
+            self._expected = now + self.interval
+        if stall is not None:
+            stall["duration_ms"] = round((now - self._stall_started) * 1000, 1)
+            logger.warning("event loop stalled for %.0f ms in %s (%s)",
+                           stall["duration_ms"], stall["handler"], stall["innermost"])
+            self._write({"id": stall["id"], "handler": stall["handler"], "duration_ms": stall["duration_ms"]})
+
+    def start(self):
+        """
+        Starts the checker thread and the heartbeat.
+        """
+        threading.Thread(target=self._run, name="stall-watchdog", daemon=True).start()
+        self._schedule()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _schedule(self):
+        raise NotImplementedError
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                if self._stall is not None:
+                    continue
+                stalled_for = time.monotonic() - self._last_beat
+                if stalled_for < self.threshold:
+                    continue
+                self._stall_started = self._last_beat
+                stall = self._stall = self._capture(stalled_for)
+            if stall is not None:
+                self._write(stall)
+
+    def _capture(self, stalled_for):
+        frame = sys._current_frames().get(self._main_ident)
+        if frame is None:
+            return None
+        handler, innermost = describe_stack(frame)
+        report = {
+            "id": len(self.reports) + 1,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "handler": handler,
+            "innermost": innermost,
+            "detected_after_ms": round(stalled_for * 1000, 1),
+            "stack": traceback.format_stack(frame),
+        }
+        self.reports.append(report)
+        return report
+
+    def _write(self, report):
+        if not self.report_path:
+            return
+        with open(self.report_path, "a") as file:
+            file.write(json.dumps(report) + "\n")
+
+
+class TkWatchdog(Watchdog):
+    """
+    Watchdog whose heartbeat runs on a Tk mainloop via ``after()``.
+
+    :param root: The Tk root window.
+    """
+
+    def __init__(self, root, **kwargs):
+        super().__init__(**kwargs)
+        self.root = root
+
+    def _schedule(self):
+        self.root.after(int(self.interval * 1000), self._tick)
+
+    def _tick(self):
+        self.beat()
+        if not self._stop.is_set():
+            self._schedule()
+
+
+class QtWatchdog(Watchdog):
+    """
+    Watchdog whose heartbeat is a ``QTimer`` on the Qt event loop.
+    """
+
+    def _schedule(self):
+        from PyQt5.QtCore import QTimer
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.beat)
+        self.timer.start(int(self.interval * 1000))
+
+    def stop(self):
+        super().stop()
+        self.timer.stop()
+
+
+def from_env(watchdog_class, *args):
+    """
+    Starts a watchdog if ``SCHOOL_STALL_REPORT`` is set.
+
+    :param watchdog_class: :class:`TkWatchdog` or :class:`QtWatchdog`.
+    :param args: Positional arguments for the class, e.g. the Tk root.
+    :return: The running watchdog, or None when disabled.
+    """
+    path = os.environ.get("SCHOOL_STALL_REPORT")
+    if not path:
+        return None
+    threshold = float(os.environ.get("SCHOOL_STALL_MS", "500")) / 1000
+    return watchdog_class(*args, threshold=threshold, report_path=path).start()
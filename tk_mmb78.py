@@ -1,21 +1,66 @@
 import tkinter as tk
-from tkinter import messagebox, simpledialog
+from tkinter import messagebox
 from tkinter import ttk
-import json
-from lab2_mmb78 import Student, Instructor, Course
-from db_mmb78 import *
+import os
+import backup
+import change_feed
+import db_mmb78
+import metrics
+import registration
+import repository
+import schedule
+import sql_trace
+import stall_watchdog
+import versions
+import write_behind
+from progressive import BackgroundLoader, StartupTimer
+from sql_trace import traced_action
+from lab2_mmb78 import Student, Instructor
 
 # Sample data storage
 courses = []
 students = []
 instructors = []
 
-create_tables()
-root = tk.Tk()
-root.title("School Management System")
-root.geometry("1300x700")
+# Storage backend, opened in main() from SCHOOL_BACKEND (SQLite by default)
+repo = None
 
+# Change feed of the database, set once the initial records are shown
+feed = None
 
+# Write-behind buffer of submitted students, if SCHOOL_WRITE_BEHIND is set
+writes = None
+
+RECORD_TYPES = {"students": "Student", "instructors": "Instructor", "courses": "Course"}
+KINDS = {record_type: kind for kind, record_type in RECORD_TYPES.items()}
+
+# Dropdown label of each record by table and ID, to patch single menu entries
+dropdown_labels = {"students": {}, "instructors": {}, "courses": {}}
+
+# Instructor ID and enrolled student IDs shown in each course row
+course_members = {}
+
+
+def sqlite_backend():
+    """
+    Returns True if the records are in the SQLite database of db_mmb78.
+
+    Course meetings, seats and waitlists, sessions, the fuzzy name index and
+    the change feed are kept in that database, so they are only used then.
+    """
+    return isinstance(repo, repository.SqliteRepository)
+
+
+def find_by_name(kind, name):
+    """
+    Returns the first record of a kind with exactly this name, or None.
+    """
+    position = repository.FIELDS[kind].index(repository.NAME_FIELD[kind])
+    return next((row for row in repo.search(kind, name) if row[position] == name), None)
+
+
+
+@traced_action
 def submit_student():
     """
     Handles the submission of a student entry.
@@ -33,12 +78,20 @@ def submit_student():
         return
 
     new_student = Student(name=name, age=int(age), email=email, student_id=student_id)
-    add_student(new_student)
+    row = (student_id, new_student.name, new_student.age, new_student.get_email())
+    try:
+        if writes is not None:
+            # Committed with others by flush_writes(); shown and counted then
+            writes.submit("add", "students", row)
+        else:
+            repo.add("students", row)
+            metrics.inc('school_crud_operations_total', entity='student', op='create')
+    except repository.IntegrityError as e:
+        messagebox.showerror("Input Error", str(e))
+        return
     #students.append(new_student)
-    update_dropdowns()
-    
     messagebox.showinfo("Submission Successful", f"Student {name} has been added!")
-    display_records()
+    refresh_records()
 
     entry_student_name.delete(0, tk.END)
     entry_student_age.delete(0, tk.END)
@@ -46,6 +99,7 @@ def submit_student():
     entry_student_id.delete(0, tk.END)
 
 
+@traced_action
 def submit_instructor():
     """
     Handles the submission of an instructor entry.
@@ -64,11 +118,14 @@ def submit_instructor():
 
     new_instructor = Instructor(name=name, age=int(age), email=email, instructor_id=instructor_id)
     #instructors.append(new_instructor)
-    add_instructor(new_instructor)
-    update_dropdowns()
-    
+    try:
+        repo.add("instructors", (instructor_id, new_instructor.name, new_instructor.age, new_instructor.get_email()))
+    except repository.IntegrityError as e:
+        messagebox.showerror("Input Error", str(e))
+        return
+    metrics.inc('school_crud_operations_total', entity='instructor', op='create')
     messagebox.showinfo("Submission Successful", f"Instructor {name} has been added!")
-    display_records()
+    refresh_records()
 
     entry_instructor_name.delete(0, tk.END)
     entry_instructor_age.delete(0, tk.END)
@@ -76,6 +133,7 @@ def submit_instructor():
     entry_instructor_id.delete(0, tk.END)
 
 
+@traced_action
 def submit_course():
     """
     Handles the submission of a course entry.
@@ -91,24 +149,36 @@ def submit_course():
         messagebox.showerror("Input Error", "All fields must be filled out")
         return
 
-    selected_instructor = get_instructor_by_name(instructor_name)
+    try:
+        meetings = schedule.parse_meetings(entry_course_meetings.get())
+    except ValueError as e:
+        messagebox.showerror("Input Error", str(e))
+        return
+
+    selected_instructor = find_by_name("instructors", instructor_name)
 
     if not selected_instructor:
         messagebox.showerror("Input Error", "Instructor not found in the database")
         return
 
-    new_course = Course(course_id=course_id, course_name=course_name, instructor=selected_instructor)
-    
-    add_course(new_course)
+    try:
+        repo.add("courses", (course_id, course_name, selected_instructor[0]))
+    except repository.IntegrityError as e:
+        messagebox.showerror("Input Error", str(e))
+        return
+    metrics.inc('school_crud_operations_total', entity='course', op='create')
+    if meetings:
+        # The field is only shown with the SQLite backend
+        db_mmb78.set_course_meetings(course_id, meetings)
 
-    update_dropdowns()
     messagebox.showinfo("Submission Successful", f"Course '{course_name}' has been added!")
 
     entry_course_id.delete(0, tk.END)
     entry_course_name.delete(0, tk.END)
     entry_course_instructor.delete(0, tk.END)
+    entry_course_meetings.delete(0, tk.END)
 
-    display_records()
+    refresh_records()
 
 
 def update_dropdowns():
@@ -118,39 +188,76 @@ def update_dropdowns():
     This function fetches the latest data from the database and updates the
     dropdown menus in the UI.
     """
-    courses = get_all_courses()
-    students = get_all_students()
-    instructors = get_all_instructors()
+    # Repository rows: (id, name, ...)
+    courses = repo.list("courses")
+    students = repo.list("students")
+    instructors = repo.list("instructors")
 
     course_menu = course_dropdown["menu"]
     course_menu.delete(0, "end")
     course_assign_menu = course_dropdown_assign["menu"]
     course_assign_menu.delete(0, "end")
-    for course in courses:
-        course_menu.add_command(label=course.course_name, command=lambda value=course.course_name: course_var.set(value))
-        course_assign_menu.add_command(label=course.course_name, command=lambda value=course.course_name: course_var.set(value))
+    dropdown_labels["courses"] = {}
+    for course_id, course_name, _ in courses:
+        course_menu.add_command(label=course_name, command=lambda value=course_name: course_var.set(value))
+        course_assign_menu.add_command(label=course_name, command=lambda value=course_name: course_var.set(value))
+        dropdown_labels["courses"][course_id] = course_name
 
     student_menu = student_dropdown["menu"]
     student_menu.delete(0, "end")
-    for student in students:
-        student_menu.add_command(label=student.name, command=lambda value=student.name: student_var.set(value))
+    dropdown_labels["students"] = {}
+    for student_id, name, *_ in students:
+        student_menu.add_command(label=name, command=lambda value=name: student_var.set(value))
+        dropdown_labels["students"][student_id] = name
 
     instructor_menu = instructor_dropdown["menu"]
     instructor_menu.delete(0, "end")
-    for instructor in instructors:
-        instructor_menu.add_command(label=instructor.name, command=lambda value=instructor.name: instructor_var.set(value))
-
-
-
+    dropdown_labels["instructors"] = {}
+    for instructor_id, name, *_ in instructors:
+        instructor_menu.add_command(label=name, command=lambda value=name: instructor_var.set(value))
+        dropdown_labels["instructors"][instructor_id] = name
 
 
+def update_dropdown_entry(table, record_id, label):
+    """
+    Renames, adds or (with ``label`` None) removes the dropdown entry of one record.
+    """
+    if table == "students":
+        menus, var = [student_dropdown["menu"]], student_var
+    elif table == "instructors":
+        menus, var = [instructor_dropdown["menu"]], instructor_var
+    else:
+        menus, var = [course_dropdown["menu"], course_dropdown_assign["menu"]], course_var
+
+    old = dropdown_labels[table].pop(record_id, None)
+    for menu in menus:
+        index = None
+        last = menu.index("end")
+        if old is not None and last is not None:
+            index = next((i for i in range(last + 1) if menu.entrycget(i, "label") == old), None)
+        if label is None:
+            if index is not None:
+                menu.delete(index)
+        elif index is not None:
+            menu.entryconfigure(index, label=label, command=lambda value=label: var.set(value))
+        else:
+            menu.add_command(label=label, command=lambda value=label: var.set(value))
+    if label is not None:
+        dropdown_labels[table][record_id] = label
+
+
+
+
+
+@traced_action
 def register_student():
     """
     Registers a student to a selected course.
 
     This function allows a student to be registered for a course by selecting
     both the student and the course from dropdowns. The registration is stored
-    in the database.
+    in the database. With the SQLite backend the student is waitlisted if
+    the course is full, and refused if it overlaps their schedule.
     """
     student_name = student_var.get()
     course_name = course_var.get()
@@ -159,24 +266,43 @@ def register_student():
         messagebox.showerror("Input Error", "Please select both student and course")
         return
 
-    selected_student = next((s for s in get_all_students() if s.name == student_name), None)
-    selected_course = next((c for c in get_all_courses() if c.course_name == course_name), None)
+    selected_student = find_by_name("students", student_name)
+    selected_course = find_by_name("courses", course_name)
 
     if not selected_student or not selected_course:
         messagebox.showerror("Error", "Invalid student or course selection")
         return
 
-    enroll_student(selected_student.student_id, selected_course.course_id)
+    if sqlite_backend():
+        try:
+            result = db_mmb78.enroll_student(selected_student[0], selected_course[0])
+        except schedule.ScheduleConflict as e:
+            clashes = "\n".join(f"{schedule.format_meetings([theirs])} ({course_id}) overlaps {schedule.format_meetings([ours])}"
+                                 for course_id, theirs, ours in e.clashes)
+            messagebox.showerror("Schedule Conflict", f"{course_name} conflicts with the schedule of {student_name}:\n{clashes}")
+            return
+    else:
+        try:
+            repo.enroll(selected_student[0], selected_course[0])
+        except repository.IntegrityError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        metrics.inc('school_crud_operations_total', entity='enrollment', op='create')
+        result = registration.Registration(registration.ENROLLED, None)
     
-    messagebox.showinfo("Registration Successful", f"Student {student_name} has been registered for {course_name}")
+    if result.status == registration.ENROLLED:
+        messagebox.showinfo("Registration Successful", f"Student {student_name} has been registered for {course_name}")
+    else:
+        messagebox.showinfo("Course Full", f"{course_name} is full; {student_name} is number {result.position} on the waitlist")
 
     student_var.set('')
     course_var.set('')
 
-    display_records()  
+    refresh_records()
 
 
 
+@traced_action
 def assign_instructor():
     """
     Assigns an instructor to a selected course.
@@ -192,24 +318,53 @@ def assign_instructor():
         messagebox.showerror("Input Error", "Please select both instructor and course")
         return
 
-    selected_instructor = next((i for i in get_all_instructors() if i.name == instructor_name), None)
-    selected_course = next((c for c in get_all_courses() if c.course_name == course_name), None)
+    selected_instructor = find_by_name("instructors", instructor_name)
+    selected_course = find_by_name("courses", course_name)
 
     if not selected_instructor or not selected_course:
         messagebox.showerror("Error", "Invalid instructor or course selection")
         return
 
-    selected_course.instructor = selected_instructor  
-    update_course(selected_course)  
+    if sqlite_backend():
+        # Only the course's instructor is written, in one transaction
+        edits = db_mmb78.session()
+        instructor = edits.get_instructor(selected_instructor[0])
+        course = edits.get_course(selected_course[0])
+        if instructor is None or course is None:
+            deleted = selected_course[0] if course is None else selected_instructor[0]
+            messagebox.showerror("Edit Conflict", f"{deleted} was deleted by someone else.")
+            refresh_records()
+            return
+        instructor.assign_course(course)
+        try:
+            edits.commit()
+        except versions.StaleRecordError as e:
+            # The course changed since it was read; nothing was written
+            metrics.inc('school_edit_conflicts_total', kind=e.kind)
+            state = "deleted" if e.current is None else "changed"
+            messagebox.showerror("Edit Conflict", f"{e.record_id} was {state} by someone else.")
+            refresh_records()
+            return
+        except (registration.CourseFull, schedule.ScheduleConflict) as e:
+            messagebox.showerror("Error", str(e))
+            refresh_records()
+            return
+    elif not repo.update("courses", selected_course[:2] + (selected_instructor[0],)):
+        messagebox.showerror("Edit Conflict", f"{selected_course[0]} was deleted by someone else.")
+        refresh_records()
+        return
+    else:
+        metrics.inc('school_crud_operations_total', entity='course', op='update')
 
     messagebox.showinfo("Assignment Successful", f"Instructor {instructor_name} has been assigned to {course_name}")
 
     instructor_var.set('')
     course_var.set('')
 
-    display_records() 
+    refresh_records()
 
 
+@traced_action
 def edit_record():
     """
     Handles the editing of a selected record.
@@ -225,11 +380,27 @@ def edit_record():
     values = tree.item(selected_item, "values")
     record_type, record_id, record_name = values[0], values[1], values[2]
 
+    # Versions are read before the records and checked when saving, so an
+    # edit made by someone else meanwhile is not overwritten unseen
+    if record_type == "Course" and sqlite_backend():
+        # Written by the session's commit(): only the changed columns and meetings
+        edits = db_mmb78.session()
+        record = edits.get_course(record_id)
+    else:
+        version = repo.version(KINDS[record_type], record_id)
+        record = repo.get(KINDS[record_type], record_id)
+    if record is None:
+        # Another instance deleted it since the table was shown
+        messagebox.showerror("Edit Conflict", f"{record_id} was deleted by someone else.")
+        refresh_records()
+        return
+
     popup = tk.Toplevel(root)
     popup.title(f"Edit {record_type} {record_name}")
 
     if record_type == "Student":
-        student = get_student_by_id(record_id)
+        student_id, name, age, email = record
+        student = Student(name=name, age=age, email=email, student_id=student_id)
 
         tk.Label(popup, text="Name").pack()
         name_entry = tk.Entry(popup)
@@ -247,19 +418,33 @@ def edit_record():
         email_entry.insert(0, student.get_email())
 
         def save_changes():
+            nonlocal version
             student.name = name_entry.get()
             student.age = int(age_entry.get())
             student.set_email(email_entry.get())
 
-            update_student(student)
+            mine = (student.student_id, student.name, student.age, student.get_email())
+            try:
+                repo.update('students', mine, version)
+            except versions.StaleRecordError as e:
+                choice = resolve_conflict(popup, e, mine, ("ID", "Name", "Age", "Email"))
+                if choice is not None:
+                    version = e.version
+                if choice:
+                    save_changes()
+                elif choice is False:
+                    fill_entries((name_entry, age_entry, email_entry), e.current[1:])
+                return
+            metrics.inc('school_crud_operations_total', entity='student', op='update')
 
-            display_records()
+            refresh_records()
             popup.destroy()
 
         tk.Button(popup, text="Save", command=save_changes).pack()
 
     elif record_type == "Instructor":
-        instructor = get_instructor_by_id(record_id)
+        instructor_id, name, age, email = record
+        instructor = Instructor(name=name, age=age, email=email, instructor_id=instructor_id)
 
         tk.Label(popup, text="Name").pack()
         name_entry = tk.Entry(popup)
@@ -277,19 +462,35 @@ def edit_record():
         email_entry.insert(0, instructor.get_email())
 
         def save_changes():
+            nonlocal version
             instructor.name = name_entry.get()
             instructor.age = int(age_entry.get())
             instructor.set_email(email_entry.get())
 
-            update_instructor(instructor)
+            mine = (instructor.instructor_id, instructor.name, instructor.age, instructor.get_email())
+            try:
+                repo.update('instructors', mine, version)
+            except versions.StaleRecordError as e:
+                choice = resolve_conflict(popup, e, mine, ("ID", "Name", "Age", "Email"))
+                if choice is not None:
+                    version = e.version
+                if choice:
+                    save_changes()
+                elif choice is False:
+                    fill_entries((name_entry, age_entry, email_entry), e.current[1:])
+                return
+            metrics.inc('school_crud_operations_total', entity='instructor', op='update')
 
-            display_records()
+            refresh_records()
             popup.destroy()
 
         tk.Button(popup, text="Save", command=save_changes).pack()
 
+    elif record_type == "Course" and not sqlite_backend():
+        edit_course_row(popup, record, version)
+
     elif record_type == "Course":
-        course = get_course_by_id(record_id)
+        course = record
 
         tk.Label(popup, text="Course Name").pack()
         course_name_entry = tk.Entry(popup)
@@ -299,25 +500,134 @@ def edit_record():
         tk.Label(popup, text="Instructor").pack()
         instructor_name_entry = tk.Entry(popup)
         instructor_name_entry.pack()
-        instructor_name_entry.insert(0, course.instructor.name)
+        instructor_name_entry.insert(0, course.instructor.name if course.instructor else "")
+
+        tk.Label(popup, text="Meetings").pack()
+        meetings_entry = tk.Entry(popup)
+        meetings_entry.pack()
+        meetings_entry.insert(0, schedule.format_meetings(course.meetings))
 
         def save_changes():
+            try:
+                course.meetings = schedule.parse_meetings(meetings_entry.get())
+            except ValueError as e:
+                messagebox.showerror("Input Error", str(e))
+                return
             course.course_name = course_name_entry.get()
-            selected_instructor = get_instructor_by_name(instructor_name_entry.get())  
+            selected_instructor = find_by_name("instructors", instructor_name_entry.get())
             if selected_instructor:
-                course.instructor = selected_instructor
-
-                update_course(course)
+                course.instructor = edits.get_instructor(selected_instructor[0])
+
+                try:
+                    edits.commit()
+                except versions.StaleRecordError as e:
+                    mine = (course.course_id, course.course_name,
+                            course.instructor.instructor_id if course.instructor else None)
+                    choice = resolve_conflict(popup, e, mine, ("ID", "Course Name", "Instructor ID"))
+                    if choice:
+                        edits.overwrite(course)
+                        save_changes()
+                    elif choice is False and edits.refresh(course):
+                        fill_entries((course_name_entry, instructor_name_entry, meetings_entry),
+                                     (course.course_name, course.instructor.name if course.instructor else "",
+                                      schedule.format_meetings(course.meetings)))
+                    return
             else:
                 messagebox.showerror("Error", "Instructor not found")
                 return
 
-            display_records()
+            refresh_records()
             popup.destroy()
 
         tk.Button(popup, text="Save", command=save_changes).pack()
 
 
+def edit_course_row(popup, course, version):
+    """
+    Fills the edit window of a course kept outside the SQLite database.
+
+    Only the name and instructor are edited; meetings are SQLite-only.
+
+    :param course: The ``(course_id, course_name, instructor_id)`` row.
+    :param version: Its version, checked when saving.
+    """
+    course_id, course_name, instructor_id = course
+    instructor = repo.get('instructors', instructor_id) if instructor_id is not None else None
+
+    tk.Label(popup, text="Course Name").pack()
+    course_name_entry = tk.Entry(popup)
+    course_name_entry.pack()
+    course_name_entry.insert(0, course_name)
+
+    tk.Label(popup, text="Instructor").pack()
+    instructor_name_entry = tk.Entry(popup)
+    instructor_name_entry.pack()
+    instructor_name_entry.insert(0, instructor[1] if instructor else "")
+
+    def save_changes():
+        nonlocal version
+        selected_instructor = find_by_name("instructors", instructor_name_entry.get())
+        if not selected_instructor:
+            messagebox.showerror("Error", "Instructor not found")
+            return
+        mine = (course_id, course_name_entry.get(), selected_instructor[0])
+        try:
+            repo.update('courses', mine, version)
+        except versions.StaleRecordError as e:
+            choice = resolve_conflict(popup, e, mine, ("ID", "Course Name", "Instructor ID"))
+            if choice is not None:
+                version = e.version
+            if choice:
+                save_changes()
+            elif choice is False:
+                theirs = repo.get('instructors', e.current[2]) if e.current[2] is not None else None
+                fill_entries((course_name_entry, instructor_name_entry),
+                             (e.current[1], theirs[1] if theirs else ""))
+            return
+        metrics.inc('school_crud_operations_total', entity='course', op='update')
+
+        refresh_records()
+        popup.destroy()
+
+    tk.Button(popup, text="Save", command=save_changes).pack()
+
+
+def resolve_conflict(popup, error, mine, labels):
+    """
+    Asks what to do with an edit refused because someone else changed the record.
+
+    Both versions are shown field by field. A record deleted meanwhile is
+    only reported, and its edit window closed.
+
+    :param popup: The edit window.
+    :param error: The versions.StaleRecordError of the refused update.
+    :param mine: The record as edited, in the column order of its table.
+    :param labels: Labels of the columns.
+    :return: True to overwrite their change, False to load it into the
+             form, None to keep editing.
+    """
+    metrics.inc('school_edit_conflicts_total', kind=error.kind)
+    if error.current is None:
+        messagebox.showerror("Edit Conflict", f"{error.record_id} was deleted by someone else.", parent=popup)
+        popup.destroy()
+        return None
+    fields = "\n".join(f"{label}: {theirs}" + (f"  (yours: {value})" if value != theirs else "")
+                       for label, value, theirs in zip(labels, mine, error.current))
+    return messagebox.askyesnocancel(
+        "Edit Conflict",
+        f"Someone else changed this record since you opened it:\n\n{fields}\n\n"
+        "Yes: overwrite their change with yours\nNo: load their change into the form\nCancel: keep editing",
+        parent=popup)
+
+
+def fill_entries(entries, values):
+    """Replaces the text of each entry with the matching value."""
+    for entry, value in zip(entries, values):
+        entry.delete(0, tk.END)
+        entry.insert(0, value)
+
+
+@traced_action
 def delete_record():
     """
     Deletes a selected record from the system.
@@ -336,14 +646,11 @@ def delete_record():
     if not confirm:
         return
 
-    if record_type == "Student":
-        delete_student(record_id)
-    elif record_type == "Instructor":
-        delete_instructor(record_id)
-    elif record_type == "Course":
-        delete_course(record_id)
+    entity = record_type.lower()
+    repo.delete(KINDS[record_type], record_id)
+    metrics.inc('school_crud_operations_total', entity=entity, op='delete')
 
-    display_records()
+    refresh_records()
 
 def save_data():
     """
@@ -364,33 +671,284 @@ def load_data():
     messagebox.showinfo("OOPS", "this button is useless now")
 
     
+@traced_action
+@metrics.timed('school_ui_refresh_seconds', view='search_records')
 def search_records():
     """
     Searches for records based on the query.
 
     This function performs a search on students, instructors, and courses based on the input in the search field.
+    With "Fuzzy" checked, misspelled names are found too and the best matches are listed first.
     """
     query = search_entry.get().lower()
 
     for item in tree.get_children():
         tree.delete(item)
 
-    students = get_all_students()
-    for student in students:
-        if query in student.name.lower():
-            tree.insert("", "end", values=("Student", student.student_id, student.name, student.age, student.get_email()))
+    if fuzzy_var.get() and sqlite_backend():
+        for record in db_mmb78.fuzzy_search(query):
+            if isinstance(record, Student):
+                insert_row(("Student", record.student_id, record.name, record.age, record.get_email()))
+            elif isinstance(record, Instructor):
+                insert_row(("Instructor", record.instructor_id, record.name, record.age, record.get_email()))
+            else:
+                # Loaded for all matched courses in one query
+                insert_row(course_row(record, record.enrolled_students))
+        return
+
+    if fuzzy_var.get():
+        # Ranked per kind by the repository's own name index
+        names = {}
+        for kind, record_type in RECORD_TYPES.items():
+            for row in repo.fuzzy_search(kind, query):
+                if kind != "courses":
+                    insert_row((record_type,) + tuple(row))
+                    continue
+                if not names:
+                    names = {kind: {record[0]: record[1] for record in repo.list(kind)}
+                             for kind in ("students", "instructors")}
+                insert_row(stored_course_row(row, names["instructors"], names["students"],
+                                             repo.enrolled_students(row[0])))
+        return
+
+    for values in record_rows():
+        if query in values[2].lower():
+            insert_row(values)
+
+
+def record_rows():
+    """
+    Yields the TreeView rows for all students, instructors and courses.
+
+    Every db_mmb78 call opens its own connection, so with the SQLite backend
+    this can also run on the background loader thread during progressive
+    startup, so it only builds rows; course_members is filled as they are
+    inserted. The records are streamed from the database rather than read
+    into lists first. Other backends are read through the repository.
+    """
+    if not sqlite_backend():
+        yield from stored_rows(repo)
+        return
+
+    for student in db_mmb78.iter_students():
+        yield ("Student", student.student_id, student.name, student.age, student.get_email())
+
+    for instructor in db_mmb78.iter_instructors():
+        yield ("Instructor", instructor.instructor_id, instructor.name, instructor.age, instructor.get_email())
+
+    for course in db_mmb78.iter_courses():
+        # Loaded for a batch of courses at a time
+        yield course_row(course, course.enrolled_students)
 
-    instructors = get_all_instructors()
+
+def course_row(course, enrolled_students):
+    """
+    Builds the TreeView row of a course, followed by the instructor ID and
+    enrolled student IDs whose names it shows (see row_values).
+
+    Another instance may have deleted the instructor or an enrolled student,
+    so either can be missing.
+    """
+    enrolled_students = [student for student in enrolled_students if student is not None]
+    enrolled_students_names = ", ".join([student.name for student in enrolled_students])
+
+    return (
+        "Course", 
+        course.course_id, 
+        course.course_name, 
+        course.instructor.name if course.instructor else "", 
+        enrolled_students_names if enrolled_students else "No students enrolled",
+        (course.instructor.instructor_id if course.instructor else None,
+         {student.student_id for student in enrolled_students}),
+    )
+
+
+def stored_rows(source):
+    """
+    Yields the TreeView rows for all records of a repository.
+    """
+    students = source.list("students")
+    instructors = source.list("instructors")
+    for student in students:
+        yield ("Student",) + tuple(student)
     for instructor in instructors:
-        if query in instructor.name.lower():
-            tree.insert("", "end", values=("Instructor", instructor.instructor_id, instructor.name, instructor.age, instructor.get_email()))
+        yield ("Instructor",) + tuple(instructor)
+
+    student_names = {student[0]: student[1] for student in students}
+    instructor_names = {instructor[0]: instructor[1] for instructor in instructors}
+    enrolled = {}
+    for student_id, course_id in source.enrollments():
+        enrolled.setdefault(course_id, []).append(student_id)
+    for course in source.list("courses"):
+        yield stored_course_row(course, instructor_names, student_names, enrolled.get(course[0], ()))
+
+
+def stored_course_row(course, instructor_names, student_names, student_ids):
+    """
+    Builds the TreeView row of a course read from a repository, like course_row.
+
+    :param course: The ``(course_id, course_name, instructor_id)`` row.
+    :param instructor_names: Instructor names by ID.
+    :param student_names: Student names by ID.
+    :param student_ids: IDs of the enrolled students.
+    """
+    course_id, course_name, instructor_id = course
+    student_ids = [student_id for student_id in student_ids if student_id in student_names]
+    enrolled_students_names = ", ".join(student_names[student_id] for student_id in student_ids)
+
+    return (
+        "Course",
+        course_id,
+        course_name,
+        instructor_names.get(instructor_id, ""),
+        enrolled_students_names if student_ids else "No students enrolled",
+        (instructor_id if instructor_id in instructor_names else None, set(student_ids)),
+    )
+
+
+def row_values(values):
+    """
+    Returns the TreeView values of a row, remembering in course_members whose
+    names a course row shows. Only called on the main thread.
+    """
+    if values[0] == "Course":
+        course_members[values[1]] = values[5]
+        return values[:5]
+    return values
+
+
+def insert_row(values):
+    """
+    Appends a row to the TreeView, identified by its record type and ID.
+    """
+    tree.insert("", "end", iid=f"{values[0]}:{values[1]}", values=row_values(values))
+
+
+def upsert_row(values, searching):
+    """
+    Updates a TreeView row in place, or appends it unless a search is shown.
+    """
+    iid = f"{values[0]}:{values[1]}"
+    if tree.exists(iid):
+        tree.item(iid, values=row_values(values))
+    elif not searching:
+        tree.insert("", "end", iid=iid, values=row_values(values))
 
-    courses = get_all_courses()
-    for course in courses:
-        if query in course.course_name.lower():
-            tree.insert("", "end", values=("Course", course.course_id, course.course_name, course.instructor.name, ", ".join([s.name for s in course.enrolled_students])))
 
+def apply_changes(changes):
+    """
+    Patches the TreeView and the dropdowns with the rows reported by the change feed.
 
+    Only the changed rows and their dropdown entries are touched. Course rows
+    show instructor and student names, so the rows of the courses involved in
+    a changed enrollment, or showing an updated or deleted instructor or
+    student, are rebuilt as well. While search results are shown, new rows
+    are not added.
+
+    :param changes: List of change_feed.Change from one poll.
+    """
+    if isinstance(repo, repository.ReplicaRepository):
+        # The dropdowns and edit windows read the replica
+        repo.sync()
+    if any(change.op == "reset" for change in changes):
+        display_records()
+        return
+
+    searching = bool(search_entry.get())
+    course_ids = set()
+    for change in changes:
+        if change.table == "enrollments":
+            course_ids.add(change.key[1])
+            continue
+
+        record_id = change.key[0]
+        update_dropdown_entry(change.table, record_id, None if change.op == "delete" else change.row[1])
+        if change.table == "courses":
+            course_ids.add(record_id)
+            continue
+
+        if change.op == "delete":
+            iid = f"{RECORD_TYPES[change.table]}:{record_id}"
+            if tree.exists(iid):
+                tree.delete(iid)
+        else:
+            upsert_row((RECORD_TYPES[change.table],) + tuple(change.row), searching)
+        if change.op != "insert":
+            course_ids.update(courses_showing(change.table, record_id))
+
+    for course_id in course_ids:
+        course = db_mmb78.get_course_by_id(course_id)
+        if course is None:
+            course_members.pop(course_id, None)
+            if tree.exists(f"Course:{course_id}"):
+                tree.delete(f"Course:{course_id}")
+        else:
+            upsert_row(course_row(course, course.enrolled_students), searching)
+
+
+def courses_showing(table, record_id):
+    """
+    Returns the IDs of the course rows showing a student's or instructor's name.
+    """
+    if table == "students":
+        return [course_id for course_id, (_, student_ids) in course_members.items() if record_id in student_ids]
+    return [course_id for course_id, (instructor_id, _) in course_members.items() if instructor_id == record_id]
+
+
+def refresh_records():
+    """
+    Shows the effect of a change made in this window.
+
+    With a change feed running this applies just the changed rows; without one
+    it reloads every record.
+    """
+    if feed is None:
+        display_records()
+    else:
+        feed.poll()
+
+
+def flush_writes():
+    """
+    Commits the buffered student submissions every ``write_behind.FLUSH_MS`` milliseconds.
+
+    Without a change feed the records are reloaded to show them.
+    """
+    try:
+        if writes.flush() and feed is None:
+            display_records()
+    finally:
+        root.after(write_behind.FLUSH_MS, flush_writes)
+
+
+def show_write_error(op, kind, row, error):
+    """Reports a buffered submission that another app made impossible since."""
+    messagebox.showerror("Submission Lost", f"Could not {op} {row[0]} in {kind}: {error}")
+
+
+def watch_changes(changes):
+    """
+    Polls a change feed every ``change_feed.POLL_MS`` milliseconds, so
+    changes made by other windows and apps show up without a reload.
+
+    :param changes: The ChangeFeed of the database.
+    """
+    global feed
+    feed = changes
+    feed.subscribe(apply_changes)
+
+    def poll():
+        try:
+            feed.poll()
+        finally:
+            # Keep polling after a failed refresh; the feed retries those changes.
+            root.after(change_feed.POLL_MS, poll)
+
+    root.after(change_feed.POLL_MS, poll)
+
+
+@traced_action
+@metrics.timed('school_ui_refresh_seconds', view='display_records')
 def display_records():
     """
     Displays all records in the TreeView widget.
@@ -401,123 +959,219 @@ def display_records():
 
     for item in tree.get_children():
         tree.delete(item)
+    course_members.clear()
 
-    students = get_all_students()
-    for student in students:
-        tree.insert("", "end", values=("Student", student.student_id, student.name, student.age, student.get_email()))
+    for values in record_rows():
+        insert_row(values)
 
-    instructors = get_all_instructors()
-    for instructor in instructors:
-        tree.insert("", "end", values=("Instructor", instructor.instructor_id, instructor.name, instructor.age, instructor.get_email()))
-
-    courses = get_all_courses()
-    for course in courses:
-        # Fetch enrolled students for each course
-        enrolled_students = get_enrollments_for_course(course.course_id)
-        enrolled_students_names = ", ".join([student.name for student in enrolled_students])
-        
-        tree.insert("", "end", values=(
-            "Course", 
-            course.course_id, 
-            course.course_name, 
-            course.instructor.name, 
-            enrolled_students_names if enrolled_students else "No students enrolled"
-        ))
 
+def load_records_progressively(timer, on_done=None):
+    """
+    Streams the records into the TreeView without blocking the first paint.
+
+    The rows are read by a background loader as soon as this is called. Once
+    the window is mapped they are inserted in time-sliced chunks from ``after()``
+    callbacks, so the window stays responsive while a large database loads.
 
-    
-# Create Treeview for displaying records
-columns = ("Type", "ID", "Name", "Age/Instructor", "Email/Students")
-tree = ttk.Treeview(root, columns=columns, show="headings")
-for col in columns:
-    tree.heading(col, text=col)
-tree.grid(row=0, column=2, rowspan=3, padx=10, pady=10, sticky="nsew")
-
-root.grid_columnconfigure(2, weight=1)
-
-# Creating the UI forms
-student_frame = tk.LabelFrame(root, text="Add Student", padx=10, pady=10)
-student_frame.grid(row=0, column=0, padx=10, pady=10)
-tk.Label(student_frame, text="Name").pack()
-entry_student_name = tk.Entry(student_frame)
-entry_student_name.pack()
-tk.Label(student_frame, text="Age").pack()
-entry_student_age = tk.Entry(student_frame)
-entry_student_age.pack()
-tk.Label(student_frame, text="Email").pack()
-entry_student_email = tk.Entry(student_frame)
-entry_student_email.pack()
-tk.Label(student_frame, text="Student ID").pack()
-entry_student_id = tk.Entry(student_frame)
-entry_student_id.pack()
-tk.Button(student_frame, text="Submit", command=submit_student).pack()
-
-instructor_frame = tk.LabelFrame(root, text="Add Instructor", padx=10, pady=10)
-instructor_frame.grid(row=1, column=0, padx=10, pady=10)
-tk.Label(instructor_frame, text="Name").pack()
-entry_instructor_name = tk.Entry(instructor_frame)
-entry_instructor_name.pack()
-tk.Label(instructor_frame, text="Age").pack()
-entry_instructor_age = tk.Entry(instructor_frame)
-entry_instructor_age.pack()
-tk.Label(instructor_frame, text="Email").pack()
-entry_instructor_email = tk.Entry(instructor_frame)
-entry_instructor_email.pack()
-tk.Label(instructor_frame, text="Instructor ID").pack()
-entry_instructor_id = tk.Entry(instructor_frame)
-entry_instructor_id.pack()
-tk.Button(instructor_frame, text="Submit", command=submit_instructor).pack()
-
-course_frame = tk.LabelFrame(root, text="Add Course", padx=10, pady=10)
-course_frame.grid(row=2, column=0, padx=10, pady=10)
-tk.Label(course_frame, text="Course ID").pack()
-entry_course_id = tk.Entry(course_frame)
-entry_course_id.pack()
-tk.Label(course_frame, text="Course Name").pack()
-entry_course_name = tk.Entry(course_frame)
-entry_course_name.pack()
-tk.Label(course_frame, text="Instructor Name").pack()
-entry_course_instructor = tk.Entry(course_frame)
-entry_course_instructor.pack()
-tk.Button(course_frame, text="Submit", command=submit_course).pack()
-
-registration_frame = tk.LabelFrame(root, text="Register Student to Course", padx=10, pady=10)
-registration_frame.grid(row=0, column=1, padx=10, pady=10)
-tk.Label(registration_frame, text="Select Student").pack()
-student_var = tk.StringVar(root)
-student_dropdown = tk.OptionMenu(registration_frame, student_var, [])
-student_dropdown.pack()
-tk.Label(registration_frame, text="Select Course").pack()
-course_var = tk.StringVar(root)
-course_dropdown = tk.OptionMenu(registration_frame, course_var, [])
-course_dropdown.pack()
-tk.Button(registration_frame, text="Register", command=register_student).pack()
-
-assignment_frame = tk.LabelFrame(root, text="Assign Instructor to Course", padx=10, pady=10)
-assignment_frame.grid(row=1, column=1, padx=10, pady=10)
-tk.Label(assignment_frame, text="Select Instructor").pack()
-instructor_var = tk.StringVar(root)
-instructor_dropdown = tk.OptionMenu(assignment_frame, instructor_var, [])
-instructor_dropdown.pack()
-tk.Label(assignment_frame, text="Select Course").pack()
-course_dropdown_assign = tk.OptionMenu(assignment_frame, course_var, [])
-course_dropdown_assign.pack()
-tk.Button(assignment_frame, text="Assign", command=assign_instructor).pack()
-
-button_frame = tk.Frame(root)
-button_frame.grid(row=2, column=1, padx=10, pady=10, sticky="n")
-tk.Button(button_frame, text="Edit", command=edit_record).pack(side=tk.LEFT, padx=5)
-tk.Button(button_frame, text="Delete", command=delete_record).pack(side=tk.LEFT, padx=5)
-tk.Button(button_frame, text="Save", command=save_data).pack(side=tk.LEFT, padx=5)
-tk.Button(button_frame, text="Load", command=load_data).pack(side=tk.LEFT, padx=5)
-
-search_frame = tk.Frame(root)
-search_frame.grid(row=2, column=1, padx=10, pady=10)
-tk.Label(search_frame, text="Search by Name:").pack(side=tk.LEFT)
-search_entry = tk.Entry(search_frame)
-search_entry.pack(side=tk.LEFT)
-tk.Button(search_frame, text="Search", command=search_records).pack(side=tk.LEFT, padx=5)
-
-
-display_records()
-root.mainloop()
+    :param timer: The StartupTimer that records first paint and interactive.
+    :param on_done: Optional callable run once all records are shown.
+    """
+    if sqlite_backend():
+        loader = BackgroundLoader(lambda: sql_trace.iter_action("display_records", record_rows())).start()
+    else:
+        # Other backends are not shared with the loader thread
+        rows = list(record_rows())
+        loader = BackgroundLoader(lambda: rows).start()
+
+    def insert_rows(rows):
+        # A refresh during the load may already have shown some of these rows
+        for values in rows:
+            upsert_row(values, False)
+
+    def pump():
+        if loader.drain(insert_rows):
+            update_dropdowns()
+            timer.mark("interactive")
+            if on_done is not None:
+                on_done()
+        else:
+            root.after(10, pump)
+
+    def on_map(event):
+        root.unbind("<Map>")
+        root.update_idletasks()
+        timer.mark("first_paint")
+        root.after(0, pump)
+
+    root.bind("<Map>", on_map)
+
+
+def build_ui():
+    """
+    Creates the main window and all of its widgets.
+
+    The widgets are stored in module globals so the handlers above can reach them.
+    """
+    global root, tree, search_entry, fuzzy_var
+    global entry_student_name, entry_student_age, entry_student_email, entry_student_id
+    global entry_instructor_name, entry_instructor_age, entry_instructor_email, entry_instructor_id
+    global entry_course_id, entry_course_name, entry_course_instructor, entry_course_meetings
+    global student_var, course_var, instructor_var
+    global student_dropdown, course_dropdown, instructor_dropdown, course_dropdown_assign
+
+    root = tk.Tk()
+    root.title("School Management System")
+    root.geometry("1300x700")
+
+    # Create Treeview for displaying records
+    columns = ("Type", "ID", "Name", "Age/Instructor", "Email/Students")
+    tree = ttk.Treeview(root, columns=columns, show="headings")
+    for col in columns:
+        tree.heading(col, text=col)
+    tree.grid(row=0, column=2, rowspan=3, padx=10, pady=10, sticky="nsew")
+
+    root.grid_columnconfigure(2, weight=1)
+
+    # Creating the UI forms
+    student_frame = tk.LabelFrame(root, text="Add Student", padx=10, pady=10)
+    student_frame.grid(row=0, column=0, padx=10, pady=10)
+    tk.Label(student_frame, text="Name").pack()
+    entry_student_name = tk.Entry(student_frame)
+    entry_student_name.pack()
+    tk.Label(student_frame, text="Age").pack()
+    entry_student_age = tk.Entry(student_frame)
+    entry_student_age.pack()
+    tk.Label(student_frame, text="Email").pack()
+    entry_student_email = tk.Entry(student_frame)
+    entry_student_email.pack()
+    tk.Label(student_frame, text="Student ID").pack()
+    entry_student_id = tk.Entry(student_frame)
+    entry_student_id.pack()
+    tk.Button(student_frame, text="Submit", command=submit_student).pack()
+
+    instructor_frame = tk.LabelFrame(root, text="Add Instructor", padx=10, pady=10)
+    instructor_frame.grid(row=1, column=0, padx=10, pady=10)
+    tk.Label(instructor_frame, text="Name").pack()
+    entry_instructor_name = tk.Entry(instructor_frame)
+    entry_instructor_name.pack()
+    tk.Label(instructor_frame, text="Age").pack()
+    entry_instructor_age = tk.Entry(instructor_frame)
+    entry_instructor_age.pack()
+    tk.Label(instructor_frame, text="Email").pack()
+    entry_instructor_email = tk.Entry(instructor_frame)
+    entry_instructor_email.pack()
+    tk.Label(instructor_frame, text="Instructor ID").pack()
+    entry_instructor_id = tk.Entry(instructor_frame)
+    entry_instructor_id.pack()
+    tk.Button(instructor_frame, text="Submit", command=submit_instructor).pack()
+
+    course_frame = tk.LabelFrame(root, text="Add Course", padx=10, pady=10)
+    course_frame.grid(row=2, column=0, padx=10, pady=10)
+    tk.Label(course_frame, text="Course ID").pack()
+    entry_course_id = tk.Entry(course_frame)
+    entry_course_id.pack()
+    tk.Label(course_frame, text="Course Name").pack()
+    entry_course_name = tk.Entry(course_frame)
+    entry_course_name.pack()
+    tk.Label(course_frame, text="Instructor Name").pack()
+    entry_course_instructor = tk.Entry(course_frame)
+    entry_course_instructor.pack()
+    entry_course_meetings = tk.Entry(course_frame)
+    if sqlite_backend():
+        tk.Label(course_frame, text="Meetings (e.g. Mon 09:00-10:15, Wed 09:00-10:15)").pack()
+        entry_course_meetings.pack()
+    tk.Button(course_frame, text="Submit", command=submit_course).pack()
+
+    registration_frame = tk.LabelFrame(root, text="Register Student to Course", padx=10, pady=10)
+    registration_frame.grid(row=0, column=1, padx=10, pady=10)
+    tk.Label(registration_frame, text="Select Student").pack()
+    student_var = tk.StringVar(root)
+    student_dropdown = tk.OptionMenu(registration_frame, student_var, [])
+    student_dropdown.pack()
+    tk.Label(registration_frame, text="Select Course").pack()
+    course_var = tk.StringVar(root)
+    course_dropdown = tk.OptionMenu(registration_frame, course_var, [])
+    course_dropdown.pack()
+    tk.Button(registration_frame, text="Register", command=register_student).pack()
+
+    assignment_frame = tk.LabelFrame(root, text="Assign Instructor to Course", padx=10, pady=10)
+    assignment_frame.grid(row=1, column=1, padx=10, pady=10)
+    tk.Label(assignment_frame, text="Select Instructor").pack()
+    instructor_var = tk.StringVar(root)
+    instructor_dropdown = tk.OptionMenu(assignment_frame, instructor_var, [])
+    instructor_dropdown.pack()
+    tk.Label(assignment_frame, text="Select Course").pack()
+    course_dropdown_assign = tk.OptionMenu(assignment_frame, course_var, [])
+    course_dropdown_assign.pack()
+    tk.Button(assignment_frame, text="Assign", command=assign_instructor).pack()
+
+    button_frame = tk.Frame(root)
+    button_frame.grid(row=2, column=1, padx=10, pady=10, sticky="n")
+    tk.Button(button_frame, text="Edit", command=edit_record).pack(side=tk.LEFT, padx=5)
+    tk.Button(button_frame, text="Delete", command=delete_record).pack(side=tk.LEFT, padx=5)
+    tk.Button(button_frame, text="Save", command=save_data).pack(side=tk.LEFT, padx=5)
+    tk.Button(button_frame, text="Load", command=load_data).pack(side=tk.LEFT, padx=5)
+
+    search_frame = tk.Frame(root)
+    search_frame.grid(row=2, column=1, padx=10, pady=10)
+    tk.Label(search_frame, text="Search by Name:").pack(side=tk.LEFT)
+    search_entry = tk.Entry(search_frame)
+    search_entry.pack(side=tk.LEFT)
+    fuzzy_var = tk.BooleanVar(root)
+    tk.Checkbutton(search_frame, text="Fuzzy", variable=fuzzy_var).pack(side=tk.LEFT)
+    tk.Button(search_frame, text="Search", command=search_records).pack(side=tk.LEFT, padx=5)
+
+
+def main(progressive=None):
+    """
+    Opens the storage backend, creates the tables if needed, builds the UI
+    and runs the Tk mainloop.
+
+    ``SCHOOL_BACKEND`` selects the backend (see repository.from_env). Backups
+    and the change feed only exist for the SQLite database; with another
+    backend the window reloads after its own changes instead.
+
+    :param progressive: Paint the window first and stream the records in (the
+                        default), or load everything before the first paint.
+                        Defaults to progressive unless ``SCHOOL_STARTUP=eager``.
+    """
+    global writes, repo
+    if progressive is None:
+        progressive = os.environ.get("SCHOOL_STARTUP", "progressive") != "eager"
+    timer = StartupTimer("tk_mmb78")
+    repo = repository.from_env(db_mmb78.DB_PATH, "enrollments")
+    if sqlite_backend():
+        db_mmb78.create_tables()
+        if isinstance(repo, repository.ReplicaRepository):
+            repo.reload()
+    build_ui()
+    metrics.start_from_env()
+    if sqlite_backend():
+        backup.start_from_env(db_mmb78.DB_PATH)
+    writes = write_behind.from_env(repo, getattr(repo, "path", db_mmb78.DB_PATH) + ".edits",
+                                   on_error=show_write_error)
+    if writes is not None:
+        root.after(write_behind.FLUSH_MS, flush_writes)
+    watchdog = stall_watchdog.from_env(stall_watchdog.TkWatchdog, root)
+    # Created before loading so changes committed during the load are not missed
+    changes = change_feed.ChangeFeed(db_mmb78.DB_PATH) if sqlite_backend() else None
+    start_watching = (lambda: watch_changes(changes)) if changes is not None else None
+    if progressive:
+        load_records_progressively(timer, on_done=start_watching)
+    else:
+        display_records()
+        if start_watching is not None:
+            start_watching()
+        root.after_idle(timer.mark, "interactive")
+    root.mainloop()
+    if writes is not None:
+        writes.close()
+    repo.close()
+
+    if sql_trace.is_enabled():
+        print(sql_trace.report())
+        print(sql_trace.n_plus_one_report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+PRAGMA tuning against a recorded workload.
+
+Which page size, cache size, memory map size and synchronous level suit a
+database depends on its size and on the statements the apps run, so they
+are measured rather than guessed:
+
+1. Run an app with ``SQL_RECORD=workload.jsonl`` (see :mod:`sql_trace`),
+   which writes every statement it runs and copies the database as it was.
+2. ``python tuning.py workload.jsonl`` replays the workload against fresh
+   copies of that database under candidate settings and prints how long each
+   took. Starting from SQLite's defaults it tries the :data:`CANDIDATES` of
+   one PRAGMA at a time, keeping a value only if it is at least
+   :data:`MIN_GAIN` faster, so replays are not wasted on the full grid
+   (``--exhaustive`` tries it anyway).
+3. ``--apply`` writes the best settings to a profile next to the recorded
+   database, ``<database>.pragmas.json``, and rebuilds the database if the
+   page size changed. :func:`sql_trace.connect` applies the profile to every
+   connection it opens, so db_mmb78, db and the repositories all get it.
+
+``synchronous`` is only tried down to ``NORMAL``: ``OFF`` could corrupt the
+database on a power loss, which no speed-up is worth.
+"""
+import itertools
+import json
+import os
+import sqlite3
+import time
+
+import metrics
+
+PRAGMAS = ("page_size", "cache_size", "mmap_size", "synchronous")
+
+CANDIDATES = {
+    "page_size": (4096, 8192, 16384),
+    # Negative sizes are in KiB.
+    "cache_size": (-2000, -16384, -65536),
+    "mmap_size": (0, 64 * 2 ** 20, 256 * 2 ** 20),
+    "synchronous": ("FULL", "NORMAL"),
+}
+
+# Settings of a connection nobody tuned; the page size is the database's own.
+DEFAULTS = {"cache_size": -2000, "mmap_size": 0, "synchronous": "FULL"}
+
+# A value replaces the current one only if the replay is this much faster.
+MIN_GAIN = 0.03
+
+PROFILE_SUFFIX = ".pragmas.json"
+
+_SYNCHRONOUS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# Profile path -> (modification time, pragmas), so connections opened once
+# per call do not parse the file each time.
+_profiles = {}
+
+
+def profile_path(database):
+    """Returns the path of the PRAGMA profile of a database file."""
+    return os.path.abspath(database) + PROFILE_SUFFIX
+
+
+def pragma_statements(pragmas):
+    """
+    Returns the ``PRAGMA`` statements setting ``pragmas``.
+
+    :param pragmas: A dict of PRAGMA name to value.
+    :raises ValueError: For unknown names or values.
+    """
+    statements = []
+    for name, value in pragmas.items():
+        if name not in PRAGMAS or not (isinstance(value, int) or value in _SYNCHRONOUS):
+            raise ValueError(f"invalid pragma {name} = {value!r}")
+        statements.append(f"PRAGMA {name} = {value}")
+    return statements
+
+
+def load_profile(database):
+    """
+    Returns the tuned pragmas of a database, or None if it has no profile.
+
+    :param database: Path of the database file.
+    """
+    path = profile_path(database)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _profiles.get(path)
+    if cached is None or cached[0] != mtime:
+        metrics.cache_miss("pragma_profile")
+        with open(path, encoding="utf-8") as f:
+            pragmas = json.load(f)["pragmas"]
+        pragma_statements(pragmas)
+        cached = _profiles[path] = (mtime, pragmas)
+    else:
+        metrics.cache_hit("pragma_profile")
+    return cached[1]
+
+
+def apply_profile(conn, database):
+    """
+    Applies the profile of ``database`` to a new connection, if it has one.
+
+    The page size only takes effect on a database that has no tables yet;
+    :func:`apply` rebuilds existing ones.
+
+    :param conn: The connection, before any other statement.
+    :param database: The path it was opened with.
+    """
+    if database == ":memory:":
+        return
+    pragmas = load_profile(database)
+    if pragmas:
+        for statement in pragma_statements(pragmas):
+            # Not through a traced connection's execute, so not recorded.
+            sqlite3.Connection.execute(conn, statement)
+
+
+def read_workload(path):
+    """
+    Reads a workload recorded by :class:`sql_trace.Recorder`.
+
+    :return: ``(snapshots, entries)``: the snapshot file of each recorded
+             database and the list of statement and transaction entries.
+    """
+    snapshots = {}
+    entries = []
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if "snapshot" in entry:
+                snapshots[entry["database"]] = os.path.join(directory, entry["snapshot"])
+            else:
+                entries.append(entry)
+    return snapshots, entries
+
+
+def set_page_size(conn, page_size):
+    """
+    Rebuilds a database with another page size.
+
+    WAL databases are switched out of WAL for the rebuild, which is the only
+    way SQLite allows it, and back afterwards.
+
+    :param conn: A connection with no other connection to the database open.
+    """
+    if conn.execute("PRAGMA page_size").fetchone()[0] == page_size:
+        return
+    mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if mode == "wal":
+        conn.execute("PRAGMA journal_mode = DELETE")
+    conn.execute(f"PRAGMA page_size = {int(page_size)}")
+    conn.execute("VACUUM")
+    if mode == "wal":
+        conn.execute("PRAGMA journal_mode = WAL")
+
+
+def replay(entries, databases, pragmas):
+    """
+    Runs a recorded workload once, single-threaded and in recorded order.
+
+    Query results are fetched in full, as the apps do. Connections do not
+    wait for locks: the recorded order already has each transaction after
+    the one it waited for.
+
+    :param entries: Entries from :func:`read_workload`.
+    :param databases: Recorded database path -> the copy to run against.
+    :param pragmas: PRAGMA values set on every connection, page size excepted.
+    :return: ``(seconds, errors)``; errors include statements that failed when recorded too.
+    """
+    setup = pragma_statements({name: value for name, value in pragmas.items() if name != "page_size"})
+    conns = {}
+    errors = 0
+    start = time.perf_counter()
+    for entry in entries:
+        if "open" in entry:
+            conn = sqlite3.connect(databases[entry["open"]], timeout=0)
+            for statement in setup:
+                conn.execute(statement)
+            conns[entry["c"]] = conn
+            continue
+        conn = conns.get(entry["c"])
+        if conn is None:
+            continue
+        op = entry.get("op")
+        try:
+            if op == "commit":
+                conn.commit()
+            elif op == "rollback":
+                conn.rollback()
+            elif op == "close":
+                del conns[entry["c"]]
+                conn.close()
+            elif "many" in entry:
+                conn.executemany(entry["sql"], entry["many"])
+            else:
+                conn.execute(entry["sql"], entry["params"]).fetchall()
+        except sqlite3.Error:
+            errors += 1
+    for conn in conns.values():
+        conn.close()
+    return time.perf_counter() - start, errors
+
+
+def measure(snapshots, entries, pragmas, repeat=3):
+    """
+    Replays the workload ``repeat`` times on fresh copies of the snapshots.
+
+    :return: ``(median seconds, errors of the last run)``.
+    """
+    # Imported here: every app imports this module through sql_trace.
+    import shutil
+    import tempfile
+
+    times = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for run in range(repeat):
+            databases = {}
+            for i, (database, snapshot) in enumerate(snapshots.items()):
+                copy = os.path.join(tmp, f"{run}-{i}.db")
+                shutil.copyfile(snapshot, copy)
+                conn = sqlite3.connect(copy)
+                try:
+                    set_page_size(conn, pragmas["page_size"])
+                finally:
+                    conn.close()
+                databases[database] = copy
+            seconds, errors = replay(entries, databases, pragmas)
+            times.append(seconds)
+    times.sort()
+    return times[len(times) // 2], errors
+
+
+def tune(workload, repeat=3, exhaustive=False, log=print):
+    """
+    Finds the fastest PRAGMA settings for a recorded workload.
+
+    :param workload: Path of the workload file.
+    :param repeat: Replays per setting; the median counts.
+    :param exhaustive: Try every combination of :data:`CANDIDATES`.
+    :param log: Called with a line of text per setting tried.
+    :return: ``(best, seconds, baseline_seconds)``; ``best`` is a dict of PRAGMA values.
+    """
+    snapshots, entries = read_workload(workload)
+    if not snapshots:
+        raise ValueError(f"{workload} holds no statements")
+    conn = sqlite3.connect(next(iter(snapshots.values())))
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    conn.close()
+    results = {}
+
+    def timed(pragmas):
+        key = tuple(pragmas[name] for name in PRAGMAS)
+        if key not in results:
+            seconds, errors = measure(snapshots, entries, pragmas, repeat)
+            results[key] = seconds
+            log(f"{seconds * 1000:10.1f} ms  {errors:4d} errors  "
+                + "  ".join(f"{name}={pragmas[name]}" for name in PRAGMAS))
+        return results[key]
+
+    best = {"page_size": page_size, **DEFAULTS}
+    baseline = best_seconds = timed(best)
+    if exhaustive:
+        for values in itertools.product(*(CANDIDATES[name] for name in PRAGMAS)):
+            pragmas = dict(zip(PRAGMAS, values))
+            seconds = timed(pragmas)
+            if seconds < best_seconds * (1 - MIN_GAIN):
+                best, best_seconds = pragmas, seconds
+    else:
+        for name in PRAGMAS:
+            for value in CANDIDATES[name]:
+                pragmas = dict(best, **{name: value})
+                seconds = timed(pragmas)
+                if seconds < best_seconds * (1 - MIN_GAIN):
+                    best, best_seconds = pragmas, seconds
+    return best, best_seconds, baseline
+
+
+def apply(database, pragmas, seconds=None, baseline=None):
+    """
+    Makes ``pragmas`` the profile of a database and rebuilds it for the page size.
+
+    :param database: Path of the database file; no other connection may be open.
+    :param pragmas: A dict of PRAGMA values, as returned by :func:`tune`.
+    :param seconds: Replay time with ``pragmas``, kept in the profile for reference.
+    :param baseline: Replay time with the defaults, likewise.
+    """
+    pragma_statements(pragmas)
+    conn = sqlite3.connect(database)
+    try:
+        set_page_size(conn, pragmas["page_size"])
+    finally:
+        conn.close()
+    profile = {"pragmas": pragmas, "replay_seconds": seconds, "baseline_seconds": baseline}
+    with open(profile_path(database), "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("workload", help="file written with SQL_RECORD")
+    parser.add_argument("--repeat", type=int, default=3, help="replays per setting")
+    parser.add_argument("--exhaustive", action="store_true", help="try every combination")
+    parser.add_argument("--apply", action="store_true", help="write the profile and rebuild the database")
+    args = parser.parse_args()
+
+    best, seconds, baseline = tune(args.workload, args.repeat, args.exhaustive)
+    print(f"best: {'  '.join(f'{name}={best[name]}' for name in PRAGMAS)}  "
+          f"{seconds * 1000:.1f} ms vs {baseline * 1000:.1f} ms with the defaults")
+    if args.apply:
+        for database in read_workload(args.workload)[0]:
+            apply(database, best, seconds, baseline)
+            print(f"profile written to {profile_path(database)}")
+
+
+if __name__ == "__main__":
+    main()
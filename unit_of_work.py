@@ -0,0 +1,466 @@
+"""
+Unit of work for the lab2_mmb78 models stored by db_mmb78.
+
+A :class:`Session` loads students, instructors and courses into an identity
+map, so that each record is a single object within the session, and keeps a
+snapshot of every object as it was loaded. The objects are then changed as
+usual: attributes are set, ``Course.add_student``,
+``Student.register_course`` and ``Instructor.assign_course`` are called,
+students are removed from ``Course.enrolled_students``, and whole objects
+are added or deleted with :meth:`Session.add` and :meth:`Session.delete`.
+
+A course comes with its instructor, capacity and meetings, read for a whole
+batch of courses at once. ``Course.enrolled_students``,
+``Student.registered_courses`` and ``Instructor.assigned_courses`` are
+loaded on first access, for the whole batch as in :mod:`relations`, and the
+records they bring join the session.
+
+:meth:`Session.commit` compares every object with its snapshot and writes
+only what changed, in one transaction: an ``INSERT`` per new object, an
+``UPDATE`` of just the changed columns of each dirty one, a ``DELETE`` per
+deleted one, and the enrollments added or removed on either side of the
+student-course relationship. ``Course.instructor`` decides a course's
+instructor; ``Instructor.assigned_courses`` only adds to it.
+
+Updates and deletes are checked against the versions read when the objects
+were loaded (see :mod:`versions`): if another app changed a record since,
+:meth:`~Session.commit` raises :class:`versions.StaleRecordError` and writes
+nothing. New enrollments take a seat as :func:`registration.enroll` does; a
+full course raises :class:`registration.CourseFull` and an overlapping one
+:class:`schedule.ScheduleConflict`, again writing nothing. Nobody is
+waitlisted here; use ``db_mmb78.enroll_student`` for that.
+"""
+import metrics
+import registration
+import schedule
+import versions
+from lab2_mmb78 import Student, Instructor, Course, is_loaded
+from relations import BATCH_SIZE, Batch
+
+# Table, key attribute and metrics entity of each model.
+_MODELS = {
+    Student: ("students", "student_id", "student"),
+    Instructor: ("instructors", "instructor_id", "instructor"),
+    Course: ("courses", "course_id", "course"),
+}
+
+# To-many relationship of each model: its name, the model it links to, and
+# the table, owner column and linked column holding the links.
+_RELATIONS = {
+    Course: ("enrolled_students", Student, "enrollments", "course_id", "student_id"),
+    Student: ("registered_courses", Course, "enrollments", "student_id", "course_id"),
+    Instructor: ("assigned_courses", Course, "courses", "instructor_id", "course_id"),
+}
+
+# Inserted in this order and deleted in the reverse one, for the foreign keys.
+_ORDER = (Instructor, Course, Student)
+
+
+def _model(obj):
+    for cls in _ORDER:
+        if isinstance(obj, cls):
+            return cls
+    raise TypeError(f"not a model object: {obj!r}")
+
+
+def _key(obj):
+    cls = _model(obj)
+    return cls, getattr(obj, _MODELS[cls][1])
+
+
+def _ref(item, attr):
+    # Relationship lists hold objects, or IDs when built by from_dict().
+    return getattr(item, attr, item)
+
+
+def _columns(obj):
+    if isinstance(obj, Course):
+        return {"course_name": obj.course_name,
+                "instructor_id": obj.instructor.instructor_id if obj.instructor else None}
+    return {"name": obj.name, "age": obj.age, "email": obj.get_email()}
+
+
+def _links(obj):
+    """Returns the IDs linked by the to-many relationship of an object, or None if not loaded."""
+    name, target, *_ = _RELATIONS[_model(obj)]
+    if not is_loaded(obj, name):
+        return None
+    return frozenset(_ref(item, _MODELS[target][1]) for item in obj.__dict__[name])
+
+
+def _snapshot(obj):
+    """Returns what commit() compares: columns, linked IDs and course extras."""
+    if isinstance(obj, Course):
+        meetings = tuple(obj.meetings) if obj.meetings is not None else None
+        return _columns(obj), _links(obj), obj.capacity, meetings
+    return _columns(obj), _links(obj), None, None
+
+
+def _chunks(keys):
+    keys = list(keys)
+    for start in range(0, len(keys), BATCH_SIZE):
+        yield keys[start:start + BATCH_SIZE]
+
+
+class Session:
+    """
+    Tracks model objects and writes their changes in one transaction.
+
+    Each call opens its own connection, like the db_mmb78 functions, so a
+    session can be kept across a dialog without holding a connection.
+
+    :param connect: Function returning a new connection, e.g. ``db_mmb78.connect``.
+    :param allow_conflicts: Enroll students in courses that overlap their schedule.
+    """
+
+    def __init__(self, connect, allow_conflicts=False):
+        self.connect = connect
+        self.allow_conflicts = allow_conflicts
+        # (model, key) -> [object, snapshot, version] of loaded and committed objects
+        self._loaded = {}
+        self._new = {}
+        self._deleted = {}
+        # Batch being filled for each model, for the relationships loaded on first access
+        self._batches = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.rollback()
+
+    # Loading
+
+    def _load(self, conn, cls, where, params):
+        table, key, _ = _MODELS[cls]
+        # The version is read with the row, so both come from one snapshot;
+        # a course brings its capacity and instructor in the same statement.
+        if cls is Course:
+            rows = conn.execute(f"""
+                SELECT t.course_id, t.course_name, t.instructor_id, COALESCE(v.version, 0), cap.capacity,
+                       i.instructor_id, i.name, i.age, i.email, COALESCE(iv.version, 0) FROM courses t
+                LEFT JOIN row_versions v ON v.table_name = 'courses' AND v.row_key = t.course_id
+                LEFT JOIN course_capacity cap ON cap.course_id = t.course_id
+                LEFT JOIN instructors i ON i.instructor_id = t.instructor_id
+                LEFT JOIN row_versions iv ON iv.table_name = 'instructors' AND iv.row_key = i.instructor_id
+                WHERE {where}
+            """, params).fetchall()
+        else:
+            rows = conn.execute(f"""
+                SELECT t.*, COALESCE(v.version, 0) FROM {table} t
+                LEFT JOIN row_versions v ON v.table_name = '{table}' AND v.row_key = t.{key}
+                WHERE {where}
+            """, params).fetchall()
+        objects = []
+        made = []
+        for row in rows:
+            identity = (cls, row[0])
+            if identity in self._loaded:
+                objects.append(self._loaded[identity][0])
+                continue
+            if cls is Course:
+                obj = Course(course_id=row[0], course_name=row[1], capacity=row[4])
+                if row[5] is None:
+                    obj.instructor = None
+                elif (Instructor, row[5]) in self._loaded:
+                    obj.instructor = self._loaded[Instructor, row[5]][0]
+                else:
+                    obj.instructor = self._track(Instructor(row[6], row[7], row[8], row[5]), row[9])
+                made.append((obj, row[3]))
+            else:
+                made.append((cls(row[1], row[2], row[3], row[0]), row[-1]))
+            objects.append(made[-1][0])
+        if cls is Course:
+            meetings = {course.course_id: [] for course, _ in made}
+            for chunk in _chunks(meetings):
+                for row in conn.execute(f"""
+                    SELECT course_id, day, start_minute, end_minute FROM course_meetings
+                    WHERE course_id IN ({', '.join('?' * len(chunk))}) ORDER BY course_id, day, start_minute
+                """, chunk):
+                    meetings[row[0]].append(schedule.Meeting(*row[1:]))
+            for course, _ in made:
+                course.meetings = meetings[course.course_id]
+        for obj, version in made:
+            self._track(obj, version)
+        metrics.inc('school_crud_operations_total', entity=_MODELS[cls][2], op='read')
+        return objects
+
+    def _track(self, obj, version):
+        """Puts a just loaded object in the identity map and in a batch."""
+        identity = _key(obj)
+        batch = self._batches.get(identity[0])
+        if batch is None or len(batch) >= BATCH_SIZE:
+            batch = self._batches[identity[0]] = Batch(self)
+        batch.append(obj)
+        obj.__dict__["_batch"] = batch
+        self._loaded[identity] = [obj, _snapshot(obj), version]
+        return obj
+
+    def load(self, cls, name, objects, batch):
+        """
+        Loads a to-many relationship of a batch of objects into the session;
+        called by the batch on first access to it.
+        """
+        _, target, table, owner, linked = _RELATIONS[cls]
+        related = {getattr(obj, _MODELS[cls][1]): [] for obj in objects}
+        conn = self.connect()
+        try:
+            links = []
+            for chunk in _chunks(related):
+                links += conn.execute(f"SELECT {owner}, {linked} FROM {table} "
+                                      f"WHERE {owner} IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+            metrics.inc('school_crud_operations_total', entity='enrollment' if table == 'enrollments' else 'course',
+                        op='read')
+            missing = {target_id for _, target_id in links} - {key for model, key in self._loaded if model is target}
+            for chunk in _chunks(missing):
+                self._load(conn, target, f"t.{_MODELS[target][1]} IN ({', '.join('?' * len(chunk))})", chunk)
+        finally:
+            conn.close()
+        for owner_id, target_id in links:
+            if (target, target_id) in self._loaded:
+                related[owner_id].append(self._loaded[target, target_id][0])
+        for obj in objects:
+            obj.__dict__[name] = related[getattr(obj, _MODELS[cls][1])]
+            entry = self._loaded.get(_key(obj))
+            if entry is not None and entry[0] is obj:
+                # What was just read is what commit() compares the links with.
+                entry[1] = (entry[1][0], _links(obj)) + entry[1][2:]
+
+    def _get(self, cls, record_id):
+        identity = (cls, record_id)
+        if identity in self._new:
+            return self._new[identity]
+        if identity in self._deleted:
+            return None
+        if identity in self._loaded:
+            return self._loaded[identity][0]
+        conn = self.connect()
+        try:
+            found = self._load(conn, cls, f"t.{_MODELS[cls][1]} = ?", (record_id,))
+        finally:
+            conn.close()
+        return found[0] if found else None
+
+    def get_student(self, student_id):
+        """Returns the student with this ID, loading it on first use, or None."""
+        return self._get(Student, student_id)
+
+    def get_instructor(self, instructor_id):
+        """Returns the instructor with this ID, loading it on first use, or None."""
+        return self._get(Instructor, instructor_id)
+
+    def get_course(self, course_id):
+        """
+        Returns the course with this ID, loading it on first use, or None.
+
+        Its instructor is loaded into the session too.
+        """
+        return self._get(Course, course_id)
+
+    # Tracking
+
+    def add(self, obj):
+        """Adds a new student, instructor or course, inserted on commit."""
+        identity = _key(obj)
+        if self._deleted.pop(identity, None) is not None:
+            # Deleted and added again: an update of the loaded record.
+            self._loaded[identity][0] = obj
+            return
+        if identity in self._loaded or identity in self._new:
+            raise ValueError(f"{identity[1]!r} is already in the session")
+        self._new[identity] = obj
+
+    def delete(self, obj):
+        """Marks an object for deletion on commit; a new one is just forgotten."""
+        identity = _key(obj)
+        if self._new.pop(identity, None) is None:
+            if identity not in self._loaded:
+                raise ValueError(f"{identity[1]!r} is not in the session")
+            self._deleted[identity] = obj
+
+    @property
+    def new(self):
+        """Objects added since the last commit."""
+        return list(self._new.values())
+
+    @property
+    def dirty(self):
+        """Loaded objects that differ from their snapshot."""
+        return [obj for identity, (obj, snapshot, _) in self._loaded.items()
+                if identity not in self._deleted and _snapshot(obj) != snapshot]
+
+    @property
+    def deleted(self):
+        """Objects marked for deletion."""
+        return list(self._deleted.values())
+
+    def rollback(self):
+        """Forgets pending additions and deletions; changed objects stay as they are."""
+        self._new.clear()
+        self._deleted.clear()
+
+    def refresh(self, obj):
+        """
+        Reloads an object from the database, discarding its changes.
+
+        :return: The object, or None if its record was deleted.
+        """
+        identity = _key(obj)
+        self._loaded.pop(identity, None)
+        self._deleted.pop(identity, None)
+        conn = self.connect()
+        try:
+            found = self._load(conn, identity[0], f"t.{_MODELS[identity[0]][1]} = ?", (identity[1],))
+        finally:
+            conn.close()
+        if not found:
+            return None
+        fresh = found[0]
+        # Relationships read before are dropped and load again on next access.
+        obj.__dict__.clear()
+        obj.__dict__.update(fresh.__dict__)
+        batch = obj.__dict__["_batch"]
+        batch[next(i for i, item in enumerate(batch) if item is fresh)] = obj
+        self._loaded[identity][0] = obj
+        return obj
+
+    def overwrite(self, obj):
+        """
+        Makes the next commit apply the changes of an object over those made
+        by others since it was loaded, after a :class:`versions.StaleRecordError`.
+
+        Only the columns changed in this session are written; other columns
+        keep the values others gave them.
+        """
+        identity = _key(obj)
+        conn = self.connect()
+        try:
+            self._loaded[identity][2] = versions.get(conn, _MODELS[identity[0]][0], identity[1])
+        finally:
+            conn.close()
+
+    # Writing
+
+    def commit(self):
+        """
+        Writes the new, changed and deleted objects in one transaction.
+
+        :return: The number of statements run.
+        :raises versions.StaleRecordError: If a changed or deleted record was
+                                           changed by someone else since it was loaded.
+        :raises registration.CourseFull: If a new enrollment finds no free seat.
+        :raises schedule.ScheduleConflict: If a new enrollment overlaps the student's schedule.
+        """
+        dirty = {identity: entry for identity, entry in self._loaded.items()
+                 if identity not in self._deleted and _snapshot(entry[0]) != entry[1]}
+        if not (dirty or self._new or self._deleted):
+            return 0
+        counts = {}
+        conn = self.connect()
+        try:
+            with registration.transaction(conn):
+                for cls in _ORDER:
+                    for (model, record_id), obj in self._new.items():
+                        if model is cls:
+                            self._insert(conn, obj, counts)
+                for identity, (obj, snapshot, version) in dirty.items():
+                    self._update(conn, obj, snapshot, version, counts)
+                self._link(conn, dirty, counts)
+                for cls in reversed(_ORDER):
+                    for identity in [identity for identity in self._deleted if identity[0] is cls]:
+                        self._delete(conn, identity, self._loaded[identity][2], counts)
+                written = {**dirty, **{identity: [obj] for identity, obj in self._new.items()}}
+                versions_now = {identity: versions.get(conn, _MODELS[identity[0]][0], identity[1])
+                                for identity in written}
+        finally:
+            conn.close()
+
+        for identity in self._deleted:
+            del self._loaded[identity]
+        for identity, entry in written.items():
+            self._loaded[identity] = [entry[0], _snapshot(entry[0]), versions_now[identity]]
+        self._new.clear()
+        self._deleted.clear()
+        for (entity, op), count in counts.items():
+            metrics.inc('school_crud_operations_total', count, entity=entity, op=op)
+        return sum(counts.values())
+
+    @staticmethod
+    def _count(counts, entity, op):
+        counts[entity, op] = counts.get((entity, op), 0) + 1
+
+    def _insert(self, conn, obj, counts):
+        table, key, entity = _MODELS[_model(obj)]
+        columns = _columns(obj)
+        names = (key,) + tuple(columns)
+        conn.execute(f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                     (getattr(obj, key),) + tuple(columns.values()))
+        self._count(counts, entity, 'create')
+        if isinstance(obj, Course):
+            if obj.capacity is not None:
+                registration.set_capacity(conn, obj.course_id, obj.capacity)
+            if obj.meetings:
+                schedule.set_meetings(conn, obj.course_id, obj.meetings)
+
+    def _update(self, conn, obj, snapshot, version, counts):
+        table, key, entity = _MODELS[_model(obj)]
+        old_columns, _, old_capacity, old_meetings = snapshot
+        changed = {name: value for name, value in _columns(obj).items() if old_columns[name] != value}
+        if changed:
+            assignments = ", ".join(f"{name} = ?" for name in changed)
+            updated = conn.execute(f"UPDATE {table} SET {assignments} WHERE {key} = ? AND {versions.matches(table)}",
+                                   tuple(changed.values()) + (getattr(obj, key), version)).rowcount
+            if not updated:
+                raise versions.stale(conn, table, getattr(obj, key))
+            self._count(counts, entity, 'update')
+        if isinstance(obj, Course):
+            if obj.capacity != old_capacity:
+                registration.set_capacity(conn, obj.course_id, obj.capacity)
+            meetings = tuple(obj.meetings) if obj.meetings is not None else None
+            if meetings is not None and meetings != old_meetings:
+                schedule.set_meetings(conn, obj.course_id, obj.meetings)
+
+    def _link(self, conn, dirty, counts):
+        """Writes the enrollments and course assignments added or removed on either side."""
+        added, removed = set(), set()
+        assigned = {}
+        objects = [(entry[0], entry[1][1]) for entry in dirty.values()]
+        objects += [(obj, frozenset()) for obj in self._new.values()]
+        for obj, before in objects:
+            links = _links(obj)
+            if links is None:
+                continue
+            if before is None:
+                # Set without being loaded first: compare with the database.
+                _, _, table, owner, linked = _RELATIONS[_model(obj)]
+                before = frozenset(row[0] for row in conn.execute(
+                    f"SELECT {linked} FROM {table} WHERE {owner} = ?", (getattr(obj, _MODELS[_model(obj)][1]),)))
+            if isinstance(obj, Course):
+                added |= {(student_id, obj.course_id) for student_id in links - before}
+                removed |= {(student_id, obj.course_id) for student_id in before - links}
+            elif isinstance(obj, Student):
+                added |= {(obj.student_id, course_id) for course_id in links - before}
+                removed |= {(obj.student_id, course_id) for course_id in before - links}
+            else:
+                for course_id in links - before:
+                    assigned[course_id] = obj.instructor_id
+        for student_id, course_id in removed - added:
+            if conn.execute("DELETE FROM enrollments WHERE student_id = ? AND course_id = ?",
+                            (student_id, course_id)).rowcount:
+                self._count(counts, 'enrollment', 'delete')
+        for student_id, course_id in sorted(added - removed):
+            if not registration.take_seat(conn, student_id, course_id, self.allow_conflicts):
+                raise registration.CourseFull(student_id, course_id)
+            self._count(counts, 'enrollment', 'create')
+        for course_id, instructor_id in assigned.items():
+            # A course loaded here is written from its own instructor attribute.
+            if (Course, course_id) not in self._loaded and (Course, course_id) not in self._new:
+                conn.execute("UPDATE courses SET instructor_id = ? WHERE course_id = ?", (instructor_id, course_id))
+                self._count(counts, 'course', 'update')
+
+    def _delete(self, conn, identity, version, counts):
+        table, key, entity = _MODELS[identity[0]]
+        if not conn.execute(f"DELETE FROM {table} WHERE {key} = ? AND {versions.matches(table)}",
+                            (identity[1], version)).rowcount:
+            raise versions.stale(conn, table, identity[1])
+        self._count(counts, entity, 'delete')
@@ -0,0 +1,112 @@
+"""
+Row versions for optimistic concurrency control of edits.
+
+An edit dialog reads the version of a record along with the record, and its
+save is a version-checked ``UPDATE``: it only changes the row if nobody else
+changed it since, in the same statement, and otherwise fails with
+:class:`StaleRecordError` carrying the record as it is now. Nothing is
+locked while a dialog is open, so two registrar staff editing at once never
+wait for each other, and the second save is caught instead of silently
+overwriting the first.
+
+The versions live in a ``row_versions`` side table rather than a column of
+their own, so ``SELECT *`` rows and ``INSERT ... VALUES`` statements keep
+their shape. Triggers add 1 to the version of a row on every update, by any
+app or connection, and on delete; the version of a deleted record is kept
+so that a record added again under the same key does not match a version
+read before the delete. A record never changed has version 0 and no entry.
+"""
+
+# Tables with versioned rows and their key columns.
+TABLES = {"students": "student_id", "instructors": "instructor_id", "courses": "course_id"}
+
+_BUMP_SQL = """
+    INSERT OR REPLACE INTO row_versions (table_name, row_key, version)
+        SELECT '{table}', {key}, COALESCE((SELECT version FROM row_versions
+                                           WHERE table_name = '{table}' AND row_key = {key}), 0) + 1
+        {where};
+"""
+
+_VERSION_SQL = "SELECT version FROM row_versions WHERE table_name = ? AND row_key = ?"
+
+
+class StaleRecordError(Exception):
+    """
+    Raised when a version-checked update finds the record changed or deleted.
+
+    :param kind: Name of the table.
+    :param record_id: Key of the record.
+    :param current: The record as it is now, or None if it was deleted.
+    :param version: Its current version.
+    """
+
+    def __init__(self, kind, record_id, current, version):
+        state = "deleted" if current is None else f"changed (now version {version})"
+        super().__init__(f"{kind} {record_id!r} was {state} since it was read")
+        self.kind = kind
+        self.record_id = record_id
+        self.current = current
+        self.version = version
+
+
+def create(conn, tables=TABLES):
+    """
+    Creates the version table and its triggers if they do not exist yet.
+
+    Must run after :func:`schema.create`, which may rebuild a table and drop
+    its triggers.
+
+    :param conn: An open connection; the caller commits.
+    :param tables: Mapping of table name to key column.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS row_versions (
+            table_name TEXT NOT NULL,
+            row_key TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (table_name, row_key)
+        ) WITHOUT ROWID
+    """)
+    for table, key in tables.items():
+        old, new = f"OLD.{key}", f"NEW.{key}"
+        # A changed key changes the versions of both keys.
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_version_update AFTER UPDATE ON {table}
+            BEGIN
+                {_BUMP_SQL.format(table=table, key=old, where="")}
+                {_BUMP_SQL.format(table=table, key=new, where=f"WHERE {old} IS NOT {new}")}
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_version_delete AFTER DELETE ON {table}
+            BEGIN {_BUMP_SQL.format(table=table, key=old, where="")} END
+        """)
+
+
+def get(conn, table, record_id):
+    """Returns the version of a record; 0 if it was never updated or deleted."""
+    row = conn.execute(_VERSION_SQL, (table, record_id)).fetchone()
+    return row[0] if row else 0
+
+
+def matches(table):
+    """
+    Returns a condition for the ``WHERE`` clause of an ``UPDATE`` of ``table``
+    that holds if the row is still at the version given as its ``?`` parameter.
+    """
+    key = TABLES[table]
+    return (f"COALESCE((SELECT version FROM row_versions "
+            f"WHERE table_name = '{table}' AND row_key = {table}.{key}), 0) = ?")
+
+
+def stale(conn, table, record_id, columns="*"):
+    """
+    Returns the :class:`StaleRecordError` for a version-checked update that
+    changed no row.
+
+    :param conn: The connection the update ran on.
+    :param columns: Columns of the current record, e.g. ``"*"``.
+    """
+    version = get(conn, table, record_id)
+    current = conn.execute(f"SELECT {columns} FROM {table} WHERE {TABLES[table]} = ?", (record_id,)).fetchone()
+    return StaleRecordError(table, record_id, current, version)
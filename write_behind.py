@@ -0,0 +1,251 @@
+"""
+Write-behind buffering of form submissions, with group commit.
+
+Committing every submitted form on its own costs SQLite several fsyncs per
+click. A :class:`WriteBehind` buffer instead checks each edit against the
+repository and the edits still pending, appends it to a local journal with a
+single fsync, and acknowledges it. The pending edits are then applied in one
+transaction (a group commit) when :data:`FLUSH_SIZE` of them have piled up
+or when the GUI's timer calls :meth:`~WriteBehind.flush`, every
+:data:`FLUSH_MS` milliseconds.
+
+The journal is only cleared after the transaction commits. If the app dies
+in between, the next :class:`WriteBehind` opened on the same journal applies
+it again; the edits of a record whose last journaled row is already stored
+are taken as done then. Edits that cannot be applied when flushing, e.g.
+because another app took the key or changed a record a versioned update was
+based on meanwhile, are applied one by one so the others still commit, and
+reported to ``on_error``.
+
+It is off by default. ``SCHOOL_WRITE_BEHIND=1`` turns it on in the PyQt and
+Tk apps (see :func:`from_env`); edits then show up in the tables once
+flushed, through the change feed. ``bench_write_behind.py`` compares both.
+"""
+import json
+import os
+
+import metrics
+import repository
+
+# Pending edits that trigger a flush from submit().
+FLUSH_SIZE = 100
+
+# Interval of the GUI timer calling flush().
+FLUSH_MS = int(os.environ.get("SCHOOL_WRITE_BEHIND_MS", "1000"))
+
+OPS = ("add", "update")
+
+# school_crud_operations_total labels of each kind and operation.
+_ENTITIES = {"students": "student", "instructors": "instructor", "courses": "course"}
+_METRIC_OPS = {"add": "create", "update": "update"}
+
+
+class WriteBehind:
+    """
+    Buffers adds and updates of records for a :class:`repository.Repository`.
+
+    Everything runs on the caller's thread, so a repository that is not
+    thread-safe can be used; the GUIs call :meth:`flush` from their timers.
+
+    :param repo: The repository edits are applied to.
+    :param journal_path: Path of the journal file; edits left in it by a
+                         crash are applied right away.
+    :param flush_size: Pending edits that trigger a flush.
+    :param on_error: Called with ``(op, kind, row, error)`` for each edit
+                     that could not be applied; by default the error is raised
+                     once the others are committed.
+    """
+
+    def __init__(self, repo, journal_path, flush_size=FLUSH_SIZE, on_error=None):
+        self.repo = repo
+        self.journal_path = journal_path
+        self.flush_size = flush_size
+        self.on_error = on_error
+        # Keys added or updated by pending edits, per kind, with their rows,
+        # and the number of pending updates of each key.
+        self._rows = {kind: {} for kind in repository.KINDS}
+        self._updates = {kind: {} for kind in repository.KINDS}
+        self._pending = self._read_journal()
+        # Set while edits a crash left in the journal are still pending.
+        self._recovering = False
+        self._journal = open(journal_path, "a", encoding="utf-8")
+        if self._pending:
+            self.flush(recovering=True)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _read_journal(self):
+        if not os.path.exists(self.journal_path):
+            return []
+        pending = []
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op, kind, row, *version = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash was never acknowledged.
+                    break
+                pending.append((op, kind, tuple(row), version[0] if version else None))
+        return pending
+
+    def get(self, kind, record_id):
+        """Returns a record as it will be once flushed, or None."""
+        row = self._rows[kind].get(record_id)
+        return row if row is not None else self.repo.get(kind, record_id)
+
+    def version(self, kind, record_id):
+        """
+        Returns the version a record will have once flushed.
+
+        Each pending update of it adds 1 when it is applied, so an edit based
+        on this version follows this app's own pending ones.
+        """
+        return self.repo.version(kind, record_id) + self._updates[kind].get(record_id, 0)
+
+    def validate(self, op, kind, row, version=None):
+        """
+        Checks that an edit will apply, given the edits still pending.
+
+        :raises ValueError: For an unknown operation or kind.
+        :raises repository.IntegrityError: For a duplicate or missing key, or
+                                           a course of a missing instructor.
+        :raises repository.StaleRecordError: For an update based on a version
+                                             the record is no longer at.
+        """
+        if op not in OPS or kind not in repository.KINDS:
+            raise ValueError(f"cannot buffer {op} of {kind}")
+        if version is not None and self.version(kind, row[0]) != version:
+            raise repository.StaleRecordError(kind, row[0], self.get(kind, row[0]), self.version(kind, row[0]))
+        exists = self.get(kind, row[0]) is not None
+        if op == "add" and exists:
+            raise repository.IntegrityError(f"duplicate key {row[0]!r} in {kind}")
+        if op == "update" and not exists:
+            raise repository.IntegrityError(f"unknown key {row[0]!r} in {kind}")
+        if kind == "courses" and row[2] is not None and self.get("instructors", row[2]) is None:
+            raise repository.IntegrityError(f"unknown instructor {row[2]!r}")
+
+    def submit(self, op, kind, row, version=None):
+        """
+        Validates an edit and journals it; it is applied by a later flush.
+
+        :param op: ``"add"`` or ``"update"``, as the repository methods.
+        :param kind: One of :data:`repository.KINDS`.
+        :param row: The record, as for :meth:`repository.Repository.add`.
+        :param version: For an update, the version from :meth:`version` read
+                        before the record, to have it checked again when
+                        flushing; see :meth:`repository.Repository.update`.
+        :raises repository.IntegrityError: See :meth:`validate`.
+        :raises repository.StaleRecordError: See :meth:`validate`.
+        """
+        row = tuple(row)
+        self.validate(op, kind, row, version)
+        self._journal.write(json.dumps([op, kind, row, version]) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._pending.append((op, kind, row, version))
+        self._rows[kind][row[0]] = row
+        if op == "update":
+            self._updates[kind][row[0]] = self._updates[kind].get(row[0], 0) + 1
+        metrics.inc("school_write_behind_edits_total", op=op, kind=kind)
+        if len(self._pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self, recovering=False):
+        """
+        Applies the pending edits in one transaction and clears the journal.
+
+        If the repository raises anything but an integrity error, e.g. the
+        database is locked, the edits not committed yet stay pending for the
+        next flush. Each edit committed counts in ``school_crud_operations_total``.
+
+        :return: The number of edits flushed.
+        """
+        pending = self._pending
+        if not pending:
+            return 0
+        recovering = recovering or self._recovering
+        errors = []
+        # The last journaled row of each record; if it is stored, the flush a
+        # crash interrupted committed every edit of that record.
+        last = {(kind, row[0]): row for _, kind, row, _ in pending} if recovering else {}
+        with metrics.timer("school_write_behind_flush_seconds"):
+            try:
+                with self.repo.transaction():
+                    applied = [edit for edit in pending if self._apply(*edit, last)]
+            except (repository.IntegrityError, repository.StaleRecordError):
+                applied = []
+                failed = []
+                for done, edit in enumerate(pending):
+                    try:
+                        with self.repo.transaction():
+                            if self._apply(*edit, last):
+                                applied.append(edit)
+                    except (repository.IntegrityError, repository.StaleRecordError) as e:
+                        failed.append(edit)
+                        errors.append(edit[:3] + (e,))
+                    except BaseException:
+                        # Those committed already must not be applied again by the next flush.
+                        self._count(applied)
+                        self._keep(failed + pending[done:], recovering)
+                        raise
+        self._count(applied)
+        self._keep([], False)
+        metrics.inc("school_write_behind_flushes_total")
+        for error in errors:
+            if self.on_error is None:
+                raise error[-1]
+            self.on_error(*error)
+        return len(pending)
+
+    @staticmethod
+    def _count(applied):
+        for op, kind, _, _ in applied:
+            metrics.inc("school_crud_operations_total", entity=_ENTITIES[kind], op=_METRIC_OPS[op])
+
+    def _keep(self, edits, recovering):
+        """Leaves only ``edits`` pending, in memory and in the journal."""
+        self._pending = edits
+        self._recovering = recovering and bool(edits)
+        self._rows = {kind: {} for kind in repository.KINDS}
+        self._updates = {kind: {} for kind in repository.KINDS}
+        self._journal.truncate(0)
+        for op, kind, row, version in edits:
+            self._journal.write(json.dumps([op, kind, row, version]) + "\n")
+            self._rows[kind][row[0]] = row
+            if op == "update":
+                self._updates[kind][row[0]] = self._updates[kind].get(row[0], 0) + 1
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _apply(self, op, kind, row, version, last):
+        # Returns False for an edit a crash interrupted after it committed:
+        # an add or a versioned update would fail if applied again.
+        if (kind, row[0]) in last and self.repo.get(kind, row[0]) == last[kind, row[0]]:
+            return False
+        if op == "add":
+            self.repo.add(kind, row)
+        elif not self.repo.update(kind, row, version):
+            raise repository.IntegrityError(f"unknown key {row[0]!r} in {kind}")
+        return True
+
+    def close(self):
+        """Flushes the pending edits and closes the journal."""
+        try:
+            self.flush()
+        finally:
+            self._journal.close()
+
+
+def from_env(repo, journal_path, **kwargs):
+    """
+    Returns a write-behind buffer if ``SCHOOL_WRITE_BEHIND`` is set, else None.
+
+    :param repo: The repository edits are applied to, or a function
+                 returning it, only called if the buffer is enabled.
+    :param journal_path: Path of the journal, e.g. next to the database.
+    :param kwargs: Passed to :class:`WriteBehind`.
+    """
+    if os.environ.get("SCHOOL_WRITE_BEHIND", "") in ("", "0"):
+        return None
+    return WriteBehind(repo() if callable(repo) else repo, journal_path, **kwargs)